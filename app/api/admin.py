@@ -1,7 +1,6 @@
 # app/api/admin.py
 import os
 import asyncio
-import uuid
 import logging
 from typing import Optional, Any
 from datetime import datetime, timedelta, timezone
@@ -502,17 +501,8 @@ async def user_full(
     return {"user": _user(u), "payments": [_pay(p) for p in pays], "subscriptions": [_sub(x) for x in subs]}
 
 # === Summaries bridge (/api/admin/summaries/*) ===
-from sqlalchemy import text as _sql
-from app.db.core import async_session as _summ_sess
-from app.memory_summarizer import make_daily, rollup_weekly, rollup_monthly
-from app.site.summaries_api import (
-    _try_advisory_lock,
-    _run_daily_job,
-    DAILY_LOCK_KEY,
-    DAILY_BATCH_SIZE,
-    DAILY_MAX_RUNTIME_SEC,
-    DAILY_JOBS,
-)
+from app.memory_summarizer import rollup_bulk, DAILY_SUMMARIES_CONCURRENCY
+from app.site.summaries_api import start_daily_job
 
 logger = logging.getLogger(__name__)
 
@@ -523,56 +513,15 @@ def _utc() -> datetime:
 async def admin_summaries_daily():
     """
     Дневные саммари за прошедшие сутки (UTC) всем пользователям, у кого были сообщения.
+    Джоб в очереди summary_jobs: повторный вызов продолжает незавершённый.
     """
     day_utc = (_utc() - timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
-    next_day = day_utc + timedelta(days=1)
-    lock_session = _summ_sess()
-    try:
-        got_lock = await _try_advisory_lock(lock_session, DAILY_LOCK_KEY)
-        if not got_lock:
-            await lock_session.close()
-            return {"status": "already_running", "day": day_utc.isoformat()}
-    except Exception:
-        await lock_session.close()
-        logger.exception("[summaries/daily] lock check failed (admin)")
-        raise HTTPException(status_code=500, detail="lock_failed")
-
-    job_id = f"daily-{uuid.uuid4().hex[:12]}"
     try:
-        async with _summ_sess() as s:
-            uids = (await s.execute(
-                _sql("SELECT DISTINCT user_id FROM bot_messages WHERE created_at >= :st AND created_at < :en"),
-                {"st": day_utc, "en": next_day}
-            )).scalars().all()
-        user_ids = [int(x) for x in uids]
+        res = await start_daily_job(day_utc, source="admin")
     except Exception:
-        await lock_session.close()
-        logger.exception("[summaries/daily] failed to load user_ids (admin)")
-        raise HTTPException(status_code=500, detail="uids_failed")
-
-    DAILY_JOBS[job_id] = {
-        "status": "queued",
-        "queued_at": _utc().isoformat(),
-        "source": "admin",
-        "user_ids_count": len(user_ids),
-    }
-    asyncio.create_task(
-        _run_daily_job(
-            lock_session,
-            job_id=job_id,
-            target_day=day_utc,
-            user_id=None,
-            user_ids=user_ids,
-            batch_size=DAILY_BATCH_SIZE,
-            max_runtime_sec=DAILY_MAX_RUNTIME_SEC,
-        )
-    )
-    return {
-        "status": "queued",
-        "day": day_utc.isoformat(),
-        "job_id": job_id,
-        "users": len(user_ids),
-    }
+        logger.exception("[summaries/daily] enqueue failed (admin)")
+        raise HTTPException(status_code=500, detail="enqueue_failed")
+    return {**res, "day": day_utc.isoformat()}
 
 # --- WEEKLY rollup (batch) ---
 @router.post("/summaries/weekly", dependencies=[Depends(require_admin)])
@@ -598,13 +547,11 @@ async def admin_summaries_weekly(
         """), {"after_id": after_id, "limit": limit})
         uids = [int(r[0]) for r in rows]
 
-    processed = 0
     # якорная дата: вчерашняя UTC-полночь (хелпер сам возьмёт границы недели)
     week_anchor = (_utc() - timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
 
-    for uid in uids:
-        await rollup_weekly(uid, week_anchor)   # <-- ПЕРЕДАЁМ ДАТУ, НЕ СЕССИЮ
-        processed += 1
+    res = await rollup_bulk("weekly", week_anchor, user_ids=uids) if uids else None
+    processed = res["users"] if res else 0
 
     next_after = uids[-1] if len(uids) == limit else None
     return {
@@ -612,6 +559,7 @@ async def admin_summaries_weekly(
         "processed": processed,
         "batch_size": len(uids),
         "next_after_id": next_after,
+        "stats": res,
     }
 
 
@@ -639,13 +587,11 @@ async def admin_summaries_monthly(
         """), {"after_id": after_id, "limit": limit})
         uids = [int(r[0]) for r in rows]
 
-    processed = 0
     # якорная дата: вчерашняя UTC-полночь (хелпер сам возьмёт границы месяца)
     month_anchor = (_utc() - timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
 
-    for uid in uids:
-        await rollup_monthly(uid, month_anchor)  # <-- ПЕРЕДАЁМ ДАТУ, НЕ СЕССИЮ
-        processed += 1
+    res = await rollup_bulk("monthly", month_anchor, user_ids=uids) if uids else None
+    processed = res["users"] if res else 0
 
     next_after = uids[-1] if len(uids) == limit else None
     return {
@@ -653,47 +599,36 @@ async def admin_summaries_monthly(
         "processed": processed,
         "batch_size": len(uids),
         "next_after_id": next_after,
+        "stats": res,
     }
 
-# --- MONTHLY rollup (batch) ---
-@router.post("/summaries/monthly", dependencies=[Depends(require_admin)])
-async def admin_summaries_monthly(
-    _: Any = Depends(require_admin),
-    limit: int = Query(80, ge=1, le=1000),
-    after_id: int = Query(0, ge=0),
+# --- WEEKLY/MONTHLY rollup (все пользователи, с пропускной способностью) ---
+@router.post("/summaries/rollup", dependencies=[Depends(require_admin)])
+async def admin_summaries_rollup(
+    kind: str = Query("weekly", pattern="^(weekly|monthly)$"),
+    period_start: Optional[str] = Query(None, description="YYYY-MM-DD; по умолчанию прошлая неделя / прошлый месяц (UTC)"),
+    concurrency: int = Query(DAILY_SUMMARIES_CONCURRENCY, ge=1, le=64),
 ):
     """
-    Сводные monthly-итоги батчами.
-    Источники: daily/weekly за последние ~35 дней.
-    Пагинация такая же: ?limit=80&after_id=<...>
+    Пакетный роллап за период для всех пользователей с источниками:
+    один потоковый запрос, параллельные LLM-свёртки, запись пачками.
+    Возвращает счётчики, users/min, p50/p95 LLM и записи в БД.
     """
-    async with async_session() as s:
-        rows = await s.execute(text("""
-            SELECT DISTINCT user_id
-            FROM dialog_summaries
-            WHERE kind IN ('daily','weekly')
-              AND period_start >= (NOW() AT TIME ZONE 'UTC') - INTERVAL '35 days'
-              AND (:after_id = 0 OR user_id > :after_id)
-            ORDER BY user_id
-            LIMIT :limit
-        """), {"after_id": after_id, "limit": limit})
-        uids = [int(r[0]) for r in rows]
-
-    processed = 0
-    # якорная дата: вчерашняя UTC-полночь (хелпер сам возьмёт границы месяца)
-    month_anchor = (_utc() - timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
-
-    for uid in uids:
-        await rollup_monthly(uid, month_anchor)  # <-- ПЕРЕДАЁМ ДАТУ, НЕ СЕССИЮ
-        processed += 1
-
-    next_after = uids[-1] if len(uids) == limit else None
-    return {
-        "ok": True,
-        "processed": processed,
-        "batch_size": len(uids),
-        "next_after_id": next_after,
-    }
+    today = _utc().replace(hour=0, minute=0, second=0, microsecond=0)
+    if period_start:
+        try:
+            start = datetime.strptime(period_start, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+        except Exception:
+            raise HTTPException(status_code=400, detail="bad period_start, expected YYYY-MM-DD")
+    elif kind == "weekly":
+        start = today - timedelta(days=today.weekday() + 7)
+    else:
+        start = (today.replace(day=1) - timedelta(days=1)).replace(day=1)
+    try:
+        return await rollup_bulk(kind, start, concurrency=concurrency)
+    except Exception:
+        logger.exception("[summaries/rollup] failed kind=%s start=%s", kind, start.date())
+        raise HTTPException(status_code=500, detail="rollup_failed")
 
 # === Maintenance: expire overdue & charge due ===
 from fastapi import Body
@@ -53,7 +53,8 @@ except Exception:
     rag_search = None
 
 # RAG summaries (долгая память)
-from app.rag_summaries import search_summaries, delete_user_summaries
+from app.rag_summaries import search_summaries_cached, delete_user_summaries
+from app.summary_compaction import delete_user_summary_rows
 
 # БД (async)
 from sqlalchemy import text, select
@@ -75,6 +76,7 @@ from app.texts_pay import get_pay_help_text
 from app.services.access_state import get_access_state
 from app.billing.prices import plan_price_int, plan_price_stars, PLAN_PRICES_INT
 from app.services.short_reply import is_short_reply, normalize_short_reply
+from app.services.retrieval_gate import decide_retrieval, remember_context, reused_context, get_gate_stats
 
 from zoneinfo import ZoneInfo
 from collections import deque
@@ -694,6 +696,43 @@ async def _fetch_summary_texts_by_ids(ids: List[int]) -> List[dict]:
     return out
 
 
+def _parse_iso_dt(value: Any) -> Any:
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except Exception:
+            return value
+    return value
+
+
+async def _summary_items_from_hits(hits: List[dict]) -> List[dict]:
+    """
+    Хиты с текстом (из кэша/payload) берём как есть; за остальными идём в Postgres.
+    """
+    out: List[dict] = []
+    missing: List[int] = []
+    for h in hits or []:
+        sid = h.get("summary_id")
+        if sid is None:
+            continue
+        if h.get("text"):
+            out.append(
+                {
+                    "id": int(sid),
+                    "kind": h.get("kind"),
+                    "period": f"{_fmt_dt(_parse_iso_dt(h.get('period_start')))} — {_fmt_dt(_parse_iso_dt(h.get('period_end')))}",
+                    "text": h.get("text"),
+                }
+            )
+        else:
+            missing.append(int(sid))
+            out.append({"id": int(sid), "text": None})
+    if missing:
+        fetched = {it["id"]: it for it in await _fetch_summary_texts_by_ids(missing)}
+        out = [fetched.get(it["id"]) if not it.get("text") else it for it in out]
+    return [it for it in out if it]
+
+
 async def _purge_user_summaries_all(tg_id: int) -> int:
     async with async_session() as s:
         r = await s.execute(
@@ -706,15 +745,10 @@ async def _purge_user_summaries_all(tg_id: int) -> int:
             await delete_user_summaries(int(uid))
         except Exception:
             pass
-        res = await s.execute(
-            _sql_text("DELETE FROM dialog_summaries WHERE user_id = :uid"),
-            {"uid": int(uid)},
-        )
+        # вместе с архивом компакции — иначе тексты саммарей переживут очистку памяти
+        deleted = await delete_user_summary_rows(s, int(uid))
         await s.commit()
-        try:
-            return int(getattr(res, "rowcount", 0) or 0)
-        except Exception:
-            return 0
+        return deleted
 
 
 # ===== Онбординг: ссылки и картинки =====
@@ -1600,12 +1634,28 @@ async def on_diag_llm(m: Message):
     }
     lm = LAST_MEMORY_STATUS.copy()
     llm = LAST_LLM_STATUS.copy()
+    gs = get_gate_stats()
+    try:
+        from app.rag_qdrant import get_ctx_cache_stats, get_compress_stats
+        cs = get_ctx_cache_stats()
+        cps = get_compress_stats()
+    except Exception:
+        cs, cps = {}, {}
+    try:
+        from app.rag_summaries import get_summary_cache_stats
+        ss = get_summary_cache_stats()
+    except Exception:
+        ss = {}
     msg = (
         "<b>/diag_llm</b>\n"
         f"qdrant-client: {qdrant_ver} (method: {qdrant_method})\n"
         f"env: {env_state}\n"
         f"last memory: ts={lm.get('ts')} src={lm.get('source')} err={lm.get('error')} summaries={lm.get('summaries_count')} qdrant_err={lm.get('qdrant_error')}\n"
-        f"last llm: ts={llm.get('ts')} model={llm.get('meta', {}).get('model')} fallback={llm.get('meta', {}).get('fallback_used')} status={llm.get('meta', {}).get('status')} err={llm.get('error') or llm.get('meta', {}).get('error')}"
+        f"last llm: ts={llm.get('ts')} model={llm.get('meta', {}).get('model')} fallback={llm.get('meta', {}).get('fallback_used')} status={llm.get('meta', {}).get('status')} err={llm.get('error') or llm.get('meta', {}).get('error')}\n"
+        f"rag gate: turns={gs.get('turns')} rag_skipped={gs.get('rag_skipped')} summaries_skipped={gs.get('summaries_skipped')} reused={gs.get('reused')} skip_rate={gs.get('rag_skip_rate')}\n"
+        f"rag cache: size={cs.get('size')} hit_rate={cs.get('hit_rate')} hits={cs.get('hits')} misses={cs.get('misses')} saved_ms_per_hit={cs.get('saved_ms_per_hit')} corpus={cs.get('corpus_version')}\n"
+        f"rag compress: calls={cps.get('calls')} cache_hits={cps.get('cache_hits')} timeouts={cps.get('timeouts')} errors={cps.get('errors')} p50_ms={cps.get('latency_ms_p50')} p95_ms={cps.get('latency_ms_p95')} tokens_saved={cps.get('tokens_saved')}\n"
+        f"summary cache: users={ss.get('users')} bytes={ss.get('bytes')} hit_rate={ss.get('hit_rate')} empty_hits={ss.get('empty_hits')} evicted={ss.get('evicted')}"
     )
     await m.answer(msg)
 
@@ -1705,8 +1755,18 @@ async def _answer_with_llm(m: Message, user_text: str):
     if len_hint:
         sys_prompt += "\n\n" + len_hint
 
+    # Гейт ретрива: на фатических/коротких репликах не тратим эмбеддинг и запросы в Qdrant
+    gate = decide_retrieval(user_text, chat_id=chat_id)
+    if gate["reuse"]:
+        prev_ctx = reused_context(chat_id)
+    else:
+        prev_ctx = {"rag_ctx": "", "sum_block": ""}
+    logger.debug("[rag-gate] chat_id=%s decision=%s", chat_id, gate)
+
     rag_ctx = ""
-    if rag_search is not None:
+    if not gate["rag"]:
+        rag_ctx = prev_ctx["rag_ctx"]
+    elif rag_search is not None:
         try:
             qlen = len((user_text or "").split())
             k = 3 if qlen < 8 else 6 if qlen < 20 else 8
@@ -1719,26 +1779,31 @@ async def _answer_with_llm(m: Message, user_text: str):
             rag_ctx = ""
 
     sum_block = ""
-    try:
-        uid = await _ensure_user_id(m.from_user.id)
-        hits = await search_summaries(user_id=uid, query=user_text, top_k=4)
-        ids = [int(h.get("summary_id")) for h in (hits or []) if str(h.get("summary_id", "")).isdigit()]
-        items = await _fetch_summary_texts_by_ids(ids)
-        if items:
-            def _short(s: str, n: int = 260) -> str:
-                s = (s or "").strip().replace("\r", " ").replace("\n", " ")
-                return s if len(s) <= n else (s[: n - 1] + "…")
-            lines = [f"• [{it['period']}] {_short(it.get('text', ''))}" for it in items]
-            sum_text = "\n".join(lines).strip()
-            MAX_SUMMARY_BLOCK = 900
-            if len(sum_text) > MAX_SUMMARY_BLOCK:
-                sum_text = sum_text[: MAX_SUMMARY_BLOCK - 1] + "…"
-            sum_block = "Заметки из прошлых разговоров (учитывай по мере уместности):\n" + sum_text
-        _record_memory_status(error=None, source="summaries", summaries_count=len(items), qdrant_error=None)
-    except Exception as e:
-        print(f"[memory] summaries error: {e!r}")
-        _record_memory_status(error=str(e), source="summaries", summaries_count=0, qdrant_error=str(e))
-        sum_block = ""
+    if not gate["summaries"]:
+        sum_block = prev_ctx["sum_block"]
+    else:
+        try:
+            uid = await _ensure_user_id(m.from_user.id)
+            hits = await search_summaries_cached(user_id=uid, query=user_text, top_k=4)
+            items = await _summary_items_from_hits(hits)
+            if items:
+                def _short(s: str, n: int = 260) -> str:
+                    s = (s or "").strip().replace("\r", " ").replace("\n", " ")
+                    return s if len(s) <= n else (s[: n - 1] + "…")
+                lines = [f"• [{it['period']}] {_short(it.get('text', ''))}" for it in items]
+                sum_text = "\n".join(lines).strip()
+                MAX_SUMMARY_BLOCK = 900
+                if len(sum_text) > MAX_SUMMARY_BLOCK:
+                    sum_text = sum_text[: MAX_SUMMARY_BLOCK - 1] + "…"
+                sum_block = "Заметки из прошлых разговоров (учитывай по мере уместности):\n" + sum_text
+            _record_memory_status(error=None, source="summaries", summaries_count=len(items), qdrant_error=None)
+        except Exception as e:
+            print(f"[memory] summaries error: {e!r}")
+            _record_memory_status(error=str(e), source="summaries", summaries_count=0, qdrant_error=str(e))
+            sum_block = ""
+
+    if gate["rag"] or gate["summaries"]:
+        remember_context(chat_id, query=user_text, rag_ctx=rag_ctx, sum_block=sum_block)
 
     messages: List[Dict[str, str]] = [{"role": "system", "content": sys_prompt}]
     if rag_ctx:
@@ -1787,7 +1852,7 @@ async def _answer_with_llm(m: Message, user_text: str):
     seed = f"{user_text_for_llm}|{turn_idx}|{salt}"
     temp = 0.66 + (abs(hash(seed)) % 17) / 100.0  # 0.66–0.82
     LLM_MAX_TOKENS = 480
-    trace_info: Dict[str, Any] = {"route": "talk", "mode": mode, "user_id": m.from_user.id}
+    trace_info: Dict[str, Any] = {"route": "talk", "mode": mode, "user_id": m.from_user.id, "retrieval_gate": dict(gate)}
     try:
         reply = await chat_with_style(
             messages=messages,
@@ -1815,7 +1880,7 @@ async def _answer_with_llm(m: Message, user_text: str):
     try:
         if trace_info:
             import logging  # Render highlights ERROR as red
-            msg = f"[llm] route={trace_info.get('route')} model={trace_info.get('model')} fallback={trace_info.get('fallback_used')} status={trace_info.get('status')} latency_ms={trace_info.get('latency_ms')} err={trace_info.get('error')}"
+            msg = f"[llm] route={trace_info.get('route')} model={trace_info.get('model')} fallback={trace_info.get('fallback_used')} status={trace_info.get('status')} latency_ms={trace_info.get('latency_ms')} gate={(trace_info.get('retrieval_gate') or {}).get('reason')} err={trace_info.get('error')}"
             if trace_info.get("status") == "ok" and not trace_info.get("error"):
                 logging.info(msg)
             else:
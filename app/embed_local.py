@@ -0,0 +1,256 @@
+# app/embed_local.py
+# -*- coding: utf-8 -*-
+"""
+Локальные эмбеддинги на CPU (sentence-transformers), без сетевых round-trip'ов.
+
+- модель грузится один раз на процесс (лениво, при первом запросе, не при импорте);
+- одиночные запросы из разных корутин склеиваются в батч (окно LOCAL_EMBED_BATCH_WAIT_MS);
+- кодирование идёт в отдельном потоке или, при LOCAL_EMBED_PROCS>0, в пуле процессов
+  (у каждого воркера своя тёплая модель) — event loop не блокируется;
+- LOCAL_EMBED_BACKEND: torch | onnx | onnx-int8 (ONNX Runtime, динамически квантованная модель).
+
+ENV:
+- SBERT_MODEL                 — имя модели (по умолчанию sentence-transformers/all-MiniLM-L6-v2,
+                                как и прежний SBERT-путь: коллекции построены этой моделью)
+- LOCAL_EMBED_BACKEND         — torch | onnx | onnx-int8 (по умолчанию torch)
+- LOCAL_EMBED_ONNX_FILE       — файл квантованной модели внутри репозитория модели
+- LOCAL_EMBED_BATCH_SIZE      — максимум текстов в одном encode (32)
+- LOCAL_EMBED_BATCH_WAIT_MS   — сколько ждать попутчиков в батч (5)
+- LOCAL_EMBED_PROCS           — размер пула процессов (0 = поток в текущем процессе)
+- LOCAL_EMBED_THREADS         — torch/onnx потоки на воркер (0 = по умолчанию библиотеки)
+- LOCAL_EMBED_NORMALIZE       — нормировать векторы (0, как прежний SBERT-путь)
+
+Смена SBERT_MODEL или LOCAL_EMBED_NORMALIZE требует переэмбеддить коллекции: размерность у многих
+моделей одна (384), ошибки не будет, но запросы пойдут в векторы другой модели.
+Префиксы "query: "/"passage: " (семейство e5) не добавляются — такие модели сюда не подходят.
+"""
+from __future__ import annotations
+
+import os
+import asyncio
+import logging
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SBERT_MODEL = os.getenv("SBERT_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+LOCAL_EMBED_BACKEND = (os.getenv("LOCAL_EMBED_BACKEND", "torch") or "torch").strip().lower()
+LOCAL_EMBED_ONNX_FILE = os.getenv("LOCAL_EMBED_ONNX_FILE", "onnx/model_qint8_avx512_vnni.onnx")
+LOCAL_EMBED_BATCH_SIZE = max(1, int(os.getenv("LOCAL_EMBED_BATCH_SIZE", "32") or "32"))
+LOCAL_EMBED_BATCH_WAIT_MS = float(os.getenv("LOCAL_EMBED_BATCH_WAIT_MS", "5") or "5")
+LOCAL_EMBED_PROCS = max(0, int(os.getenv("LOCAL_EMBED_PROCS", "0") or "0"))
+LOCAL_EMBED_THREADS = max(0, int(os.getenv("LOCAL_EMBED_THREADS", "0") or "0"))
+LOCAL_EMBED_NORMALIZE = os.getenv("LOCAL_EMBED_NORMALIZE", "0") == "1"
+
+# --- Модель (одна на процесс)
+_MODEL: Any = None
+_MODEL_LOCK = threading.Lock()
+_MODEL_INFO: Dict[str, Any] = {}
+
+
+def _load_model(model_name: str, backend: str) -> Any:
+    from sentence_transformers import SentenceTransformer  # type: ignore
+
+    if "e5" in model_name.lower().split("/")[-1].split("-"):
+        logger.warning("[embed_local] %s expects query:/passage: prefixes, they are not added", model_name)
+
+    if LOCAL_EMBED_THREADS:
+        try:
+            import torch  # type: ignore
+            torch.set_num_threads(LOCAL_EMBED_THREADS)
+        except Exception:
+            pass
+
+    if backend in ("onnx", "onnx-int8"):
+        kwargs: Dict[str, Any] = {}
+        if backend == "onnx-int8":
+            kwargs["model_kwargs"] = {"file_name": LOCAL_EMBED_ONNX_FILE}
+        try:
+            m = SentenceTransformer(model_name, backend="onnx", **kwargs)
+            _MODEL_INFO.update({"backend": backend, "model": model_name})
+            return m
+        except Exception as e:
+            # старый sentence-transformers / нет onnxruntime / нет квантованного файла
+            logger.warning("[embed_local] backend=%s unavailable (%r) — fallback to torch", backend, e)
+
+    m = SentenceTransformer(model_name)
+    _MODEL_INFO.update({"backend": "torch", "model": model_name})
+    return m
+
+
+def get_model() -> Any:
+    global _MODEL
+    if _MODEL is None:
+        with _MODEL_LOCK:
+            if _MODEL is None:
+                _MODEL = _load_model(SBERT_MODEL, LOCAL_EMBED_BACKEND)
+    return _MODEL
+
+
+def encode_sync(texts: List[str]) -> List[List[float]]:
+    """
+    Синхронное кодирование в текущем процессе (модель грузится при первом вызове).
+    """
+    if not texts:
+        return []
+    model = get_model()
+    embs = model.encode(
+        list(texts),
+        batch_size=LOCAL_EMBED_BATCH_SIZE,
+        convert_to_numpy=True,
+        normalize_embeddings=LOCAL_EMBED_NORMALIZE,
+        show_progress_bar=False,
+    )
+    return embs.tolist()
+
+
+def _worker_init() -> None:
+    # прогреваем модель в воркере сразу, чтобы первый запрос не платил за загрузку
+    get_model()
+
+
+class LocalEmbedder:
+    """
+    Асинхронный фронт к локальной модели: склеивает одиночные запросы в батчи
+    и выполняет encode вне event loop (поток или пул процессов).
+    """
+
+    def __init__(
+        self,
+        *,
+        batch_size: int = LOCAL_EMBED_BATCH_SIZE,
+        batch_wait_ms: float = LOCAL_EMBED_BATCH_WAIT_MS,
+        procs: int = LOCAL_EMBED_PROCS,
+        encode_fn: Any = None,
+    ):
+        self.batch_size = max(1, int(batch_size))
+        self.batch_wait = max(0.0, float(batch_wait_ms)) / 1000.0
+        self.procs = max(0, int(procs))
+        self._encode = encode_fn or encode_sync
+        self._executor: Optional[Executor] = None
+        self._queue: Optional["asyncio.Queue[Tuple[str, asyncio.Future]]"] = None
+        self._runner: Optional["asyncio.Task[None]"] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.stats: Dict[str, Any] = {"requests": 0, "batches": 0, "texts": 0, "max_batch": 0}
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.procs > 0:
+                self._executor = ProcessPoolExecutor(max_workers=self.procs, initializer=_worker_init)
+            else:
+                # один поток: модель не потокобезопасна для параллельных encode, батчинг даёт своё
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed-local")
+        return self._executor
+
+    def _ensure_runner(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._runner is None or self._runner.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._runner = loop.create_task(self._run())
+
+    async def _run(self) -> None:
+        assert self._queue is not None
+        q = self._queue
+        loop = asyncio.get_running_loop()
+        while True:
+            first = await q.get()
+            batch = [first]
+            deadline = loop.time() + self.batch_wait
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    # окно истекло — забираем то, что уже лежит в очереди, без ожидания
+                    try:
+                        batch.append(q.get_nowait())
+                        continue
+                    except asyncio.QueueEmpty:
+                        break
+                try:
+                    batch.append(await asyncio.wait_for(q.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            texts = [t for t, _ in batch]
+            self.stats["batches"] += 1
+            self.stats["texts"] += len(texts)
+            self.stats["max_batch"] = max(self.stats["max_batch"], len(texts))
+            try:
+                vecs = await loop.run_in_executor(self._get_executor(), self._encode, texts)
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            for (_, fut), vec in zip(batch, vecs):
+                if not fut.done():
+                    fut.set_result(vec)
+
+    async def aembed(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        self._ensure_runner()
+        assert self._queue is not None
+        loop = asyncio.get_running_loop()
+        futs = []
+        for t in texts:
+            fut = loop.create_future()
+            await self._queue.put((t, fut))
+            futs.append(fut)
+        self.stats["requests"] += 1
+        return list(await asyncio.gather(*futs))
+
+    def warmup(self) -> None:
+        """
+        Загружает модель заранее (в пуле — во всех воркерах через initializer).
+        """
+        if self.procs > 0:
+            ex = self._get_executor()
+            list(ex.map(encode_sync, [["warmup"]] * self.procs))
+        else:
+            encode_sync(["warmup"])
+
+    def close(self) -> None:
+        if self._runner is not None:
+            self._runner.cancel()
+            self._runner = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+_LOCAL: Optional[LocalEmbedder] = None
+
+
+def get_local_embedder() -> LocalEmbedder:
+    global _LOCAL
+    if _LOCAL is None:
+        _LOCAL = LocalEmbedder()
+    return _LOCAL
+
+
+def local_embed_available() -> bool:
+    try:
+        import importlib.util
+        return importlib.util.find_spec("sentence_transformers") is not None
+    except Exception:
+        return False
+
+
+def get_local_embed_stats() -> Dict[str, Any]:
+    out: Dict[str, Any] = dict(_LOCAL.stats) if _LOCAL is not None else {}
+    out.update(_MODEL_INFO)
+    if out.get("batches"):
+        out["avg_batch"] = round(out["texts"] / out["batches"], 2)
+    return out
+
+
+__all__ = [
+    "LocalEmbedder",
+    "get_local_embedder",
+    "encode_sync",
+    "local_embed_available",
+    "get_local_embed_stats",
+]
@@ -1,25 +1,19 @@
 # app/maintenance.py
 from __future__ import annotations
 
+import time
 import asyncio
 from datetime import datetime, timedelta, timezone
-from typing import List
+from typing import Optional
 
 import click
 from sqlalchemy import text as sql
 
 from app.db.core import async_session
-from app.memory_summarizer import make_daily, rollup_weekly, rollup_monthly
-from app.rag_summaries import delete_user_summaries
-
-
-# ------------------------
-# Вспомогательные утилиты
-# ------------------------
-
-async def _all_user_ids() -> List[int]:
-    async with async_session() as s:
-        return list((await s.execute(sql("SELECT id FROM users ORDER BY id"))).scalars().all())
+from app.memory_summarizer import plan_daily_candidates, run_daily_pool, rollup_bulk, DAILY_SUMMARIES_CONCURRENCY
+from app.summary_jobs import run_job_worker, job_status, recent_jobs
+from app.summary_compaction import run_compaction, delete_user_summary_rows, SUMMARY_RETENTION
+from app.rag_summaries import delete_user_summaries, backfill_summary_payloads, migrate_summaries_collection, SummaryBatch
 
 
 # ------------------------
@@ -53,49 +47,54 @@ async def expire_subscriptions_now() -> int:
 async def _run_daily(yesterday: bool) -> None:
     # за «вчера» по UTC — как в админ-эндпоинте
     day = (datetime.now(timezone.utc) - timedelta(days=1)) if yesterday else datetime.now(timezone.utc)
-    uids = await _all_user_ids()
-
-    for uid in uids:
-        # privacy guard
-        async with async_session() as s:
-            pr = (await s.execute(sql("SELECT privacy_level FROM users WHERE id=:uid"), {"uid": uid})).scalar_one_or_none()
-        if pr == "none":
-            continue
-        await make_daily(uid, day)
-
-
-async def _run_weekly(week_start_utc: str | None) -> None:
+    # только активные за сутки и privacy != none (без запроса на каждого пользователя)
+    candidates = await plan_daily_candidates(day)
+    counters: dict = {}
+    # точки пишутся пачками, финальный сброс — внутри run_daily_pool
+    res = await run_daily_pool(
+        [c["user_id"] for c in candidates], day, batch=SummaryBatch(), counters=counters, privacy_checked=True
+    )
+    print(
+        f"daily: candidates={len(candidates)} users={res['users']} written={counters['summaries_written']} "
+        f"errors={counters['errors']} index_errors={counters['index_errors']} "
+        f"wall={res['wall_sec']}s user_ms={res['user_ms']}"
+    )
+
+
+def _print_rollup(res: dict) -> None:
+    print(
+        f"{res['kind']}: period={res['period_start'][:10]} status={res['status']} users={res['users']} "
+        f"written={res['written']} empty={res['empty']} errors={res['errors']} rate_limited={res['rate_limited']} "
+        f"index_errors={res['index_errors']} "
+        f"wall={res['wall_sec']}s users/min={res['users_per_min']} llm_ms={res['llm_ms']} "
+        f"db_writes={res['db_writes']} write_ms={res['write_ms']} qdrant={res['qdrant']}"
+    )
+
+
+async def _run_weekly(week_start_utc: str | None, concurrency: int = DAILY_SUMMARIES_CONCURRENCY) -> None:
     if week_start_utc:
         start = datetime.fromisoformat(week_start_utc).replace(tzinfo=timezone.utc)
     else:
         now = datetime.now(timezone.utc)
         start = (now - timedelta(days=now.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
 
-    uids = await _all_user_ids()
-    # один сеанс на батч
-    async with async_session() as s:
-        for uid in uids:
-            # ВАЖНО: передаём session вторым аргументом
-            await rollup_weekly(uid, s, start)
+    # все пользователи с daily за неделю — одним потоковым запросом, свёртки параллельно
+    _print_rollup(await rollup_bulk("weekly", start, concurrency=concurrency))
 
 
-async def _run_monthly(month_start_utc: str | None) -> None:
+async def _run_monthly(month_start_utc: str | None, concurrency: int = DAILY_SUMMARIES_CONCURRENCY) -> None:
     if month_start_utc:
         start = datetime.fromisoformat(month_start_utc).replace(tzinfo=timezone.utc)
     else:
         now = datetime.now(timezone.utc)
         start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
 
-    uids = await _all_user_ids()
-    async with async_session() as s:
-        for uid in uids:
-            # ВАЖНО: передаём session вторым аргументом
-            await rollup_monthly(uid, s, start)
+    _print_rollup(await rollup_bulk("monthly", start, concurrency=concurrency))
 
 
 async def _run_purge_user(user_id: int) -> None:
     async with async_session() as s:
-        await s.execute(sql("DELETE FROM dialog_summaries WHERE user_id=:uid"), {"uid": user_id})
+        await delete_user_summary_rows(s, user_id)
         await s.commit()
     await delete_user_summaries(user_id)
 
@@ -119,16 +118,61 @@ def cmd_daily(yesterday: bool) -> None:
 
 @cli.command("weekly")
 @click.option("--week-start-utc", required=False, help="YYYY-MM-DD (понедельник UTC)")
-def cmd_weekly(week_start_utc: str | None) -> None:
+@click.option("--concurrency", type=int, default=DAILY_SUMMARIES_CONCURRENCY, show_default=True)
+def cmd_weekly(week_start_utc: str | None, concurrency: int) -> None:
     """Собрать weekly-саммари (роллап из daily) для всех пользователей."""
-    asyncio.run(_run_weekly(week_start_utc))
+    asyncio.run(_run_weekly(week_start_utc, concurrency))
 
 
 @cli.command("topic")
 @click.option("--month-start-utc", required=False, help="YYYY-MM-01 UTC")
-def cmd_topic(month_start_utc: str | None) -> None:
-    """Собрать topic (месячные тематические) саммари для всех пользователей."""
-    asyncio.run(_run_monthly(month_start_utc))
+@click.option("--concurrency", type=int, default=DAILY_SUMMARIES_CONCURRENCY, show_default=True)
+def cmd_topic(month_start_utc: str | None, concurrency: int) -> None:
+    """Собрать monthly-саммари (роллап из weekly/daily) для всех пользователей."""
+    asyncio.run(_run_monthly(month_start_utc, concurrency))
+
+
+@cli.command("summary-job-worker")
+@click.option("--job-id", required=False, help="Джоб из summary_jobs; без него — последний активный")
+@click.option("--concurrency", type=int, default=DAILY_SUMMARIES_CONCURRENCY, show_default=True)
+@click.option("--max-runtime", type=float, default=0.0, show_default=True, help="Сек; 0 — до конца очереди")
+def cmd_summary_job_worker(job_id: Optional[str], concurrency: int, max_runtime: float) -> None:
+    """Подключиться воркером к джобу саммарей в очереди (можно на нескольких машинах)."""
+    async def _run() -> None:
+        jid = job_id
+        if not jid:
+            active = [j for j in await recent_jobs() if j["status"] in ("queued", "running")]
+            if not active:
+                print("Нет активных джобов")
+                return
+            jid = active[0]["id"]
+        deadline = time.monotonic() + max_runtime if max_runtime > 0 else None
+        res = await run_job_worker(jid, concurrency=concurrency, deadline=deadline)
+        print(f"Worker: {res}")
+        print(f"Job: {await job_status(jid)}")
+    asyncio.run(_run())
+
+
+@cli.command("compact-summaries")
+@click.option("--daily-days", type=int, default=None, help=f"Хранить daily, дней (по умолчанию {SUMMARY_RETENTION['daily']}; 0 — не трогать)")
+@click.option("--weekly-days", type=int, default=None, help=f"Хранить weekly, дней (по умолчанию {SUMMARY_RETENTION['weekly']}; 0 — не трогать)")
+@click.option("--user-id", "user_ids", type=int, multiple=True, help="Только эти пользователи (можно несколько)")
+@click.option("--dry-run", is_flag=True, default=False, help="Только посчитать, ничего не удалять")
+@click.option("--top", type=int, default=20, show_default=True, help="Сколько пользователей показать в отчёте")
+def cmd_compact_summaries(
+    daily_days: Optional[int], weekly_days: Optional[int], user_ids: tuple, dry_run: bool, top: int
+) -> None:
+    """Свернуть старые daily/weekly, покрытые monthly: убрать из Qdrant и БД, копия — в архив."""
+    retention = dict(SUMMARY_RETENTION)
+    if daily_days is not None:
+        retention["daily"] = daily_days
+    if weekly_days is not None:
+        retention["weekly"] = weekly_days
+    res = asyncio.run(run_compaction(retention=retention, user_ids=list(user_ids) or None, dry_run=dry_run))
+    per_user = res.pop("per_user")
+    print(f"Compaction: {res}")
+    for row in per_user[:top]:
+        print(f"  user={row['user_id']} daily={row['daily']} weekly={row['weekly']} total={row['total']}")
 
 
 @cli.command("purge-user")
@@ -138,6 +182,45 @@ def cmd_purge_user(user_id: int) -> None:
     asyncio.run(_run_purge_user(user_id))
 
 
+@cli.command("backfill-summary-payloads")
+@click.option("--batch", type=int, default=256, show_default=True, help="Размер страницы scroll")
+@click.option("--dry-run", is_flag=True, default=False, help="Только посчитать, ничего не писать")
+def cmd_backfill_summary_payloads(batch: int, dry_run: bool) -> None:
+    """Дописать текст саммари (payload.raw) в старые точки Qdrant из dialog_summaries."""
+    stats = asyncio.run(backfill_summary_payloads(batch=batch, dry_run=dry_run))
+    print(f"Backfill: {stats}")
+
+
+@cli.command("migrate-summaries-collection")
+@click.option("--target", required=True, help="Имя новой коллекции")
+@click.option("--layout", type=click.Choice(["tenant", "default"]), default="tenant", show_default=True)
+@click.option("--shards", type=int, default=0, show_default=True, help="Кол-во shard key (custom sharding), 0 — без шардирования")
+@click.option("--batch", type=int, default=256, show_default=True, help="Размер страницы scroll/upsert")
+@click.option("--dry-run", is_flag=True, default=False, help="Только посчитать, ничего не писать")
+def cmd_migrate_summaries_collection(target: str, layout: str, shards: int, batch: int, dry_run: bool) -> None:
+    """Перенести саммари в новую коллекцию с tenant-раскладкой (векторы без переэмбеддинга)."""
+    stats = asyncio.run(migrate_summaries_collection(target=target, layout=layout, shards=shards, batch=batch, dry_run=dry_run))
+    print(f"Migrate: {stats}")
+    if not dry_run:
+        print(
+            f"Дальше: QDRANT_SUMMARIES_COLLECTION={target} QDRANT_SUMMARIES_LAYOUT={layout} "
+            f"QDRANT_SUMMARIES_SHARD_KEYS={shards} и перезапуск процессов."
+        )
+
+
+@cli.command("apply-collection-profile")
+@click.option("--profile", "profile", type=click.Choice(["default", "scalar", "scalar-disk", "binary"]), required=True)
+@click.option("--collection", default=None, help="По умолчанию — QDRANT_COLLECTION")
+@click.option("--dry-run", is_flag=True, default=False, help="Только показать разницу с текущей конфигурацией")
+def cmd_apply_collection_profile(profile: str, collection: Optional[str], dry_run: bool) -> None:
+    """Перевести коллекцию на профиль квантования/HNSW без пересоздания."""
+    from app.qdrant_client import get_client, apply_collection_profile, QDRANT_COLLECTION
+    res = apply_collection_profile(get_client(), collection or QDRANT_COLLECTION, profile, dry_run=dry_run)
+    print(f"Profile: {res}")
+    if res["applied"]:
+        print(f"Для поиска: QDRANT_CORPUS_PROFILE={profile} (hnsw_ef/oversampling профиля) и перезапуск процессов.")
+
+
 @cli.command("expire-subscriptions")
 def cmd_expire_subscriptions() -> None:
     """Перевести просроченные активные подписки в expired."""
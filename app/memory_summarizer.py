@@ -1,16 +1,26 @@
 # app/memory_summarizer.py
 from __future__ import annotations
-from typing import List, Dict, Optional, Tuple
+from typing import Any, AsyncIterator, Deque, Iterable, List, Dict, Optional, Tuple, Union
+from collections import deque
 from datetime import datetime, timedelta, timezone
+import os
+import time
+import asyncio
 
 from sqlalchemy import text as sql
 from app.db.core import async_session
 
 # Qdrant: сохраняем/чистим саммари как векторные документы
-from app.rag_summaries import upsert_summary_point, delete_user_summaries
+from app.rag_summaries import upsert_summary_point, delete_user_summaries, SummaryBatch
 
 # LLM-адаптер (OpenAI-совместимый)
 from app.llm_adapter import complete_chat  # complete_chat(messages=[...], ...)
+from app.services.rate_limit import get_bucket, is_rate_limit_error
+from app.services.message_filter import MessageFilter
+from app.services.stage_metrics import SUMMARY_METRICS
+
+# Сколько пользователей суммаризируем одновременно в батч-джобе
+DAILY_SUMMARIES_CONCURRENCY = max(1, int(os.getenv("DAILY_SUMMARIES_CONCURRENCY", "8") or "8"))
 
 
 # === Вспомогательные утилиты ===
@@ -46,6 +56,51 @@ def _utc_month_bounds(month_start_utc: datetime) -> Tuple[datetime, datetime]:
     return start, end
 
 
+async def _store_point(batch: Optional[SummaryBatch], **point) -> None:
+    """
+    Батч-джобы передают SummaryBatch — точка уходит в пакетный upsert; иначе пишем сразу.
+    """
+    if batch is not None:
+        await batch.add(**point)
+    else:
+        await upsert_summary_point(**point)
+
+
+def _outcome(trace: Optional[Dict[str, Any]], kind: str, outcome: str) -> None:
+    """Исход задачи саммари: в trace вызывающего и в счётчики SUMMARY_METRICS (daily_written, ...)."""
+    if trace is not None:
+        trace["outcome"] = outcome
+    SUMMARY_METRICS.incr(f"{kind}_{outcome}")
+
+
+async def _complete_limited(msgs: List[Dict], *, max_completion_tokens: int) -> Optional[str]:
+    """
+    complete_chat через общий bucket "llm" (SUMMARY_LLM_RPM): параллельные воркеры
+    не превышают лимит провайдера, 429 замедляет всех.
+    """
+    bucket = get_bucket("llm")
+    SUMMARY_METRICS.observe("llm_wait", await bucket.acquire() * 1000.0)
+    SUMMARY_METRICS.incr("llm_calls")
+    SUMMARY_METRICS.incr("llm_prompt_tokens", sum(estimate_tokens(m.get("content") or "") for m in msgs))
+    try:
+        with SUMMARY_METRICS.time("llm"):
+            try:
+                out = await complete_chat(messages=msgs, temperature=0.2, max_completion_tokens=max_completion_tokens)
+            except TypeError:
+                # На случай старой сигнатуры complete_chat
+                out = await complete_chat(msgs, temperature=0.2, max_completion_tokens=max_completion_tokens)
+    except Exception as e:
+        if is_rate_limit_error(e):
+            bucket.on_rate_limit()
+            SUMMARY_METRICS.incr("llm_rate_limited")
+        else:
+            SUMMARY_METRICS.incr("llm_errors")
+        raise
+    bucket.on_success()
+    SUMMARY_METRICS.incr("llm_completion_tokens", estimate_tokens(out or ""))
+    return out
+
+
 # === Системный промпт суммаризации ===
 
 SUMMARY_SYSTEM = (
@@ -55,121 +110,498 @@ SUMMARY_SYSTEM = (
 )
 
 
+SUMMARY_UPDATE_SYSTEM = (
+    "Ты обновляешь уже готовое саммари диалога за день по новым сообщениям.\n"
+    "Сохрани структуру: 1) Контекст и темы; 2) Важные выводы; 3) Договорённости/шаги; 4) Триггеры/предупреждения (если есть).\n"
+    "Добавь новое, поправь устаревшее, ничего важного из прежнего саммари не теряй. "
+    "Пиши на русском, без советов сверх фактов разговора. 150–250 слов. Верни только обновлённое саммари."
+)
+
+SUMMARY_MAP_SYSTEM = (
+    "Ты сжимаешь фрагмент длинного разговора (часть одного дня) в заметки для последующего общего саммари.\n"
+    "5–10 коротких пунктов: темы, факты, выводы, договорённости, тревожные сигналы. "
+    "Только то, что есть во фрагменте, на русском."
+)
+
+# Map-reduce для длинных периодов: auto | single | mapreduce
+SUMMARY_MODE = (os.getenv("SUMMARY_MODE", "auto") or "auto").strip().lower()
+# Порог (оценка токенов источника), выше которого auto переключается на map-reduce
+SUMMARY_SINGLE_SHOT_MAX_TOKENS = int(os.getenv("SUMMARY_SINGLE_SHOT_MAX_TOKENS", "6000") or "6000")
+# Целевой размер куска и параллелизм map-стадии
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "3000") or "3000")
+SUMMARY_MAP_CONCURRENCY = max(1, int(os.getenv("SUMMARY_MAP_CONCURRENCY", "4") or "4"))
+SUMMARY_MAP_OUT_TOKENS = int(os.getenv("SUMMARY_MAP_OUT_TOKENS", "350") or "350")
+
+SUMMARIZE_STATS: Dict[str, Dict[str, Any]] = {}
+
+# Инкрементальный daily: при повторном запуске за тот же день дописываем только новые сообщения
+SUMMARY_INCREMENTAL = os.getenv("SUMMARY_INCREMENTAL", "1") == "1"
+# Если новых сообщений больше — дешевле и точнее пересобрать день целиком
+SUMMARY_INCREMENTAL_MAX_NEW = int(os.getenv("SUMMARY_INCREMENTAL_MAX_NEW", "300") or "300")
+
+
+# Фильтр сообщений перед суммаризацией (app/services/message_filter.py)
+SUMMARY_FILTER = os.getenv("SUMMARY_FILTER", "1") == "1"
+SUMMARY_BOT_REPLY_MAX_CHARS = int(os.getenv("SUMMARY_BOT_REPLY_MAX_CHARS", "1200") or "1200")
+# Доп. тексты кнопок через запятую (к встроенным из DEFAULT_MENU_TEXTS)
+SUMMARY_MENU_TEXTS = [t for t in (os.getenv("SUMMARY_MENU_TEXTS", "") or "").split(",") if t.strip()]
+
+FILTER_STATS: Dict[str, int] = {}
+FILTER_RECENT: Deque[Dict[str, Any]] = deque(maxlen=200)
+
+
 # === Доступ к исходным сообщениям за период ===
 
-async def _fetch_raw_messages(user_id: int, start: datetime, end: datetime) -> List[Dict]:
+async def _fetch_raw_messages(
+    user_id: int,
+    start: datetime,
+    end: datetime,
+    *,
+    after_id: Optional[int] = None,
+    report: Optional[Dict[str, Any]] = None,
+) -> List[Dict]:
     """
-    Возвращает список {role, text} из bot_messages за [start, end).
-    Роли исходные (user/bot).
+    Возвращает список {id, role, text} из bot_messages за [start, end).
+    Роли исходные (user/bot). after_id — только сообщения новее чекпоинта.
+    Строки читаются курсором и сразу проходят MessageFilter (SUMMARY_FILTER=0 — без фильтра):
+    без [cb]-логов, команд, кнопок меню и дублей, длинные ответы бота обрезаны.
+    report — сюда пишется отчёт фильтра (токены до/после).
     """
+    flt = MessageFilter(
+        bot_max_chars=SUMMARY_BOT_REPLY_MAX_CHARS,
+        menu_texts=SUMMARY_MENU_TEXTS,
+        count_tokens=estimate_tokens,
+    ) if SUMMARY_FILTER else None
+    out: List[Dict] = []
     async with async_session() as s:
-        rows = (await s.execute(sql("""
-            SELECT role, text
+        res = await s.stream(sql("""
+            SELECT id, role, text
             FROM bot_messages
             WHERE user_id = :uid
               AND created_at >= :st
               AND created_at <  :en
-            ORDER BY created_at ASC
-        """), {"uid": user_id, "st": start, "en": end})).mappings().all()
-    return [{"role": r["role"], "text": r["text"]} for r in rows]
+              AND (CAST(:after AS BIGINT) IS NULL OR id > :after)
+            ORDER BY created_at ASC, id ASC
+        """), {"uid": user_id, "st": start, "en": end, "after": after_id})
+        async for r in res.mappings():
+            m = {"id": int(r["id"]), "role": r["role"], "text": r["text"]}
+            if flt is not None:
+                m = flt.feed(m)
+            if m is not None:
+                out.append(m)
+    if report is not None and flt is not None:
+        report.update(flt.report())
+    return out
+
+
+def _record_filter(user_id: int, day: datetime, report: Dict[str, Any]) -> None:
+    """Экономия токенов фильтра на пользователя-день: лог + агрегат для get_filter_stats()."""
+    if not report:
+        return
+    for k in ("messages_in", "messages_out", "tokens_in", "tokens_out"):
+        FILTER_STATS[k] = FILTER_STATS.get(k, 0) + int(report.get(k, 0))
+    FILTER_STATS["user_days"] = FILTER_STATS.get("user_days", 0) + 1
+    SUMMARY_METRICS.incr("filter_tokens_in", int(report.get("tokens_in", 0)))
+    SUMMARY_METRICS.incr("filter_tokens_out", int(report.get("tokens_out", 0)))
+    entry = {"user_id": user_id, "day": day.date().isoformat(), **report}
+    FILTER_RECENT.append(entry)
+    _safe_print(
+        f"[summarizer] filter user_id={user_id} day={entry['day']} msgs={report['messages_in']}->{report['messages_out']} "
+        f"tokens={report['tokens_in']}->{report['tokens_out']} (-{report['reduction'] * 100:.0f}%)"
+    )
+
+
+def get_filter_stats() -> Dict[str, Any]:
+    out: Dict[str, Any] = dict(FILTER_STATS)
+    tin = out.get("tokens_in", 0)
+    out["reduction"] = round((tin - out.get("tokens_out", 0)) / tin, 3) if tin else 0.0
+    out["recent"] = list(FILTER_RECENT)[-20:]
+    return out
 
 
 # === Вызов LLM для суммаризации ===
 
-async def _llm_summarize(messages: List[Dict]) -> Optional[str]:
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка токенов для кириллицы (~3 символа на токен), как в rag_qdrant."""
+    return (len(text or "") + 2) // 3
+
+
+def _msg_line(m: Dict) -> str:
+    return f"{m['role']}: {m['text']}"
+
+
+def split_token_chunks(messages: List[Dict], target_tokens: int, *, min_tokens: int = 0) -> List[List[Dict]]:
     """
-    Собираем компактную выжимку. Ограничиваем объём источника и токен-лимит ответа.
+    Делит сообщения (по порядку, не разрывая реплики) на куски по ~target_tokens.
+    Размер подстраивается под объём: n = ceil(total/target) кусков одинакового веса, чтобы
+    последний кусок не оказался огрызком (min_tokens — нижняя граница размера куска).
+    Реплика длиннее бюджета обрезается до него.
     """
-    if not messages:
-        return None
+    lines: List[Tuple[Dict, int]] = []
+    for m in messages:
+        if not (m.get("text") or "").strip():
+            continue
+        tok = estimate_tokens(_msg_line(m))
+        if tok > target_tokens:
+            m = {**m, "text": m["text"][: target_tokens * 3]}
+            tok = target_tokens
+        lines.append((m, tok))
+    total = sum(t for _, t in lines)
+    if not lines:
+        return []
+    n = max(1, -(-total // max(1, target_tokens)))
+    if min_tokens > 0:
+        n = max(1, min(n, total // min_tokens))
 
-    # Safety cap по количеству сообщений, чтобы не раздуть запрос:
-    pairs = messages[-500:]  # берём последние 500 событий периода — более чем достаточно
+    # реплика уходит в кусок, куда попадает её середина на шкале накопленных токенов:
+    # ровно n кусков, объём каждого ≈ total/n ± полреплики
+    chunks: List[List[Dict]] = [[] for _ in range(n)]
+    used = 0
+    for m, tok in lines:
+        idx = min(n - 1, int((used + tok / 2.0) * n / total)) if total else 0
+        chunks[idx].append(m)
+        used += tok
+    chunks = [c for c in chunks if c]
+    return chunks
 
-    # Упрощённо конкатим в текстовый формат (для саммари это ок):
-    joined = "\n".join(f"{m['role']}: {m['text']}" for m in pairs if (m.get("text") or "").strip())
 
+async def _summarize_single(messages: List[Dict], *, cap: Optional[int] = None) -> Optional[str]:
+    pairs = messages[-cap:] if cap else messages
+    # Упрощённо конкатим в текстовый формат (для саммари это ок):
+    joined = "\n".join(_msg_line(m) for m in pairs if (m.get("text") or "").strip())
     if not joined.strip():
         return None
-
     msgs = [
         {"role": "system", "content": SUMMARY_SYSTEM},
         {"role": "user", "content": f"Сделай саммари разговора за период.\n\n{joined}"},
     ]
+    out = await _complete_limited(msgs, max_completion_tokens=700)
+    return (out or "").strip() or None
 
-    try:
-        out = await complete_chat(messages=msgs, temperature=0.2, max_completion_tokens=700)
-    except TypeError:
-        # На случай старой сигнатуры complete_chat
-        out = await complete_chat(msgs, temperature=0.2, max_completion_tokens=700)
-    except Exception as e:
-        _safe_print(f"[summarizer] LLM error: {e!r}")
+
+async def _summarize_chunk(idx: int, total: int, chunk: List[Dict]) -> Optional[str]:
+    joined = "\n".join(_msg_line(m) for m in chunk)
+    msgs = [
+        {"role": "system", "content": SUMMARY_MAP_SYSTEM},
+        {"role": "user", "content": f"Фрагмент {idx + 1} из {total}:\n\n{joined}"},
+    ]
+    out = await _complete_limited(msgs, max_completion_tokens=SUMMARY_MAP_OUT_TOKENS)
+    return (out or "").strip() or None
+
+
+async def _reduce_partials(partials: List[str]) -> Optional[str]:
+    """
+    Сводит частичные саммари в одно. Если они сами не влезают в один промпт — сводим группами
+    (дерево), пока не останется один уровень.
+    """
+    while estimate_tokens("\n\n".join(partials)) > SUMMARY_SINGLE_SHOT_MAX_TOKENS and len(partials) > 2:
+        groups = split_token_chunks(
+            [{"role": "part", "text": p} for p in partials], SUMMARY_SINGLE_SHOT_MAX_TOKENS // 2
+        )
+        if len(groups) >= len(partials):
+            break
+        merged = await asyncio.gather(*(_reduce_once([m["text"] for m in g]) for g in groups))
+        partials = [m for m in merged if m]
+        if not partials:
+            return None
+    return await _reduce_once(partials)
+
+
+async def _reduce_once(partials: List[str]) -> Optional[str]:
+    if len(partials) == 1:
+        return partials[0]
+    joined = "\n\n".join(f"[Часть {i + 1}]\n{p}" for i, p in enumerate(partials))
+    msgs = [
+        {"role": "system", "content": SUMMARY_SYSTEM},
+        {"role": "user", "content": (
+            "Ниже частичные саммари последовательных фрагментов одного периода (в хронологическом порядке). "
+            "Объедини их в одно саммари периода, убери повторы, сохрани важные детали из всех частей.\n\n" + joined
+        )},
+    ]
+    out = await _complete_limited(msgs, max_completion_tokens=700)
+    return (out or "").strip() or None
+
+
+def _record_stats(st: Dict[str, Any]) -> None:
+    agg = SUMMARIZE_STATS.setdefault(st["mode"], {"calls": 0, "input_tokens": 0, "total_ms": 0.0, "chunks": 0})
+    agg["calls"] += 1
+    agg["input_tokens"] += st.get("input_tokens", 0)
+    agg["total_ms"] += st.get("total_ms", 0.0)
+    agg["chunks"] += st.get("chunks", 0)
+
+
+async def _llm_summarize(
+    messages: List[Dict],
+    *,
+    mode: Optional[str] = None,
+    stats: Optional[Dict[str, Any]] = None,
+) -> Optional[str]:
+    """
+    Собираем компактную выжимку периода.
+    mode: "single" — один промпт (как раньше, последние 500 сообщений);
+          "mapreduce" — куски по SUMMARY_CHUNK_TOKENS суммаризируются параллельно и сводятся;
+          None/"auto" — map-reduce, только если период не влезает в SUMMARY_SINGLE_SHOT_MAX_TOKENS.
+    stats — сюда пишутся режим, токены и латентность по стадиям (map/reduce).
+    Если хоть один map-кусок вернул пусто — None: неполная выжимка хуже повтора дня.
+    """
+    if not messages:
+        return None
+    st: Dict[str, Any] = stats if stats is not None else {}
+    t0 = time.perf_counter()
+    text_msgs = [m for m in messages if (m.get("text") or "").strip()]
+    st["input_tokens"] = sum(estimate_tokens(_msg_line(m)) for m in text_msgs)
+
+    mode = (mode or SUMMARY_MODE or "auto").lower()
+    if mode == "auto":
+        mode = "mapreduce" if st["input_tokens"] > SUMMARY_SINGLE_SHOT_MAX_TOKENS else "single"
+    st["mode"] = mode
+
+    if mode != "mapreduce":
+        # Safety cap по количеству сообщений, чтобы не раздуть запрос
+        out = await _summarize_single(text_msgs, cap=500)
+        st["chunks"] = 1
+        st["total_ms"] = round((time.perf_counter() - t0) * 1000.0, 1)
+        _record_stats(st)
+        return out
+
+    chunks = split_token_chunks(text_msgs, SUMMARY_CHUNK_TOKENS, min_tokens=SUMMARY_CHUNK_TOKENS // 2)
+    st["chunks"] = len(chunks)
+    sem = asyncio.Semaphore(SUMMARY_MAP_CONCURRENCY)
+
+    async def _map(i: int, chunk: List[Dict]) -> Optional[str]:
+        async with sem:
+            return await _summarize_chunk(i, len(chunks), chunk)
+
+    partials = await asyncio.gather(*(_map(i, c) for i, c in enumerate(chunks)))
+    ok = [p for p in partials if p]
+    t_map = time.perf_counter()
+    st["map_ms"] = round((t_map - t0) * 1000.0, 1)
+    st["map_failed"] = len(partials) - len(ok)
+    st["map_out_tokens"] = sum(estimate_tokens(p) for p in ok)
+    if st["map_failed"]:
+        # часть дня выпала бы из саммари молча — лучше пустой результат и повтор дня
+        st["total_ms"] = st["map_ms"]
+        _record_stats(st)
         return None
 
+    out = await _reduce_partials(ok)
+    st["reduce_ms"] = round((time.perf_counter() - t_map) * 1000.0, 1)
+    st["total_ms"] = round((time.perf_counter() - t0) * 1000.0, 1)
+    _record_stats(st)
+    return out
+
+
+def get_summarize_stats() -> Dict[str, Dict[str, Any]]:
+    out: Dict[str, Dict[str, Any]] = {}
+    for mode, agg in SUMMARIZE_STATS.items():
+        calls = max(1, agg["calls"])
+        out[mode] = {**agg, "avg_ms": round(agg["total_ms"] / calls, 1), "avg_input_tokens": agg["input_tokens"] // calls}
+    return out
+
+
+async def _llm_update_summary(prev_text: str, new_messages: List[Dict]) -> Optional[str]:
+    """
+    Вписывает новые сообщения в существующее саммари: в промпт идут только прежний текст
+    и дельта, а не весь день заново.
+    """
+    joined = "\n".join(f"{m['role']}: {m['text']}" for m in new_messages if (m.get("text") or "").strip())
+    if not joined.strip():
+        return None
+    msgs = [
+        {"role": "system", "content": SUMMARY_UPDATE_SYSTEM},
+        {"role": "user", "content": f"Текущее саммари:\n{prev_text}\n\nНовые сообщения:\n{joined}"},
+    ]
+    out = await _complete_limited(msgs, max_completion_tokens=700)
     return (out or "").strip() or None
 
 
 # === DAILY ===
 
-async def make_daily(user_id: int, day_utc: datetime) -> None:
+async def make_daily(
+    user_id: int,
+    day_utc: datetime,
+    *,
+    batch: Optional[SummaryBatch] = None,
+    privacy_checked: bool = False,
+    trace: Optional[Dict[str, Any]] = None,
+) -> Optional[int]:
     """
     Делает дневную выжимку за [00:00, 24:00) UTC указанной даты и пишет:
     - в БД (dialog_summaries kind='daily')
-    - в Qdrant (collection=dialog_summaries_v1, kind='daily')
+    - в Qdrant (collection=dialog_summaries_v1, kind='daily'); с batch — отложенно, пачкой
+    Возвращает id записи dialog_summaries или None, если писать было нечего.
+    Повторный запуск за тот же день инкрементальный: от чекпоинта source_last_id в LLM уходят
+    прежнее саммари и только новые сообщения (SUMMARY_INCREMENTAL=0 — всегда с нуля).
+    privacy_checked=True — пользователь пришёл из plan_daily_candidates, privacy уже отфильтрован.
+    trace["outcome"] — чем кончилось: written | up_to_date | reindexed | privacy | no_messages | llm_empty
+    (up_to_date тоже возвращает id, но ничего не пишет; reindexed — новых сообщений нет, но точки
+    в Qdrant нет (indexed_at пуст: прошлый flush упал) — она пишется заново из сохранённого текста).
+    Ошибки LLM (429, сеть) не глотаются: outcome=llm_error и исключение — вызывающий повторит день.
     """
     start, end = _utc_day_bounds(day_utc)
 
     # privacy guard
+    if not privacy_checked:
+        async with async_session() as s:
+            pr = (await s.execute(sql("SELECT privacy_level FROM users WHERE id=:uid"), {"uid": user_id})).scalar_one_or_none()
+            if (pr or "").lower() == "none":
+                _safe_print(f"[summarizer] skip daily: privacy=none user_id={user_id}")
+                _outcome(trace, "daily", "privacy")
+                return None
+
+    # Чекпоинт: последний учтённый bot_messages.id в уже сохранённой дневной записи
     async with async_session() as s:
-        pr = (await s.execute(sql("SELECT privacy_level FROM users WHERE id=:uid"), {"uid": user_id})).scalar_one_or_none()
-        if (pr or "").lower() == "none":
-            _safe_print(f"[summarizer] skip daily: privacy=none user_id={user_id}")
-            return
+        prev = (await s.execute(sql("""
+            SELECT id, text, source_count, source_last_id, indexed_at
+            FROM dialog_summaries
+            WHERE user_id=:uid AND kind='daily' AND period_start=:st AND period_end=:en
+        """), {"uid": user_id, "st": start, "en": end})).mappings().first()
 
-    msgs = await _fetch_raw_messages(user_id, start, end)
+    incremental = bool(
+        SUMMARY_INCREMENTAL and prev and prev["source_last_id"] is not None and (prev["text"] or "").strip()
+    )
+    filter_report: Dict[str, Any] = {}
+    with SUMMARY_METRICS.time("fetch"):
+        msgs = await _fetch_raw_messages(
+            user_id, start, end, after_id=prev["source_last_id"] if incremental else None, report=filter_report
+        )
+    if incremental and not msgs:
+        # новых сообщений (кроме отфильтрованного шума) нет — саммари актуально, LLM не нужен.
+        # Чекпоинт коммитится раньше точки: если запись в Qdrant не дошла, восстанавливаем её.
+        if prev["indexed_at"] is None:
+            await _store_point(
+                batch, summary_id=int(prev["id"]), user_id=user_id, kind="daily",
+                text=prev["text"], period_start=start, period_end=end
+            )
+            _safe_print(f"[summarizer] daily reindexed user_id={user_id} day={start.date()}")
+            _outcome(trace, "daily", "reindexed")
+            return int(prev["id"])
+        _safe_print(f"[summarizer] daily up-to-date user_id={user_id} day={start.date()}")
+        _outcome(trace, "daily", "up_to_date")
+        return int(prev["id"])
+    if incremental and len(msgs) > SUMMARY_INCREMENTAL_MAX_NEW:
+        incremental = False
+        filter_report = {}
+        with SUMMARY_METRICS.time("fetch"):
+            msgs = await _fetch_raw_messages(user_id, start, end, report=filter_report)
+    _record_filter(user_id, start, filter_report)
     if not msgs:
         _safe_print(f"[summarizer] no msgs for daily user_id={user_id} day={start.date()}")
-        return
+        _outcome(trace, "daily", "no_messages")
+        return None
 
-    text_sum = await _llm_summarize(msgs)
+    try:
+        with SUMMARY_METRICS.time("summarize"):
+            if incremental:
+                text_sum = await _llm_update_summary(prev["text"], msgs)
+                source_count = int(prev["source_count"] or 0) + len(msgs)
+            else:
+                text_sum = await _llm_summarize(msgs)
+                source_count = len(msgs)
+    except Exception as e:
+        _safe_print(f"[summarizer] LLM error daily user_id={user_id} day={start.date()}: {e!r}")
+        _outcome(trace, "daily", "llm_error")
+        raise
     if not text_sum:
         _safe_print(f"[summarizer] llm returned empty daily summary user_id={user_id} day={start.date()}")
-        return
+        _outcome(trace, "daily", "llm_empty")
+        return None
+    last_id = max(m["id"] for m in msgs)
 
-    # БД: upsert
-    async with async_session() as s:
-        existing = (await s.execute(sql("""
-            SELECT id FROM dialog_summaries
-            WHERE user_id=:uid AND kind='daily' AND period_start=:st AND period_end=:en
-        """), {"uid": user_id, "st": start, "en": end})).scalar_one_or_none()
-
-        if existing:
-            await s.execute(sql("""
-                UPDATE dialog_summaries
-                SET text=:t, source_count=:cnt, updated_at=NOW()
-                WHERE id=:id
-            """), {"t": text_sum, "cnt": len(msgs), "id": existing})
-            ds_id = existing
-            await s.commit()
-        else:
-            ds_id = (await s.execute(sql("""
-                INSERT INTO dialog_summaries (user_id, kind, period_start, period_end, text, source_count, created_at, updated_at)
-                VALUES (:uid,'daily',:st,:en,:t,:cnt, NOW(), NOW())
-                RETURNING id
-            """), {"uid": user_id, "st": start, "en": end, "t": text_sum, "cnt": len(msgs)})).scalar_one()
+    # БД: upsert одним запросом
+    with SUMMARY_METRICS.time("db_upsert"):
+        async with async_session() as s:
+            ds_id = await _upsert_summary_row(
+                s, user_id=user_id, kind="daily", start=start, end=end,
+                text_sum=text_sum, source_count=source_count, source_last_id=last_id,
+            )
             await s.commit()
 
-    # Qdrant: upsert
-    await upsert_summary_point(
-        summary_id=ds_id, user_id=user_id, kind="daily",
+    # Qdrant: upsert (с batch — только в буфер, запись пачкой позже)
+    await _store_point(
+        batch, summary_id=ds_id, user_id=user_id, kind="daily",
         text=text_sum, period_start=start, period_end=end
     )
-    _safe_print(f"[summarizer] daily saved user_id={user_id} id={ds_id}")
+    _outcome(trace, "daily", "written")
+    _safe_print(
+        f"[summarizer] daily saved user_id={user_id} id={ds_id} "
+        f"mode={'incremental' if incremental else 'full'} msgs={len(msgs)}"
+    )
+    return ds_id
+
+
+# === Запись в dialog_summaries ===
+
+async def _upsert_summary_row(
+    s,
+    *,
+    user_id: int,
+    kind: str,
+    start: datetime,
+    end: datetime,
+    text_sum: str,
+    source_count: Optional[int],
+    source_last_id: Optional[int] = None,
+) -> int:
+    """
+    Один INSERT ... ON CONFLICT по уникальному (user_id, kind, period_start, period_end)
+    вместо SELECT → UPDATE/INSERT: без лишнего round trip и без гонки параллельных суммаризаторов.
+    Коммит — на вызывающем.
+    """
+    return int((await s.execute(sql("""
+        INSERT INTO dialog_summaries (user_id, kind, period_start, period_end, text, source_count, source_last_id, created_at, updated_at)
+        VALUES (:uid, :kind, :st, :en, :t, :cnt, :last, NOW(), NOW())
+        ON CONFLICT (user_id, kind, period_start, period_end)
+        DO UPDATE SET text=EXCLUDED.text, source_count=EXCLUDED.source_count,
+                      source_last_id=EXCLUDED.source_last_id, updated_at=NOW(), indexed_at=NULL
+        RETURNING id
+    """), {
+        "uid": user_id, "kind": kind, "st": start, "en": end,
+        "t": text_sum, "cnt": source_count, "last": source_last_id,
+    })).scalar_one())
+
+
+async def _adopt_legacy_topic(s, start: datetime, end: datetime, user_ids: List[int]) -> None:
+    """
+    Legacy kind='topic' за месяц [start, end) переименовывается в 'monthly' (если monthly ещё нет),
+    чтобы последующий upsert обновил её, а не завёл вторую запись за тот же период.
+    """
+    await s.execute(sql("""
+        UPDATE dialog_summaries d
+        SET kind='monthly'
+        WHERE d.kind='topic' AND d.period_start=:st AND d.period_end=:en
+          AND d.user_id = ANY(:uids)
+          AND NOT EXISTS (
+              SELECT 1 FROM dialog_summaries m
+              WHERE m.user_id=d.user_id AND m.kind='monthly'
+                AND m.period_start=:st AND m.period_end=:en
+          )
+    """), {"st": start, "en": end, "uids": [int(x) for x in user_ids]})
+
+
+# === ROLLUP: общие промпты weekly/monthly ===
+
+# kind → (инструкция, max_completion_tokens, источники по приоритету)
+_ROLLUP_SPECS: Dict[str, Tuple[str, int, Tuple[str, ...]]] = {
+    "weekly": ("Сжать недельную сводку (7 дней) из дневных саммарей:\n", 800, ("daily",)),
+    "monthly": ("Сделай месячную выжимку: ключевые темы, сдвиги, договорённости, риски.\n", 900, ("weekly", "daily", "topic")),
+}
+
+
+async def _rollup_llm(kind: str, joined: str) -> str:
+    """Свёртка уже склеенных «- текст» саммарей в weekly/monthly; пустая строка — LLM ничего не вернула."""
+    prompt, max_tokens, _ = _ROLLUP_SPECS[kind]
+    msgs = [
+        {"role": "system", "content": SUMMARY_SYSTEM},
+        {"role": "user", "content": prompt + joined},
+    ]
+    out = await _complete_limited(msgs, max_completion_tokens=max_tokens)
+    return (out or "").strip()
 
 
 # === WEEKLY (ROLLUP из daily) ===
 
-async def rollup_weekly(user_id: int, week_start_utc: datetime) -> None:
+async def rollup_weekly(user_id: int, week_start_utc: datetime, *, batch: Optional[SummaryBatch] = None, trace: Optional[Dict[str, Any]] = None) -> Optional[int]:
     """
     Делает недельную выжимку за 7 суток [start, end), сначала пытается собрать из дневных саммарей.
     Если дневных нет — нечего сворачивать (неделя пропускается).
@@ -188,63 +620,49 @@ async def rollup_weekly(user_id: int, week_start_utc: datetime) -> None:
 
     if not dailies:
         _safe_print(f"[summarizer] no daily to rollup weekly user_id={user_id} start={start.date()}")
-        return
+        _outcome(trace, "weekly", "no_sources")
+        return None
 
     joined = "\n\n".join(f"- {r['text']}" for r in dailies if (r.get("text") or "").strip())
     if not joined.strip():
         _safe_print(f"[summarizer] empty text after join (weekly) user_id={user_id}")
-        return
+        _outcome(trace, "weekly", "no_sources")
+        return None
 
-    msgs = [
-        {"role": "system", "content": SUMMARY_SYSTEM},
-        {"role": "user", "content": f"Сжать недельную сводку (7 дней) из дневных саммарей:\n{joined}"},
-    ]
     try:
-        out = await complete_chat(messages=msgs, temperature=0.2, max_completion_tokens=800)
-    except TypeError:
-        out = await complete_chat(msgs, temperature=0.2, max_completion_tokens=800)
+        text_sum = await _rollup_llm("weekly", joined)
     except Exception as e:
         _safe_print(f"[summarizer] LLM error weekly: {e!r}")
-        return
+        _outcome(trace, "weekly", "llm_error")
+        raise
 
-    text_sum = (out or "").strip()
     if not text_sum:
         _safe_print(f"[summarizer] llm returned empty weekly summary user_id={user_id}")
-        return
+        _outcome(trace, "weekly", "llm_empty")
+        return None
 
     # БД: upsert weekly
-    async with async_session() as s:
-        existing = (await s.execute(sql("""
-            SELECT id FROM dialog_summaries
-            WHERE user_id=:uid AND kind='weekly' AND period_start=:st AND period_end=:en
-        """), {"uid": user_id, "st": start, "en": end})).scalar_one_or_none()
-        if existing:
-            await s.execute(sql("""
-                UPDATE dialog_summaries
-                SET text=:t, source_count=:cnt, updated_at=NOW()
-                WHERE id=:id
-            """), {"t": text_sum, "cnt": len(dailies), "id": existing})
-            ds_id = existing
-            await s.commit()
-        else:
-            ds_id = (await s.execute(sql("""
-                INSERT INTO dialog_summaries (user_id, kind, period_start, period_end, text, source_count, created_at, updated_at)
-                VALUES (:uid,'weekly',:st,:en,:t,:cnt, NOW(), NOW())
-                RETURNING id
-            """), {"uid": user_id, "st": start, "en": end, "t": text_sum, "cnt": len(dailies)})).scalar_one()
+    with SUMMARY_METRICS.time("db_upsert"):
+        async with async_session() as s:
+            ds_id = await _upsert_summary_row(
+                s, user_id=user_id, kind="weekly", start=start, end=end,
+                text_sum=text_sum, source_count=len(dailies),
+            )
             await s.commit()
 
     # Qdrant
-    await upsert_summary_point(
-        summary_id=ds_id, user_id=user_id, kind="weekly",
+    await _store_point(
+        batch, summary_id=ds_id, user_id=user_id, kind="weekly",
         text=text_sum, period_start=start, period_end=end
     )
+    _outcome(trace, "weekly", "written")
     _safe_print(f"[summarizer] weekly saved user_id={user_id} id={ds_id}")
+    return ds_id
 
 
 # === MONTHLY (ROLLUP из weekly, fallback на daily) ===
 
-async def rollup_monthly(user_id: int, month_start_utc: datetime) -> None:
+async def rollup_monthly(user_id: int, month_start_utc: datetime, *, batch: Optional[SummaryBatch] = None, trace: Optional[Dict[str, Any]] = None) -> Optional[int]:
     """
     Делает месячную выжимку: пытается собрать из weekly; если weekly нет — из daily за месяц.
     В БД пишет kind='monthly' (legacy 'topic' читается, но больше не используется при вставке).
@@ -290,54 +708,433 @@ async def rollup_monthly(user_id: int, month_start_utc: datetime) -> None:
 
     if not items:
         _safe_print(f"[summarizer] nothing to rollup monthly user_id={user_id} month={start.date():%Y-%m}")
-        return
+        _outcome(trace, "monthly", "no_sources")
+        return None
 
     joined = "\n\n".join(f"- {x}" for x in items)
-    msgs = [
-        {"role": "system", "content": SUMMARY_SYSTEM},
-        {"role": "user", "content": "Сделай месячную выжимку: ключевые темы, сдвиги, договорённости, риски.\n" + joined},
-    ]
     try:
-        out = await complete_chat(messages=msgs, temperature=0.2, max_completion_tokens=900)
-    except TypeError:
-        out = await complete_chat(msgs, temperature=0.2, max_completion_tokens=900)
+        text_sum = await _rollup_llm("monthly", joined)
     except Exception as e:
         _safe_print(f"[summarizer] LLM error monthly: {e!r}")
-        return
+        _outcome(trace, "monthly", "llm_error")
+        raise
 
-    text_sum = (out or "").strip()
     if not text_sum:
         _safe_print(f"[summarizer] llm returned empty monthly summary user_id={user_id}")
-        return
+        _outcome(trace, "monthly", "llm_empty")
+        return None
 
-    # БД: upsert monthly (учитываем legacy 'topic' при поиске существующей записи)
-    async with async_session() as s:
-        existing = (await s.execute(sql("""
-            SELECT id FROM dialog_summaries
-            WHERE user_id=:uid AND kind IN ('monthly','topic') AND period_start=:st AND period_end=:en
-            ORDER BY CASE kind WHEN 'monthly' THEN 0 ELSE 1 END
-            LIMIT 1
-        """), {"uid": user_id, "st": start, "en": end})).scalar_one_or_none()
-
-        if existing:
-            await s.execute(sql("""
-                UPDATE dialog_summaries
-                SET kind='monthly', text=:t, source_count=NULL, updated_at=NOW()
-                WHERE id=:id
-            """), {"t": text_sum, "id": existing})
-            ds_id = existing
-            await s.commit()
-        else:
-            ds_id = (await s.execute(sql("""
-                INSERT INTO dialog_summaries (user_id, kind, period_start, period_end, text, created_at, updated_at)
-                VALUES (:uid,'monthly',:st,:en,:t, NOW(), NOW())
-                RETURNING id
-            """), {"uid": user_id, "st": start, "en": end, "t": text_sum})).scalar_one()
+    # БД: upsert monthly (legacy 'topic' за тот же месяц становится monthly и обновляется)
+    with SUMMARY_METRICS.time("db_upsert"):
+        async with async_session() as s:
+            await _adopt_legacy_topic(s, start, end, [user_id])
+            ds_id = await _upsert_summary_row(
+                s, user_id=user_id, kind="monthly", start=start, end=end,
+                text_sum=text_sum, source_count=None,
+            )
             await s.commit()
 
     # Qdrant
-    await upsert_summary_point(
-        summary_id=ds_id, user_id=user_id, kind="monthly",
+    await _store_point(
+        batch, summary_id=ds_id, user_id=user_id, kind="monthly",
         text=text_sum, period_start=start, period_end=end
     )
+    _outcome(trace, "monthly", "written")
     _safe_print(f"[summarizer] monthly saved user_id={user_id} id={ds_id}")
+    return ds_id
+
+
+# === Кандидаты на DAILY: один сгруппированный запрос ===
+
+async def plan_daily_candidates(
+    day_utc: datetime,
+    *,
+    user_ids: Optional[List[int]] = None,
+) -> List[Dict[str, int]]:
+    """
+    Пользователи, у которых есть сообщения в bot_messages за сутки day_utc и privacy != 'none',
+    с числом сообщений и объёмом текста в байтах — одним GROUP BY вместо обхода всей users.
+    Сортировка по объёму (крупные первыми): длинные суммаризации стартуют раньше и не
+    растягивают хвост пула. user_ids — сузить до заданного списка.
+    """
+    start, end = _utc_day_bounds(day_utc)
+    params: Dict[str, Any] = {"st": start, "en": end}
+    only = ""
+    if user_ids is not None:
+        if not user_ids:
+            return []
+        only = "AND m.user_id = ANY(:uids)"
+        params["uids"] = [int(x) for x in user_ids]
+
+    async with async_session() as s:
+        rows = (await s.execute(sql(f"""
+            SELECT m.user_id,
+                   COUNT(*) AS messages,
+                   COALESCE(SUM(octet_length(m.text)), 0) AS bytes
+            FROM bot_messages m
+            JOIN users u ON u.id = m.user_id
+            WHERE m.created_at >= :st
+              AND m.created_at <  :en
+              AND LOWER(COALESCE(u.privacy_level, '')) <> 'none'
+              {only}
+            GROUP BY m.user_id
+            ORDER BY bytes DESC, m.user_id ASC
+        """), params)).mappings().all()
+    return [{"user_id": int(r["user_id"]), "messages": int(r["messages"]), "bytes": int(r["bytes"])} for r in rows]
+
+
+# === Параллельный движок DAILY для батч-джобов ===
+
+def _pct(values: List[float], q: float) -> float:
+    vals = sorted(values)
+    return vals[min(len(vals) - 1, int(round(q * (len(vals) - 1))))] if vals else 0.0
+
+
+async def _aiter_ids(user_ids: Union[Iterable[int], AsyncIterator[List[int]]]) -> AsyncIterator[int]:
+    if hasattr(user_ids, "__aiter__"):
+        async for chunk in user_ids:  # type: ignore[union-attr]
+            for uid in chunk:
+                yield int(uid)
+    else:
+        for uid in user_ids:  # type: ignore[union-attr]
+            yield int(uid)
+
+
+async def run_daily_pool(
+    user_ids: Union[Iterable[int], AsyncIterator[List[int]]],
+    day_utc: datetime,
+    *,
+    concurrency: int = DAILY_SUMMARIES_CONCURRENCY,
+    deadline: Optional[float] = None,
+    batch: Optional[SummaryBatch] = None,
+    counters: Optional[Dict[str, int]] = None,
+    slowest: int = 5,
+    privacy_checked: bool = False,
+) -> Dict[str, Any]:
+    """
+    make_daily для множества пользователей пулом из `concurrency` воркеров.
+    user_ids — список id или async-итератор пачек id (например, id кандидатов из plan_daily_candidates).
+    Темп LLM/эмбеддингов держат общие bucket'ы (SUMMARY_LLM_RPM / SUMMARY_EMBED_RPM),
+    поэтому пропускная способность упирается в лимит провайдера, а не в латентность вызова.
+    deadline — time.monotonic(), после которого новые пользователи не берутся (status=partial).
+    privacy_checked — список из plan_daily_candidates, повторная проверка privacy не нужна.
+    batch — в конце сбрасывается здесь же; пользователи, чьи точки так и не записались,
+    не считаются в summaries_written (index_failed_user_ids).
+    """
+    counters = counters if counters is not None else {}
+    for k in ("checked_users", "processed_users", "summaries_written", "skipped", "errors", "rate_limited", "index_errors"):
+        counters.setdefault(k, 0)
+    queue: "asyncio.Queue[Optional[int]]" = asyncio.Queue(maxsize=max(1, concurrency) * 2)
+    timings: List[Tuple[int, float]] = []
+    state: Dict[str, Any] = {"status": "ok", "dispatched": 0, "last_uid": None}
+    buffered: Dict[int, Tuple[int, str]] = {}  # summary_id → (user_id, outcome) для точек в batch
+
+    async def produce() -> None:
+        try:
+            async for uid in _aiter_ids(user_ids):
+                if deadline is not None and time.monotonic() > deadline:
+                    state["status"] = "partial"
+                    break
+                await queue.put(uid)
+                state["dispatched"] += 1
+                state["last_uid"] = uid
+        finally:
+            for _ in range(max(1, concurrency)):
+                await queue.put(None)
+
+    async def work() -> None:
+        while True:
+            uid = await queue.get()
+            if uid is None:
+                return
+            counters["checked_users"] += 1
+            t0 = time.perf_counter()
+            trace: Dict[str, Any] = {}
+            try:
+                rid = await make_daily(uid, day_utc, batch=batch, privacy_checked=privacy_checked, trace=trace)
+                counters["processed_users"] += 1
+                # id возвращается и для up_to_date — считаем только реально записанные
+                outcome = trace.get("outcome") or "unknown"
+                if batch is not None and rid is not None and outcome in ("written", "reindexed"):
+                    buffered[int(rid)] = (uid, outcome)
+                if outcome == "written":
+                    counters["summaries_written"] += 1
+                else:
+                    counters[f"skip_{outcome}"] = counters.get(f"skip_{outcome}", 0) + 1
+            except Exception as e:
+                if is_rate_limit_error(e):
+                    counters["rate_limited"] += 1
+                    counters["skipped"] += 1
+                    _safe_print(f"[summarizer] daily rate_limit user_id={uid}: {e!r}")
+                else:
+                    counters["errors"] += 1
+                    _safe_print(f"[summarizer] daily error user_id={uid}: {e!r}")
+            finally:
+                ms_user = (time.perf_counter() - t0) * 1000.0
+                timings.append((uid, ms_user))
+                SUMMARY_METRICS.observe("user_total", ms_user)
+
+    started = time.perf_counter()
+    await asyncio.gather(produce(), *(work() for _ in range(max(1, concurrency))))
+    index_failed: List[int] = []
+    if batch is not None:
+        try:
+            await batch.flush()
+        except Exception as e:
+            _safe_print(f"[summarizer] daily qdrant flush error points={len(batch)}: {e!r}")
+        # строки в БД есть, точек нет — следующий прогон перепишет их (indexed_at пуст)
+        for sid in batch.pending_ids():
+            uid, outcome = buffered.get(sid, (None, None))
+            if uid is None:
+                continue
+            index_failed.append(uid)
+            counters["index_errors"] += 1
+            if outcome == "written":
+                counters["summaries_written"] -= 1
+    wall = time.perf_counter() - started
+
+    ms = [t for _, t in timings]
+    state.update({
+        "users": len(timings),
+        "wall_sec": round(wall, 2),
+        "users_per_min": round(len(timings) / wall * 60.0, 1) if wall > 0 else 0.0,
+        "user_ms": {"p50": round(_pct(ms, 0.5), 1), "p95": round(_pct(ms, 0.95), 1), "max": round(max(ms or [0.0]), 1)},
+        "slowest": [{"user_id": u, "ms": round(t, 1)} for u, t in sorted(timings, key=lambda x: -x[1])[:slowest]],
+        "index_failed_user_ids": sorted(index_failed),
+        "rate_limit": {"llm": get_bucket("llm").snapshot(), "embed": get_bucket("embed").snapshot()},
+    })
+    return state
+
+
+# === Пакетный ROLLUP weekly/monthly ===
+
+# Сколько готовых свёрток копим перед одним INSERT ... ON CONFLICT
+ROLLUP_WRITE_BATCH = max(1, int(os.getenv("ROLLUP_WRITE_BATCH", "200") or "200"))
+
+
+def _rollup_bounds(kind: str, period_start: datetime) -> Tuple[datetime, datetime]:
+    if kind == "weekly":
+        return _utc_week_bounds(period_start)
+    if kind == "monthly":
+        return _utc_month_bounds(period_start)
+    raise ValueError(f"unknown rollup kind: {kind!r}")
+
+
+async def _stream_rollup_sources(
+    kind: str,
+    start: datetime,
+    end: datetime,
+    *,
+    user_ids: Optional[List[int]] = None,
+) -> AsyncIterator[Tuple[int, List[str]]]:
+    """
+    Источники свёртки всех пользователей за период одним потоковым запросом,
+    упорядоченным по user_id: отдаёт (user_id, [тексты]) по мере чтения курсора.
+    Из нескольких видов источников берётся первый по приоритету (_ROLLUP_SPECS):
+    для monthly — weekly, иначе daily, иначе legacy 'topic' — как в rollup_monthly.
+    """
+    sources = _ROLLUP_SPECS[kind][2]
+    params: Dict[str, Any] = {"kinds": list(sources), "st": start, "en": end}
+    only = ""
+    if user_ids is not None:
+        if not user_ids:
+            return
+        only = "AND user_id = ANY(:uids)"
+        params["uids"] = [int(x) for x in user_ids]
+
+    def pick(by_kind: Dict[str, List[str]]) -> List[str]:
+        for k in sources:
+            if by_kind.get(k):
+                return by_kind[k]
+        return []
+
+    async with async_session() as s:
+        res = await s.stream(sql(f"""
+            SELECT user_id, kind, text
+            FROM dialog_summaries
+            WHERE kind = ANY(:kinds)
+              AND period_start >= :st
+              AND period_end   <= :en
+              AND COALESCE(btrim(text), '') <> ''
+              {only}
+            ORDER BY user_id ASC, period_start ASC
+        """), params)
+        cur: Optional[int] = None
+        by_kind: Dict[str, List[str]] = {}
+        async for r in res.mappings():
+            uid = int(r["user_id"])
+            if uid != cur:
+                if cur is not None:
+                    yield cur, pick(by_kind)
+                cur, by_kind = uid, {}
+            by_kind.setdefault(r["kind"], []).append(r["text"])
+        if cur is not None:
+            yield cur, pick(by_kind)
+
+
+async def _upsert_rollups(
+    kind: str,
+    start: datetime,
+    end: datetime,
+    rows: List[Tuple[int, str, Optional[int]]],
+) -> Dict[int, int]:
+    """
+    Пачка (user_id, text, source_count) → один INSERT ... ON CONFLICT по
+    (user_id, kind, period_start, period_end); для monthly — после _adopt_legacy_topic.
+    Возвращает {user_id: id}.
+    """
+    if not rows:
+        return {}
+    uids = [int(r[0]) for r in rows]
+    async with async_session() as s:
+        if kind == "monthly":
+            await _adopt_legacy_topic(s, start, end, uids)
+        res = (await s.execute(sql("""
+            INSERT INTO dialog_summaries (user_id, kind, period_start, period_end, text, source_count, created_at, updated_at)
+            SELECT u.user_id, :kind, :st, :en, u.text, u.cnt, NOW(), NOW()
+            FROM unnest(CAST(:uids AS bigint[]), CAST(:texts AS text[]), CAST(:cnts AS integer[])) AS u(user_id, text, cnt)
+            ON CONFLICT (user_id, kind, period_start, period_end)
+            DO UPDATE SET text=EXCLUDED.text, source_count=EXCLUDED.source_count, updated_at=NOW(), indexed_at=NULL
+            RETURNING id, user_id
+        """), {
+            "kind": kind, "st": start, "en": end, "uids": uids,
+            "texts": [r[1] for r in rows], "cnts": [r[2] for r in rows],
+        })).all()
+        await s.commit()
+    return {int(uid): int(ds_id) for ds_id, uid in res}
+
+
+async def rollup_bulk(
+    kind: str,
+    period_start: datetime,
+    *,
+    user_ids: Optional[List[int]] = None,
+    concurrency: int = DAILY_SUMMARIES_CONCURRENCY,
+    write_batch: int = ROLLUP_WRITE_BATCH,
+    deadline: Optional[float] = None,
+) -> Dict[str, Any]:
+    """
+    weekly/monthly для всех пользователей с источниками за период:
+    потоковое чтение источников (один запрос) → `concurrency` воркеров LLM под общим
+    bucket "llm" → пакетные upsert'ы в dialog_summaries → пакетный upsert в Qdrant.
+    Возвращает счётчики и пропускную способность.
+    """
+    start, end = _rollup_bounds(kind, period_start)
+    workers = max(1, int(concurrency))
+    counters: Dict[str, int] = {"users": 0, "written": 0, "empty": 0, "errors": 0, "rate_limited": 0, "db_writes": 0, "index_errors": 0}
+    state: Dict[str, Any] = {"status": "ok"}
+    queue: "asyncio.Queue[Optional[Tuple[int, List[str]]]]" = asyncio.Queue(maxsize=workers * 2)
+    pending: List[Tuple[int, str, Optional[int]]] = []
+    write_lock = asyncio.Lock()
+    batch = SummaryBatch()
+    buffered: Dict[int, int] = {}  # summary_id → user_id
+    llm_ms: List[float] = []
+    write_ms: List[float] = []
+
+    async def flush() -> None:
+        async with write_lock:
+            chunk = pending[:]
+            pending.clear()
+            if not chunk:
+                return
+            t0 = time.perf_counter()
+            try:
+                ids = await _upsert_rollups(kind, start, end, chunk)
+            except Exception as e:
+                counters["errors"] += len(chunk)
+                _safe_print(f"[summarizer] {kind} bulk upsert error rows={len(chunk)}: {e!r}")
+                return
+            finally:
+                write_ms.append((time.perf_counter() - t0) * 1000.0)
+                SUMMARY_METRICS.observe("db_upsert", write_ms[-1])
+            counters["db_writes"] += 1
+            for uid, text_sum, _ in chunk:
+                ds_id = ids.get(uid)
+                if ds_id is None:
+                    continue
+                counters["written"] += 1
+                SUMMARY_METRICS.incr(f"{kind}_written")
+                buffered[ds_id] = uid
+                try:
+                    await batch.add(
+                        summary_id=ds_id, user_id=uid, kind=kind,
+                        text=text_sum, period_start=start, period_end=end
+                    )
+                except Exception as e:
+                    # точки остались в буфере — повторятся со следующим сбросом
+                    _safe_print(f"[summarizer] {kind} bulk qdrant flush error points={len(batch)}: {e!r}")
+
+    async def produce() -> None:
+        try:
+            async for uid, texts in _stream_rollup_sources(kind, start, end, user_ids=user_ids):
+                if deadline is not None and time.monotonic() > deadline:
+                    state["status"] = "partial"
+                    break
+                if texts:
+                    await queue.put((uid, texts))
+        except Exception as e:
+            state["status"] = "error"
+            _safe_print(f"[summarizer] {kind} bulk source stream error: {e!r}")
+        finally:
+            for _ in range(workers):
+                await queue.put(None)
+
+    async def work() -> None:
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            uid, texts = item
+            counters["users"] += 1
+            joined = "\n\n".join(f"- {t}" for t in texts)
+            t0 = time.perf_counter()
+            try:
+                text_sum = await _rollup_llm(kind, joined)
+            except Exception as e:
+                counters["rate_limited" if is_rate_limit_error(e) else "errors"] += 1
+                _safe_print(f"[summarizer] LLM error {kind} user_id={uid}: {e!r}")
+                continue
+            finally:
+                llm_ms.append((time.perf_counter() - t0) * 1000.0)
+                SUMMARY_METRICS.observe("summarize", llm_ms[-1])
+            if not text_sum:
+                counters["empty"] += 1
+                _outcome(None, kind, "llm_empty")
+                continue
+            pending.append((uid, text_sum, len(texts) if kind == "weekly" else None))
+            if len(pending) >= write_batch:
+                await flush()
+
+    started = time.perf_counter()
+    await asyncio.gather(produce(), *(work() for _ in range(workers)))
+    await flush()
+    try:
+        await batch.flush()
+    except Exception as e:
+        _safe_print(f"[summarizer] {kind} bulk qdrant flush error: {e!r}")
+    # свёртка в БД есть, точки нет — не считаем записанной
+    index_failed = sorted(buffered[sid] for sid in batch.pending_ids() if sid in buffered)
+    counters["index_errors"] = len(index_failed)
+    counters["written"] -= len(index_failed)
+    wall = time.perf_counter() - started
+
+    out: Dict[str, Any] = {"kind": kind, "period_start": start.isoformat(), "period_end": end.isoformat()}
+    out.update(state)
+    out.update(counters)
+    out.update({
+        "concurrency": workers,
+        "wall_sec": round(wall, 2),
+        "users_per_min": round(counters["users"] / wall * 60.0, 1) if wall > 0 else 0.0,
+        "written_per_min": round(counters["written"] / wall * 60.0, 1) if wall > 0 else 0.0,
+        "llm_ms": {"p50": round(_pct(llm_ms, 0.5), 1), "p95": round(_pct(llm_ms, 0.95), 1), "max": round(max(llm_ms or [0.0]), 1)},
+        "write_ms": {"p50": round(_pct(write_ms, 0.5), 1), "p95": round(_pct(write_ms, 0.95), 1), "total": round(sum(write_ms), 1)},
+        "qdrant": dict(batch.stats),
+        "index_failed_user_ids": index_failed,
+        "rate_limit": {"llm": get_bucket("llm").snapshot(), "embed": get_bucket("embed").snapshot()},
+    })
+    _safe_print(
+        f"[summarizer] {kind} bulk {start.date()} status={out['status']} users={counters['users']} "
+        f"written={counters['written']} errors={counters['errors']} wall={out['wall_sec']}s "
+        f"users/min={out['users_per_min']}"
+    )
+    return out
@@ -29,6 +29,20 @@ QDRANT_COLLECTION = os.getenv("QDRANT_COLLECTION", "reflectai_corpus_v2").strip(
 # Коллекция для саммарей (daily/weekly/monthly) — с именованным вектором "text"
 QDRANT_SUMMARIES_COLLECTION = os.getenv("QDRANT_SUMMARIES_COLLECTION", "dialog_summaries_v1").strip()
 
+# Профиль хранения/индекса корпусной коллекции (см. COLLECTION_PROFILES)
+QDRANT_CORPUS_PROFILE = (os.getenv("QDRANT_CORPUS_PROFILE", "default") or "default").strip().lower()
+
+# Раскладка коллекции саммарей:
+#   default — как раньше: фильтр по integer user_id поверх общего HNSW-графа;
+#   tenant  — строковый tenant_id с keyword-индексом is_tenant=True (точки пользователя лежат рядом),
+#             HNSW строится только внутри групп (m=0, payload_m) — много маленьких графов вместо
+#             одного большого, который фильтр по user_id рвёт на куски.
+QDRANT_SUMMARIES_LAYOUT = (os.getenv("QDRANT_SUMMARIES_LAYOUT", "default") or "default").strip().lower()
+QDRANT_SUMMARIES_PAYLOAD_M = int(os.getenv("QDRANT_SUMMARIES_PAYLOAD_M", "16") or "16")
+QDRANT_SUMMARIES_EF_CONSTRUCT = int(os.getenv("QDRANT_SUMMARIES_EF_CONSTRUCT", "100") or "100")
+# >0 — пользовательское шардирование по ключу u{user_id % N} (только для кластера; 0 — выключено)
+QDRANT_SUMMARIES_SHARD_KEYS = int(os.getenv("QDRANT_SUMMARIES_SHARD_KEYS", "0") or "0")
+
 # Имя вектора (если коллекция named). Если не задано — возьмём первое из коллекции (чаще всего "default").
 QDRANT_VECTOR_NAME = (os.getenv("QDRANT_VECTOR_NAME") or "").strip() or None
 
@@ -243,6 +257,86 @@ def normalize_points(res: Any) -> List[Any]:
     return []
 
 
+# --- Профили коллекции: квантование, on_disk оригиналов, HNSW и параметры поиска.
+# search: hnsw_ef — ширина поиска; oversampling/rescore — сколько кандидатов добрать по
+# квантованным векторам и переранжировать по оригиналам.
+COLLECTION_PROFILES: Dict[str, Dict[str, Any]] = {
+    "default": {
+        "hnsw": {"m": 16, "ef_construct": 100},
+        "quantization": None,
+        "on_disk": False,
+        "search": {"hnsw_ef": None, "oversampling": None, "rescore": None},
+    },
+    # int8: в 4 раза меньше RAM под векторы, recall почти без потерь при rescore
+    "scalar": {
+        "hnsw": {"m": 16, "ef_construct": 128},
+        "quantization": {"type": "scalar", "quantile": 0.99, "always_ram": True},
+        "on_disk": False,
+        "search": {"hnsw_ef": 96, "oversampling": 1.5, "rescore": True},
+    },
+    # int8 в RAM, оригиналы float32 на диске (mmap) — для rescore читаем только top-N
+    "scalar-disk": {
+        "hnsw": {"m": 16, "ef_construct": 128},
+        "quantization": {"type": "scalar", "quantile": 0.99, "always_ram": True},
+        "on_disk": True,
+        "search": {"hnsw_ef": 96, "oversampling": 2.0, "rescore": True},
+    },
+    # 1 бит на измерение: в 32 раза меньше, для 1536-мерных OpenAI-эмбеддингов работает с oversampling
+    "binary": {
+        "hnsw": {"m": 16, "ef_construct": 128},
+        "quantization": {"type": "binary", "always_ram": True},
+        "on_disk": True,
+        "search": {"hnsw_ef": 128, "oversampling": 3.0, "rescore": True},
+    },
+}
+
+
+def get_collection_profile(name: Optional[str] = None) -> Dict[str, Any]:
+    key = (name or QDRANT_CORPUS_PROFILE or "default").strip().lower()
+    if key not in COLLECTION_PROFILES:
+        logging.warning("[qdrant] unknown collection profile %r, using default", key)
+        key = "default"
+    return {"name": key, **COLLECTION_PROFILES[key]}
+
+
+def _quantization_config(q: Optional[Dict[str, Any]]) -> Any:
+    if not q:
+        return None
+    if q.get("type") == "scalar":
+        return qm.ScalarQuantization(
+            scalar=qm.ScalarQuantizationConfig(
+                type=qm.ScalarType.INT8,
+                quantile=q.get("quantile"),
+                always_ram=q.get("always_ram"),
+            )
+        )
+    if q.get("type") == "binary":
+        return qm.BinaryQuantization(binary=qm.BinaryQuantizationConfig(always_ram=q.get("always_ram")))
+    raise ValueError(f"unknown quantization type: {q.get('type')!r}")
+
+
+def profile_search_params(profile: Optional[str] = None, *, hnsw_ef: Optional[int] = None, oversampling: Optional[float] = None) -> Any:
+    """
+    SearchParams для профиля; hnsw_ef/oversampling переопределяют значения профиля.
+    None — если всё по умолчанию (тогда в запрос ничего не добавляем).
+    """
+    sp = dict(get_collection_profile(profile)["search"])
+    if hnsw_ef is not None:
+        sp["hnsw_ef"] = int(hnsw_ef)
+    if oversampling is not None:
+        sp["oversampling"] = float(oversampling)
+    quant = None
+    if sp.get("oversampling") is not None or sp.get("rescore") is not None:
+        quant = qm.QuantizationSearchParams(
+            ignore=False,
+            rescore=sp.get("rescore") if sp.get("rescore") is not None else True,
+            oversampling=sp.get("oversampling"),
+        )
+    if sp.get("hnsw_ef") is None and quant is None:
+        return None
+    return qm.SearchParams(hnsw_ef=sp.get("hnsw_ef"), quantization=quant)
+
+
 def _collection_exists_safe(client: QdrantClient, name: str) -> bool:
     """
     Унифицированная проверка существования коллекции, совместимая с разными версиями клиента.
@@ -270,11 +364,19 @@ def qdrant_query(
     query_filter=None,
     vector_name: Optional[str] = None,
     branch_out: Optional[Dict[str, str]] = None,
+    payload_fields: Optional[List[str]] = None,
+    shard_key_selector: Any = None,
+    search_params: Any = None,
 ) -> List[Any]:
     """
     Унифицированный вызов поиска: предпочитаем query_points, затем search_points, затем search.
+    payload_fields — вернуть только эти поля payload (вместо всего payload при with_payload=True).
+    shard_key_selector — искать только в шарде ключа (коллекции с custom sharding).
+    search_params — qm.SearchParams (hnsw_ef, квантование/oversampling), см. profile_search_params().
     Возвращает список points в формате клиента.
     """
+    if payload_fields and with_payload is not False:
+        with_payload = payload_selector(payload_fields)
     def _record_branch(name: str):
         if branch_out is not None:
             branch_out["branch"] = name
@@ -291,6 +393,10 @@ def qdrant_query(
             }
             if use_vector and vector_name:
                 kwargs["using"] = vector_name
+            if shard_key_selector is not None:
+                kwargs["shard_key_selector"] = shard_key_selector
+            if search_params is not None:
+                kwargs["search_params"] = search_params
             return normalize_points(client.query_points(**kwargs))
         if hasattr(client, "search_points"):
             _record_branch("search_points")
@@ -303,6 +409,8 @@ def qdrant_query(
             }
             if use_vector and vector_name:
                 kwargs["vector_name"] = vector_name
+            if search_params is not None:
+                kwargs["params"] = search_params
             return normalize_points(client.search_points(**kwargs))
         if hasattr(client, "search"):
             _record_branch("search")
@@ -312,6 +420,7 @@ def qdrant_query(
                 query_filter=query_filter,
                 limit=limit,
                 with_payload=with_payload,
+                **({"search_params": search_params} if search_params is not None else {}),
             ))
         raise AttributeError("Qdrant client has no query_points/search_points/search")
 
@@ -325,6 +434,17 @@ def qdrant_query(
         raise
 
 
+def payload_selector(fields: List[str]) -> Any:
+    """
+    Селектор «только эти поля payload»: PayloadSelectorInclude, на старых клиентах — список имён.
+    """
+    names = [str(f) for f in fields if f]
+    try:
+        return qm.PayloadSelectorInclude(include=names)
+    except Exception:
+        return names
+
+
 def normalize_lang_code(value: Optional[str]) -> Optional[str]:
     """
     Приводит lang к каноническому short-code виду (ru, en, ...).
@@ -341,6 +461,23 @@ def normalize_lang_code(value: Optional[str]) -> Optional[str]:
     return lang
 
 
+# Граница предложений — то же правило, что app.rag_qdrant._split_ru_sents
+SENT_BOUNDARY_RE = re.compile(r'(?<=[\.!\?])\s+(?=[А-ЯA-ZЁ])')
+
+
+def sentence_end_offsets(text: str) -> List[int]:
+    """
+    Концы предложений в тексте чанка (индекс после последнего символа).
+    Считается при индексации и кладётся в payload "sent_ends".
+    """
+    end = len((text or "").rstrip())
+    if end == 0:
+        return []
+    ends = [m.start() for m in SENT_BOUNDARY_RE.finditer(text, 0, end)]
+    ends.append(end)
+    return ends
+
+
 def _build_payload_schema(schema_type: str):
     schema_enum = getattr(qm, "PayloadSchemaType", None)
     if schema_enum is not None:
@@ -350,16 +487,24 @@ def _build_payload_schema(schema_type: str):
     return {"type": schema_type}
 
 
-def _ensure_payload_index(client: QdrantClient, collection: str, *, field_name: str, schema_type: str) -> None:
+def _ensure_payload_index(
+    client: QdrantClient,
+    collection: str,
+    *,
+    field_name: str,
+    schema_type: str,
+    field_schema: Any = None,
+) -> None:
     """
     Создаёт payload-индекс по полю для заданной коллекции.
+    field_schema — готовые параметры индекса (например, KeywordIndexParams с is_tenant).
     Безопасно: не падает, если индекс уже есть или версия клиента иная.
     """
     try:
         client.create_payload_index(
             collection_name=collection,
             field_name=field_name,
-            field_schema=_build_payload_schema(schema_type),
+            field_schema=field_schema if field_schema is not None else _build_payload_schema(schema_type),
             wait=True,
         )
     except Exception as e:
@@ -382,8 +527,120 @@ def _ensure_collection_payload_indexes(client: QdrantClient, collection: str) ->
         _ensure_payload_index(client, collection, field_name="lang", schema_type="keyword")
         return
     if collection == QDRANT_SUMMARIES_COLLECTION:
-        _ensure_payload_index(client, collection, field_name="user_id", schema_type="integer")
-        _ensure_payload_index(client, collection, field_name="kind", schema_type="keyword")
+        _ensure_summaries_payload_indexes(client, collection, layout=QDRANT_SUMMARIES_LAYOUT)
+
+
+def _ensure_summaries_payload_indexes(client: QdrantClient, collection: str, *, layout: str) -> None:
+    _ensure_payload_index(client, collection, field_name="user_id", schema_type="integer")
+    _ensure_payload_index(client, collection, field_name="kind", schema_type="keyword")
+    if layout == "tenant":
+        tenant_schema = None
+        try:
+            tenant_schema = qm.KeywordIndexParams(type="keyword", is_tenant=True)
+        except Exception:
+            # клиент без is_tenant — обычный keyword-индекс (фильтр работает, без tenant-раскладки)
+            tenant_schema = None
+        _ensure_payload_index(
+            client, collection, field_name="tenant_id", schema_type="keyword", field_schema=tenant_schema
+        )
+
+
+# --- Tenant-раскладка коллекции саммарей
+
+def summaries_tenant_layout() -> bool:
+    return QDRANT_SUMMARIES_LAYOUT == "tenant"
+
+
+def summaries_tenant_payload(user_id: int) -> Dict[str, Any]:
+    """
+    Поля владельца для payload саммари. tenant_id пишем всегда — миграция на tenant-раскладку
+    тогда не требует переписывать payload.
+    """
+    return {"user_id": int(user_id), "tenant_id": str(int(user_id))}
+
+
+def summaries_user_condition(user_id: int, *, tenant: Optional[bool] = None) -> Any:
+    """
+    Условие «точки этого пользователя» под текущую раскладку коллекции.
+    """
+    use_tenant = summaries_tenant_layout() if tenant is None else tenant
+    if use_tenant:
+        return qm.FieldCondition(key="tenant_id", match=qm.MatchValue(value=str(int(user_id))))
+    return qm.FieldCondition(key="user_id", match=qm.MatchValue(value=int(user_id)))
+
+
+def summaries_shard_key(user_id: int, *, shards: Optional[int] = None) -> Optional[str]:
+    """
+    Ключ шарда пользователя при custom sharding (None — шардирование выключено).
+    """
+    n = QDRANT_SUMMARIES_SHARD_KEYS if shards is None else int(shards)
+    if n <= 0:
+        return None
+    return f"u{int(user_id) % n}"
+
+
+def _summaries_layout_mismatch(client: QdrantClient, name: str, *, layout: str, n_shards: int) -> Optional[str]:
+    """Чем существующая коллекция не совпадает с нужной раскладкой (None — совпадает)."""
+    params = client.get_collection(name).config.params
+    vname = QDRANT_VECTOR_NAME or "default"
+    vectors = params.vectors
+    if not isinstance(vectors, dict) or vname not in vectors:
+        return f"no named vector {vname!r}"
+    if int(vectors[vname].size) != int(EMBED_DIM):
+        return f"vector size {vectors[vname].size} != EMBED_DIM {EMBED_DIM}"
+    custom = str(getattr(params, "sharding_method", None) or "").lower().endswith("custom")
+    want_custom = layout == "tenant" and n_shards > 0
+    if custom != want_custom:
+        return f"custom sharding={custom}, expected {want_custom}"
+    return None
+
+
+def create_summaries_collection(
+    client: QdrantClient,
+    name: str,
+    *,
+    layout: Optional[str] = None,
+    shards: Optional[int] = None,
+    exist_ok: bool = False,
+) -> bool:
+    """
+    Создаёт коллекцию саммарей (именованный вектор) в нужной раскладке и её payload-индексы.
+    exist_ok=True — существующая коллекция той же раскладки не ошибка: досоздаются shard key
+    и индексы (продолжение прерванной миграции); другая раскладка — ValueError.
+    Возвращает True, если коллекция создана сейчас.
+    """
+    layout = (layout or QDRANT_SUMMARIES_LAYOUT).strip().lower()
+    n_shards = QDRANT_SUMMARIES_SHARD_KEYS if shards is None else int(shards)
+    created = False
+    if exist_ok and _collection_exists_safe(client, name):
+        mismatch = _summaries_layout_mismatch(client, name, layout=layout, n_shards=n_shards)
+        if mismatch:
+            raise ValueError(f"collection {name!r} exists with a different layout: {mismatch}")
+    else:
+        vname = QDRANT_VECTOR_NAME or "default"
+        named_cfg = {vname: qm.VectorParams(size=EMBED_DIM, distance=qm.Distance.COSINE)}
+        kwargs: Dict[str, Any] = {"collection_name": name, "vectors_config": named_cfg}
+        if layout == "tenant":
+            # глобальный граф не строим (m=0): поиск всегда внутри одного пользователя
+            kwargs["hnsw_config"] = qm.HnswConfigDiff(
+                m=0,
+                payload_m=QDRANT_SUMMARIES_PAYLOAD_M,
+                ef_construct=QDRANT_SUMMARIES_EF_CONSTRUCT,
+            )
+            if n_shards > 0:
+                kwargs["sharding_method"] = qm.ShardingMethod.CUSTOM
+        client.create_collection(**kwargs)
+        created = True
+    if layout == "tenant" and n_shards > 0:
+        for i in range(n_shards):
+            try:
+                client.create_shard_key(name, f"u{i}")
+            except Exception:
+                # уже есть (повторный запуск) — если нет, upsert в этот ключ упадёт явно
+                if created:
+                    raise
+    _ensure_summaries_payload_indexes(client, name, layout=layout)
+    return created
 
 
 def get_collection_name() -> str:
@@ -402,12 +659,8 @@ def ensure_collection() -> bool:
     try:
         client = get_client()
         if not _collection_exists_safe(client, QDRANT_COLLECTION):
-            # Обычный одинарный вектор без имени
-            vectors_cfg = qm.VectorParams(size=EMBED_DIM, distance=qm.Distance.COSINE)
-            client.create_collection(
-                collection_name=QDRANT_COLLECTION,
-                vectors_config=vectors_cfg,
-            )
+            # Обычный одинарный вектор без имени, хранение/HNSW — по профилю QDRANT_CORPUS_PROFILE
+            create_corpus_collection(client, QDRANT_COLLECTION)
         _ensure_collection_payload_indexes(client, QDRANT_COLLECTION)
         return True
     except Exception as e:
@@ -415,6 +668,76 @@ def ensure_collection() -> bool:
         return False
 
 
+def _call_with_profile_metadata(call, profile: str, **kwargs: Any) -> None:
+    """
+    metadata коллекции есть только в qdrant-client/сервере 1.16+; на более старых
+    (requirements разрешают >=1.8.2) повторяем вызов без неё — метка профиля необязательна.
+    """
+    try:
+        call(**kwargs, metadata={"profile": profile})
+    except Exception as e:
+        print(f"[qdrant] collection metadata unsupported, retrying without it: {e!r}")
+        call(**kwargs)
+
+
+def create_corpus_collection(client: QdrantClient, name: str, *, profile: Optional[str] = None) -> None:
+    prof = get_collection_profile(profile)
+    _call_with_profile_metadata(
+        client.create_collection,
+        prof["name"],
+        collection_name=name,
+        vectors_config=qm.VectorParams(size=EMBED_DIM, distance=qm.Distance.COSINE, on_disk=bool(prof["on_disk"])),
+        hnsw_config=qm.HnswConfigDiff(**prof["hnsw"]),
+        quantization_config=_quantization_config(prof["quantization"]),
+    )
+
+
+def apply_collection_profile(
+    client: QdrantClient,
+    collection: str,
+    profile: str,
+    *,
+    dry_run: bool = False,
+) -> Dict[str, Any]:
+    """
+    Переводит существующую коллекцию на профиль через update_collection — без пересоздания
+    и потери точек; Qdrant перестраивает индекс/квантование в фоне, поиск продолжает работать.
+    Размер/метрику вектора профиль не меняет. Возвращает {"changes": {...}, "applied": bool}.
+    """
+    prof = get_collection_profile(profile)
+    info = client.get_collection(collection)
+    params = info.config.params
+    vectors = params.vectors
+    named = isinstance(vectors, dict)
+    cur_vec = next(iter(vectors.values())) if named and vectors else vectors
+    cur_hnsw = info.config.hnsw_config
+    cur_quant = info.config.quantization_config
+
+    changes: Dict[str, Any] = {}
+    want_hnsw = prof["hnsw"]
+    if any(getattr(cur_hnsw, k, None) != v for k, v in want_hnsw.items()):
+        changes["hnsw"] = {k: (getattr(cur_hnsw, k, None), v) for k, v in want_hnsw.items()}
+    if bool(getattr(cur_vec, "on_disk", False)) != bool(prof["on_disk"]):
+        changes["on_disk"] = (bool(getattr(cur_vec, "on_disk", False)), bool(prof["on_disk"]))
+    want_q = _quantization_config(prof["quantization"])
+    if (cur_quant is None) != (want_q is None) or (cur_quant is not None and type(cur_quant) is not type(want_q)):
+        changes["quantization"] = (type(cur_quant).__name__ if cur_quant else None, prof["quantization"])
+
+    applied = False
+    if changes and not dry_run:
+        vec_key = next(iter(vectors.keys())) if named and vectors else ""
+        _call_with_profile_metadata(
+            client.update_collection,
+            prof["name"],
+            collection_name=collection,
+            hnsw_config=qm.HnswConfigDiff(**want_hnsw) if "hnsw" in changes else None,
+            vectors_config={vec_key: qm.VectorParamsDiff(on_disk=bool(prof["on_disk"]))} if "on_disk" in changes else None,
+            quantization_config=(want_q if want_q is not None else qm.Disabled.DISABLED) if "quantization" in changes else None,
+        )
+        applied = True
+    return {"profile": prof["name"], "changes": changes, "applied": applied}
+
+
 def ensure_summaries_collection() -> bool:
     """
     Гарантирует, что коллекция саммарей создана. Используем именованный вектор "text".
@@ -424,13 +747,8 @@ def ensure_summaries_collection() -> bool:
     try:
         client = get_client()
         if not _collection_exists_safe(client, QDRANT_SUMMARIES_COLLECTION):
-            # Именованный вектор: {"text": VectorParams(...)}
-            vname = QDRANT_VECTOR_NAME or "default"
-            named_cfg = {vname: qm.VectorParams(size=EMBED_DIM, distance=qm.Distance.COSINE)}
-            client.create_collection(
-                collection_name=QDRANT_SUMMARIES_COLLECTION,
-                vectors_config=named_cfg,
-            )
+            # Именованный вектор: {"text": VectorParams(...)}, раскладка — QDRANT_SUMMARIES_LAYOUT
+            create_summaries_collection(client, QDRANT_SUMMARIES_COLLECTION)
 
         _ensure_collection_payload_indexes(client, QDRANT_SUMMARIES_COLLECTION)
         return True
@@ -449,6 +767,44 @@ def ensure_qdrant_ready() -> bool:
     return ok1 and ok2
 
 
+def get_corpus_version(client: Optional[QdrantClient] = None, collection: Optional[str] = None) -> str:
+    """
+    Версия корпуса из metadata коллекции (её поднимает scripts/ingest_qdrant.py).
+    Env QDRANT_CORPUS_VERSION имеет приоритет (ручной сброс кэшей). Если metadata нет — "0".
+    """
+    forced = (os.getenv("QDRANT_CORPUS_VERSION") or "").strip()
+    if forced:
+        return forced
+    try:
+        client = client or get_client()
+        info = client.get_collection(collection or QDRANT_COLLECTION)
+        meta = getattr(getattr(info, "config", None), "metadata", None) or {}
+        ver = meta.get("corpus_version") if isinstance(meta, dict) else None
+        return str(ver) if ver else "0"
+    except Exception as e:
+        logging.info("[qdrant] get_corpus_version failed for %s: %r", collection or QDRANT_COLLECTION, e)
+        return "0"
+
+
+def bump_corpus_version(client: Optional[QdrantClient] = None, collection: Optional[str] = None) -> Optional[str]:
+    """
+    Пишет новую версию корпуса в metadata коллекции — рантайм по ней сбрасывает кэш контекстов.
+    Возвращает новую версию или None, если сервер не поддерживает metadata.
+    """
+    import time
+    version = str(int(time.time()))
+    try:
+        client = client or get_client()
+        client.update_collection(
+            collection_name=collection or QDRANT_COLLECTION,
+            metadata={"corpus_version": version},
+        )
+        return version
+    except Exception as e:
+        print(f"[qdrant] bump_corpus_version WARNING: {e}")
+        return None
+
+
 def ping_qdrant() -> bool:
     """
     Быстрая проверка доступности кластера (для кронов и health-check).
@@ -466,5 +822,10 @@ __all__ = [
     "get_client", "ensure_collection", "ensure_summaries_collection", "ensure_qdrant_ready", "close_client",
     "get_collection_name", "get_summaries_collection_name",
     "QDRANT_COLLECTION", "QDRANT_SUMMARIES_COLLECTION",
-    "QDRANT_URL", "QDRANT_API_KEY", "EMBED_DIM", "ping_qdrant", "normalize_lang_code"
+    "QDRANT_URL", "QDRANT_API_KEY", "EMBED_DIM", "ping_qdrant", "normalize_lang_code",
+    "get_corpus_version", "bump_corpus_version", "payload_selector", "sentence_end_offsets",
+    "QDRANT_SUMMARIES_LAYOUT", "summaries_tenant_layout", "summaries_tenant_payload",
+    "summaries_user_condition", "summaries_shard_key", "create_summaries_collection",
+    "COLLECTION_PROFILES", "QDRANT_CORPUS_PROFILE", "get_collection_profile", "profile_search_params",
+    "create_corpus_collection", "apply_collection_profile",
 ]
@@ -8,7 +8,8 @@ RAG via Qdrant: тихое подмешивание контекста.
 """
 from __future__ import annotations
 
-import os, math, asyncio, logging
+import os, re, math, time, bisect, asyncio, logging
+from collections import OrderedDict, deque
 from typing import Any, Dict, List, Optional, Tuple
 
 from app.llm_adapter import (
@@ -31,9 +32,26 @@ SBERT_MODEL = os.getenv("SBERT_MODEL", "intfloat/multilingual-e5-small")
 
 RAG_COMPRESS = os.getenv("RAG_COMPRESS", "0") == "1"
 RAG_COMPRESS_MODEL = os.getenv("RAG_COMPRESS_MODEL", "gpt-5.2")
+# Дедлайн на сжатие: дольше — отдаём несжатый контекст, чтобы не держать ответ пользователю
+RAG_COMPRESS_TIMEOUT_SEC = float(os.getenv("RAG_COMPRESS_TIMEOUT_SEC", "2.5") or "2.5")
+RAG_COMPRESS_CACHE_TTL_SEC = float(os.getenv("RAG_COMPRESS_CACHE_TTL_SEC", "3600") or "3600")
+RAG_COMPRESS_CACHE_MAX_ITEMS = int(os.getenv("RAG_COMPRESS_CACHE_MAX_ITEMS", "256") or "256")
 RAG_MAX_CHARS = int(os.getenv("RAG_MAX_CHARS", "1200"))
 RAG_TRACE = os.getenv("RAG_TRACE", "0") == "1"
 
+# Поля payload, которые реально нужны рантайму (теги/метаданные корпуса не тянем)
+RAG_PAYLOAD_FIELDS = [
+    f.strip()
+    for f in os.getenv("RAG_PAYLOAD_FIELDS", "text,title,source,file,chunk,content,lang,sent_ends").split(",")
+    if f.strip()
+]
+
+# Кэш готовых контекстов (LRU + TTL), ключ: (нормализованный запрос, k, max_chars, lang, версия корпуса)
+RAG_CACHE_ENABLED = os.getenv("RAG_CACHE_ENABLED", "1") == "1"
+RAG_CACHE_TTL_SEC = float(os.getenv("RAG_CACHE_TTL_SEC", "900") or "900")
+RAG_CACHE_MAX_ITEMS = int(os.getenv("RAG_CACHE_MAX_ITEMS", "512") or "512")
+RAG_CORPUS_VERSION_REFRESH_SEC = float(os.getenv("RAG_CORPUS_VERSION_REFRESH_SEC", "60") or "60")
+
 # --- Qdrant client (локальный грузовичок)
 try:
     from app.qdrant_client import (  # type: ignore
@@ -43,6 +61,7 @@ try:
         normalize_points,
         ensure_collection,
         normalize_lang_code,
+        get_corpus_version,
     )
 except Exception:
     from qdrant_client import QdrantClient  # type: ignore
@@ -52,6 +71,8 @@ except Exception:
         return True
     def normalize_lang_code(value: Optional[str]) -> Optional[str]:  # type: ignore
         return value
+    def get_corpus_version(client=None, collection=None) -> str:  # type: ignore
+        return os.getenv("QDRANT_CORPUS_VERSION", "0")
 
 logger = logging.getLogger(__name__)
 _LANG_FILTER_WARNING_LOGGED = False
@@ -72,19 +93,12 @@ def _get_embedder():
         from .llm_adapter import embed_texts as _openai_embed
         return _openai_embed
 
-    # 2) SBERT — только если явно разрешён
+    # 2) SBERT — только если явно разрешён; модель грузится лениво (app.embed_local), не при импорте
     if "sbert" in provider:
         try:
-            from sentence_transformers import SentenceTransformer  # type: ignore
-            model_name = os.getenv("SBERT_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
-            _m = SentenceTransformer(model_name)
-
-            def _sbert_embed(texts):
-                # возвращаем list[list[float]]
-                import numpy as np
-                embs = _m.encode(texts, convert_to_numpy=True, normalize_embeddings=False)
-                return embs.tolist() if isinstance(embs, np.ndarray) else [e.tolist() for e in embs]
-            return _sbert_embed
+            from app.embed_local import encode_sync, local_embed_available
+            if local_embed_available():
+                return encode_sync
         except Exception:
             # если не установлен — просто игнорируем и падаем в общий RuntimeError ниже
             pass
@@ -96,10 +110,18 @@ def _get_embedder():
     )
 
 _EMBED = _get_embedder()
+_EMBED_IS_LOCAL = getattr(_EMBED, "__module__", "") == "app.embed_local"
 
-async def embed(text: str) -> List[float]:
+async def _embed_texts(texts: List[str]) -> List[List[float]]:
+    if _EMBED_IS_LOCAL:
+        # локальная модель: батчинг одиночных запросов + encode вне event loop
+        from app.embed_local import get_local_embedder
+        return await get_local_embedder().aembed(texts)
     # На случай тяжёлых провайдеров выполняем в пуле потоков
-    return (await asyncio.to_thread(_EMBED, [text]))[0]
+    return await asyncio.to_thread(_EMBED, texts)
+
+async def embed(text: str) -> List[float]:
+    return (await _embed_texts([text]))[0]
 
 # --- Утилиты
 def _title(payload: Dict[str, Any]) -> str:
@@ -118,16 +140,74 @@ def _chunk(payload: Dict[str, Any]) -> str:
         if payload.get(k): return str(payload[k])
     return ""
 
+_SENT_BOUNDARY_RE = re.compile(r'(?<=[\.!\?])\s+(?=[А-ЯA-ZЁ])')
+
 def _split_ru_sents(text: str) -> List[str]:
-    import re
-    parts = re.split(r'(?<=[\.!\?])\s+(?=[А-ЯA-ZЁ])', text.strip())
+    parts = _SENT_BOUNDARY_RE.split(text.strip())
     return [p.strip() for p in parts if p.strip()]
 
+def _valid_sent_ends(value: Any, text_len: int) -> Optional[List[int]]:
+    if not isinstance(value, list) or not value:
+        return None
+    prev = 0
+    for x in value:
+        if not isinstance(x, int) or x <= prev or x > text_len:
+            return None
+        prev = x
+    return value
+
+def _trim_to_sentences(chunk: str, need: int, sent_ends: Any = None) -> Tuple[str, int]:
+    """
+    Обрезает чанк до целых предложений в пределах `need` символов.
+    Если в payload есть корректные sent_ends — бинарный поиск по ним, без регэкспа и списков;
+    иначе прежний путь через _split_ru_sents. Возвращает (текст, учтённая длина) или ("", 0).
+    """
+    ends = _valid_sent_ends(sent_ends, len(chunk))
+    if ends is not None:
+        # как и в fallback-е: каждое предложение «стоит» len+1 (разделитель)
+        n = bisect.bisect_right(ends, need - 1)
+        if n <= 0:
+            return "", 0
+        cut = ends[n - 1]
+        return chunk[:cut].strip() + "…", cut + 1
+
+    sents = _split_ru_sents(chunk)
+    acc, cur = [], 0
+    for s in sents:
+        if cur + len(s) + 1 > need:
+            break
+        acc.append(s)
+        cur += len(s) + 1
+    if not acc:
+        return "", 0
+    return " ".join(acc).strip() + "…", cur
+
 def _dot(a, b): return sum(x*y for x, y in zip(a, b))
 def _norm(a): return math.sqrt(sum(x*x for x in a)) or 1.0
 def _cos(a, b): return _dot(a,b) / (_norm(a)*_norm(b))
 
-async def _qdrant_search_async(client, *, vector, limit, flt=None, with_payload=True, vector_name=None):
+_SEARCH_PARAMS: Dict[str, Any] = {}
+
+def _search_params() -> Any:
+    """
+    Параметры поиска по профилю коллекции (hnsw_ef/oversampling), считаются один раз.
+    RAG_SEARCH_HNSW_EF / RAG_SEARCH_OVERSAMPLING переопределяют профиль.
+    """
+    if "value" not in _SEARCH_PARAMS:
+        try:
+            from app.qdrant_client import profile_search_params
+            ef = os.getenv("RAG_SEARCH_HNSW_EF", "").strip()
+            ov = os.getenv("RAG_SEARCH_OVERSAMPLING", "").strip()
+            _SEARCH_PARAMS["value"] = profile_search_params(
+                hnsw_ef=int(ef) if ef else None,
+                oversampling=float(ov) if ov else None,
+            )
+        except Exception as e:
+            logger.warning("[RAG] search params unavailable: %r", e)
+            _SEARCH_PARAMS["value"] = None
+    return _SEARCH_PARAMS["value"]
+
+async def _qdrant_search_async(client, *, vector, limit, flt=None, with_payload=True, vector_name=None, payload_fields=None):
     return await asyncio.to_thread(
         qdrant_query,
         client,
@@ -137,6 +217,8 @@ async def _qdrant_search_async(client, *, vector, limit, flt=None, with_payload=
         with_payload=with_payload,
         query_filter=flt,
         vector_name=vector_name,
+        payload_fields=payload_fields,
+        search_params=_search_params(),
     )
 
 
@@ -185,21 +267,33 @@ async def build_context_mmr(
     initial_limit: int = 24,
     select: int = 6,
     max_chars: int = 1200,
-    lang: Optional[str] = None
+    lang: Optional[str] = None,
+    timings: Optional[Dict[str, float]] = None,
 ) -> Tuple[str, List[Dict[str, Any]]]:
     """
     1) ищем initial_limit кандидатов
     2) считаем эмбеддинги их текстов (локально)
     3) забираем select штук MMR-логикой
     4) собираем до max_chars с обрезкой по предложениям
+    timings — если передан, сюда пишется время стадий в мс: embed, search, cand_embed, mmr, trim.
     """
     if not (query or "").strip():
         return "", []
 
     from qdrant_client.http import models as qm  # type: ignore
 
+    t_stage = time.perf_counter()
+
+    def _mark(stage: str) -> None:
+        nonlocal t_stage
+        now = time.perf_counter()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + (now - t_stage) * 1000.0
+        t_stage = now
+
     client = get_client()
     qvec = await embed(query)
+    _mark("embed")
     _, vec_name = detect_vector_name(client, QDRANT_COLLECTION)
 
     qfilter, normalized_lang = _build_lang_filter(qm, lang)
@@ -212,6 +306,7 @@ async def build_context_mmr(
                 vector=qvec,  # type: ignore[arg-type]
                 limit=initial_limit,
                 with_payload=True,
+                payload_fields=RAG_PAYLOAD_FIELDS,
                 flt=qfilter,
                 vector_name=vec_name,
             )
@@ -225,6 +320,7 @@ async def build_context_mmr(
                     vector=qvec,  # type: ignore[arg-type]
                     limit=initial_limit,
                     with_payload=True,
+                    payload_fields=RAG_PAYLOAD_FIELDS,
                     flt=qfilter,
                     vector_name=vec_name,
                 )
@@ -234,6 +330,7 @@ async def build_context_mmr(
                     vector=qvec,  # type: ignore[arg-type]
                     limit=initial_limit,
                     with_payload=True,
+                    payload_fields=RAG_PAYLOAD_FIELDS,
                     vector_name=vec_name,
                 )
     else:
@@ -242,10 +339,12 @@ async def build_context_mmr(
             vector=qvec,  # type: ignore[arg-type]
             limit=initial_limit,
             with_payload=True,
+            payload_fields=RAG_PAYLOAD_FIELDS,
             vector_name=vec_name,
         )
 
     hits = normalize_points(hits)
+    _mark("search")
 
     cand: List[Dict[str, Any]] = []
     texts: List[str] = []
@@ -255,6 +354,7 @@ async def build_context_mmr(
         if not t:
             continue
         cand.append({
+            "id": getattr(h, "id", None),
             "text": t,
             "title": _title(payload),
             "src": _source(payload),
@@ -267,7 +367,8 @@ async def build_context_mmr(
         return "", []
 
     # Локальные эмбеддинги кандидатов (для диверсификации) — в пуле потоков
-    vecs = await asyncio.to_thread(_EMBED, texts)
+    vecs = await _embed_texts(texts)
+    _mark("cand_embed")
 
     # Похожесть запроса к каждому кандидату (пересчёт устойчивее)
     sims_q = [_cos(qvec, v) for v in vecs]
@@ -306,6 +407,7 @@ async def build_context_mmr(
             break
         selected_idx.append(best_i)
         used_sources.add(cand[best_i]["src"])
+    _mark("mmr")
 
     pieces: List[str] = []
     total = 0
@@ -318,20 +420,15 @@ async def build_context_mmr(
             pieces.append(chunk)
             total += len(chunk)
         else:
-            # обрезаем по предложениям
-            sents = _split_ru_sents(chunk)
-            acc, cur = [], 0
-            for s in sents:
-                if cur + len(s) + 1 > need:
-                    break
-                acc.append(s)
-                cur += len(s) + 1
-            if acc:
-                pieces.append(" ".join(acc).strip() + "…")
+            # обрезаем по предложениям (по готовым offsets из payload, если есть)
+            piece, cur = _trim_to_sentences(chunk, need, cand[i]["payload"].get("sent_ends"))
+            if piece:
+                pieces.append(piece)
                 total += cur
 
     ctx = "\n\n---\n\n".join(pieces).strip()
-    meta = [{"source": cand[i]["src"], "title": cand[i]["title"], "score": sims_q[i], "payload": cand[i]["payload"]} for i in selected_idx]
+    _mark("trim")
+    meta = [{"id": cand[i]["id"], "source": cand[i]["src"], "title": cand[i]["title"], "score": sims_q[i], "payload": cand[i]["payload"]} for i in selected_idx]
 
     if RAG_TRACE:
         print(f"[RAG] query='{query[:80]}', pieces={len(pieces)}, chars={len(ctx)}")
@@ -339,47 +436,317 @@ async def build_context_mmr(
     return ctx, meta
 
 # --- Сжатие контекста (опционально)
-async def compress_context(ctx: str, query: str, *, max_chars: int) -> str:
+# Кэш сжатых контекстов: ключ — (id выбранных чанков, «кластер» запроса, max_chars, версия корпуса).
+# Близкие по словам запросы к тем же чанкам переиспользуют одно сжатие.
+_COMPRESS_CACHE: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+_COMPRESS_INFLIGHT: Dict[tuple, "asyncio.Task[str]"] = {}
+_COMPRESS_LAT_MS: "deque[float]" = deque(maxlen=512)
+COMPRESS_STATS: Dict[str, Any] = {
+    "calls": 0,
+    "cache_hits": 0,
+    "compressed": 0,
+    "timeouts": 0,
+    "errors": 0,
+    "tokens_in": 0,
+    "tokens_out": 0,
+}
+
+_QCLUSTER_RE = re.compile(r"[0-9a-zа-яё]+", re.IGNORECASE)
+
+
+def _approx_tokens(text: str) -> int:
+    # грубая оценка для кириллицы: ~3 символа на токен
+    return (len(text or "") + 2) // 3
+
+
+def _query_cluster(query: str) -> str:
+    """
+    Кластер запроса: отсортированные «основы» содержательных слов (порядок и окончания не важны).
+    """
+    stems = {w[:6] for w in _QCLUSTER_RE.findall((query or "").lower()) if len(w) >= 3}
+    return " ".join(sorted(stems))
+
+
+def _compress_key(ctx: str, query: str, chunk_ids: Optional[List[Any]], max_chars: int) -> tuple:
+    ids = [str(x) for x in (chunk_ids or []) if x is not None]
+    if ids:
+        sel: Any = tuple(sorted(ids))
+    else:
+        # без id (старый payload) — ключ по самому тексту контекста
+        import hashlib
+        sel = hashlib.sha1(ctx.encode("utf-8")).hexdigest()
+    return (sel, _query_cluster(query), int(max_chars), _CORPUS_VERSION.get("value"))
+
+
+def _compress_cache_get(key: tuple) -> Optional[str]:
+    item = _COMPRESS_CACHE.get(key)
+    if item is None:
+        return None
+    if time.monotonic() - item["ts"] > RAG_COMPRESS_CACHE_TTL_SEC:
+        _COMPRESS_CACHE.pop(key, None)
+        return None
+    _COMPRESS_CACHE.move_to_end(key)
+    return item["text"]
+
+
+def _compress_cache_put(key: tuple, text: str) -> None:
+    _COMPRESS_CACHE[key] = {"text": text, "ts": time.monotonic()}
+    _COMPRESS_CACHE.move_to_end(key)
+    while len(_COMPRESS_CACHE) > RAG_COMPRESS_CACHE_MAX_ITEMS:
+        _COMPRESS_CACHE.popitem(last=False)
+
+
+async def _compress_call(ctx: str, query: str, *, max_chars: int) -> str:
+    from app.llm_adapter import complete_chat  # общий async-клиент (httpx), event loop не блокируется
+
+    sys = "Ты лаконично сжимаешь русские выдержки по психологии и КПТ, сохраняя факты и практические шаги."
+    usr = (
+        "Запрос пользователя:\n"
+        f"{query}\n\n"
+        "Ниже выдержки из статей/руководств (может быть несколько фрагментов):\n"
+        f"{ctx}\n\n"
+        "Сожми мысли в один-два абзаца понятным русским языком, без источников и ссылок. "
+        "Если есть короткие практические шаги — оставь их."
+    )
+    t0 = time.perf_counter()
+    out = await complete_chat(
+        system=sys,
+        user=usr,
+        model=RAG_COMPRESS_MODEL,
+        temperature=0.2,
+        max_completion_tokens=max(64, _approx_tokens(ctx[:max_chars])),
+    )
+    _COMPRESS_LAT_MS.append((time.perf_counter() - t0) * 1000.0)
+    out = (out or "").strip()
+    if not out:
+        return ""
+    return (out[:max_chars].rstrip() + "…") if len(out) > max_chars else out
+
+
+async def compress_context(
+    ctx: str,
+    query: str,
+    *,
+    max_chars: int,
+    chunk_ids: Optional[List[Any]] = None,
+    info: Optional[Dict[str, Any]] = None,
+) -> str:
+    """
+    Сжимает контекст LLM-ом с жёстким дедлайном (RAG_COMPRESS_TIMEOUT_SEC).
+    Не уложились/ошибка — возвращаем исходный ctx; начатое сжатие досчитывается в фоне
+    и попадает в кэш для следующего такого же запроса.
+    info["final"] — результат окончательный (сжат или сжимать нечего); False — таймаут/ошибка,
+    такой ctx нельзя надолго кэшировать поверх будущего сжатого.
+    """
+    if info is not None:
+        info["final"] = True
     if not ctx or not RAG_COMPRESS:
         return ctx
+
+    COMPRESS_STATS["calls"] += 1
+    key = _compress_key(ctx, query, chunk_ids, max_chars)
+    cached = _compress_cache_get(key)
+    if cached is not None:
+        COMPRESS_STATS["cache_hits"] += 1
+        return cached
+
+    task = _COMPRESS_INFLIGHT.get(key)
+    if task is None:
+        task = asyncio.create_task(_compress_call(ctx, query, max_chars=max_chars))
+        _COMPRESS_INFLIGHT[key] = task
+
+        def _done(t: "asyncio.Task[str]", _key: tuple = key, _ctx: str = ctx) -> None:
+            _COMPRESS_INFLIGHT.pop(_key, None)
+            if t.cancelled():
+                return
+            err = t.exception()
+            if err is not None:
+                COMPRESS_STATS["errors"] += 1
+                logger.warning("[RAG] compress failed: %r", err)
+                return
+            out = t.result()
+            if out and len(out) < len(_ctx):
+                _compress_cache_put(_key, out)
+
+        task.add_done_callback(_done)
+
     try:
-        from openai import OpenAI  # type: ignore
-        cli = OpenAI(
-            api_key=OPENROUTER_API_KEY,
-            base_url=OPENROUTER_BASE_URL or None,
-            default_headers=get_openrouter_headers() or None,
-        )
-        sys = "Ты лаконично сжимаешь русские выдержки по психологии и КПТ, сохраняя факты и практические шаги."
-        usr = (
-            "Запрос пользователя:\н"
-            f"{query}\n\n"
-            "Ниже выдержки из статей/руководств (может быть несколько фрагментов):\n"
-            f"{ctx}\n\n"
-            "Сожми мысли в один-два абзаца понятным русским языком, без источников и ссылок. "
-            "Если есть короткие практические шаги — оставь их."
-        )
-        r = cli.chat.completions.create(
-            model=resolve_model_name(RAG_COMPRESS_MODEL),
-            temperature=0.2,
-            messages=[{"role":"system","content":sys},{"role":"user","content":usr}],
-        )
-        out = (r.choices[0].message.content or "").strip()
-        if not out:
-            return ctx
-        return (out[:max_chars].rstrip()+"…") if len(out) > max_chars else out
+        out = await asyncio.wait_for(asyncio.shield(task), timeout=RAG_COMPRESS_TIMEOUT_SEC)
+    except asyncio.TimeoutError:
+        COMPRESS_STATS["timeouts"] += 1
+        if info is not None:
+            info["final"] = False
+        return ctx
     except Exception:
+        if info is not None:
+            info["final"] = False
         return ctx
 
-# --- Публичный API
-async def search_with_meta(query: str, k: int = 6, max_chars: int = 1200, lang: Optional[str] = None) -> Tuple[str, List[Dict[str, Any]]]:
-    ctx, meta = await build_context_mmr(query, initial_limit=max(16, k*4), select=k, max_chars=max_chars, lang=lang)
+    if not out or len(out) >= len(ctx):
+        return ctx
+    COMPRESS_STATS["compressed"] += 1
+    COMPRESS_STATS["tokens_in"] += _approx_tokens(ctx)
+    COMPRESS_STATS["tokens_out"] += _approx_tokens(out)
+    return out
+
+
+def get_compress_stats() -> Dict[str, Any]:
+    stats: Dict[str, Any] = dict(COMPRESS_STATS)
+    stats["tokens_saved"] = stats["tokens_in"] - stats["tokens_out"]
+    stats["cache_size"] = len(_COMPRESS_CACHE)
+    lat = sorted(_COMPRESS_LAT_MS)
+    if lat:
+        stats["latency_ms_p50"] = round(lat[len(lat) // 2], 1)
+        stats["latency_ms_p95"] = round(lat[min(len(lat) - 1, int(len(lat) * 0.95))], 1)
+    return stats
+
+# --- Кэш контекстов
+_CTX_CACHE: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+_CORPUS_VERSION: Dict[str, Any] = {"value": None, "checked_at": 0.0}
+CTX_CACHE_STATS: Dict[str, Any] = {
+    "hits": 0,
+    "misses": 0,
+    "expired": 0,
+    "evicted": 0,
+    "invalidations": 0,
+    "saved_ms_total": 0.0,
+}
+
+_QNORM_PUNCT_RE = re.compile(r"[^\w\s]+", re.UNICODE)
+_QNORM_WS_RE = re.compile(r"\s+")
+
+
+def _normalize_query(query: str) -> str:
+    q = (query or "").lower().replace("ё", "е")
+    q = _QNORM_PUNCT_RE.sub(" ", q)
+    return _QNORM_WS_RE.sub(" ", q).strip()
+
+
+async def _corpus_version() -> str:
+    """
+    Версия корпуса с редким обновлением (раз в RAG_CORPUS_VERSION_REFRESH_SEC).
+    Смена версии (ingest_qdrant.py) сбрасывает весь кэш.
+    """
+    now = time.monotonic()
+    cur = _CORPUS_VERSION.get("value")
+    if cur is not None and now - float(_CORPUS_VERSION.get("checked_at") or 0.0) < RAG_CORPUS_VERSION_REFRESH_SEC:
+        return cur
+    try:
+        ver = await asyncio.to_thread(get_corpus_version, None, QDRANT_COLLECTION)
+    except Exception:
+        ver = cur or "0"
+    _CORPUS_VERSION["checked_at"] = now
+    if cur is not None and ver != cur:
+        invalidate_ctx_cache()
+        logger.info("[rag] corpus version changed %s -> %s, context cache cleared", cur, ver)
+    _CORPUS_VERSION["value"] = ver
+    return ver
+
+
+def _cache_get(key: tuple) -> Optional[Dict[str, Any]]:
+    item = _CTX_CACHE.get(key)
+    if item is None:
+        return None
+    if time.monotonic() > float(item["expires_at"]):
+        _CTX_CACHE.pop(key, None)
+        CTX_CACHE_STATS["expired"] += 1
+        return None
+    _CTX_CACHE.move_to_end(key)
+    return item
+
+
+def _cache_put(key: tuple, ctx: str, meta: List[Dict[str, Any]], cost_ms: float) -> None:
+    _CTX_CACHE[key] = {
+        "ctx": ctx,
+        "meta": meta,
+        "cost_ms": cost_ms,
+        "expires_at": time.monotonic() + RAG_CACHE_TTL_SEC,
+    }
+    _CTX_CACHE.move_to_end(key)
+    while len(_CTX_CACHE) > RAG_CACHE_MAX_ITEMS:
+        _CTX_CACHE.popitem(last=False)
+        CTX_CACHE_STATS["evicted"] += 1
+
+
+def invalidate_ctx_cache() -> None:
+    _CTX_CACHE.clear()
+    _COMPRESS_CACHE.clear()
+    CTX_CACHE_STATS["invalidations"] += 1
+
+
+def get_ctx_cache_stats() -> Dict[str, Any]:
+    stats = dict(CTX_CACHE_STATS)
+    total = stats["hits"] + stats["misses"]
+    stats["size"] = len(_CTX_CACHE)
+    stats["hit_rate"] = round(stats["hits"] / total, 3) if total else 0.0
+    stats["saved_ms_per_hit"] = round(stats["saved_ms_total"] / stats["hits"], 1) if stats["hits"] else 0.0
+    stats["corpus_version"] = _CORPUS_VERSION.get("value")
+    return stats
+
+
+async def _search_uncached(
+    query: str,
+    k: int,
+    max_chars: int,
+    lang: Optional[str],
+    timings: Optional[Dict[str, float]] = None,
+) -> Tuple[str, List[Dict[str, Any]], bool]:
+    """(ctx, meta, final): final=False — сжатие не успело, ctx несжатый и временный."""
+    ctx, meta = await build_context_mmr(query, initial_limit=max(16, k*4), select=k, max_chars=max_chars, lang=lang, timings=timings)
+    info: Dict[str, Any] = {"final": True}
     if RAG_COMPRESS:
         limit = min(max_chars, RAG_MAX_CHARS)
-        ctx = await compress_context(ctx, query, max_chars=limit)
+        t0 = time.perf_counter()
+        ctx = await compress_context(ctx, query, max_chars=limit, chunk_ids=[m.get("id") for m in meta], info=info)
+        if timings is not None:
+            timings["compress"] = (time.perf_counter() - t0) * 1000.0
+    return ctx, meta, bool(info["final"])
+
+
+# --- Публичный API
+async def search_with_meta(
+    query: str,
+    k: int = 6,
+    max_chars: int = 1200,
+    lang: Optional[str] = None,
+    *,
+    timings: Optional[Dict[str, float]] = None,
+    use_cache: Optional[bool] = None,
+) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    timings — время стадий в мс (см. build_context_mmr; при попадании в кэш — только "cache").
+    use_cache=False — мимо кэша контекстов (для бенчмарков); None — по RAG_CACHE_ENABLED.
+    """
+    norm = _normalize_query(query)
+    cache_on = RAG_CACHE_ENABLED if use_cache is None else bool(use_cache)
+    if not cache_on or not norm:
+        ctx, meta, _ = await _search_uncached(query, k, max_chars, lang, timings)
+        return ctx, meta
+
+    t0 = time.perf_counter()
+    version = await _corpus_version()
+    key = (norm, int(k), int(max_chars), normalize_lang_code(lang) if lang else None, version)
+    item = _cache_get(key)
+    if item is not None:
+        lookup_ms = (time.perf_counter() - t0) * 1000.0
+        CTX_CACHE_STATS["hits"] += 1
+        CTX_CACHE_STATS["saved_ms_total"] += max(0.0, float(item["cost_ms"]) - lookup_ms)
+        if timings is not None:
+            timings["cache"] = lookup_ms
+        if RAG_TRACE:
+            print(f"[RAG] cache hit query='{query[:80]}' saved_ms={float(item['cost_ms']) - lookup_ms:.0f}")
+        return item["ctx"], [dict(m) for m in item["meta"]]
+
+    CTX_CACHE_STATS["misses"] += 1
+    ctx, meta, final = await _search_uncached(query, k, max_chars, lang, timings)
+    # пустой контекст не кэшируем — это может быть временный сбой Qdrant;
+    # несжатый после таймаута тоже: иначе он на весь TTL закроет сжатый, который досчитается в фоне
+    if ctx and final:
+        _cache_put(key, ctx, [dict(m) for m in meta], (time.perf_counter() - t0) * 1000.0)
     return ctx, meta
 
 async def search(query: str, k: int = 6, max_chars: int = 1200, lang: Optional[str] = None) -> str:
     ctx, _ = await search_with_meta(query, k=k, max_chars=max_chars, lang=lang)
     return ctx
 
-__all__ = ["search", "search_with_meta", "embed"]
+__all__ = ["search", "search_with_meta", "embed", "get_ctx_cache_stats", "invalidate_ctx_cache", "get_compress_stats"]
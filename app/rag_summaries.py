@@ -2,11 +2,15 @@
 from __future__ import annotations
 from typing import Any, Dict, List, Optional
 from datetime import datetime
+from collections import OrderedDict
 import os
+import time
 import inspect
 import asyncio
 import random
 
+import numpy as np
+
 # Универсальные модели Qdrant
 from qdrant_client.http import models as qm  # type: ignore
 
@@ -16,12 +20,35 @@ from app.qdrant_client import (
     qdrant_query,
     normalize_points,
     ensure_summaries_collection,
+    payload_selector,
+    summaries_tenant_payload,
+    summaries_user_condition,
+    summaries_shard_key,
+    create_summaries_collection,
 )
-from app.rag_qdrant import embed  # тот же эмбеддер, что в основном RAG
+from app.rag_qdrant import embed, _embed_texts  # тот же эмбеддер, что в основном RAG
+from app.services.rate_limit import TokenBucket, get_bucket, is_rate_limit_error
+from app.services.stage_metrics import SUMMARY_METRICS
 
 # === Конфиги ===
 SUMMARIES_COLLECTION = os.getenv("QDRANT_SUMMARIES_COLLECTION", "dialog_summaries_v1")
 
+# Пер-юзерный кэш саммарей в памяти процесса (векторы + тексты), LRU по пользователям
+SUMMARY_CACHE_ENABLED = os.getenv("SUMMARY_CACHE_ENABLED", "1") == "1"
+SUMMARY_CACHE_TTL_SEC = float(os.getenv("SUMMARY_CACHE_TTL_SEC", "1800") or "1800")
+SUMMARY_CACHE_MAX_MB = float(os.getenv("SUMMARY_CACHE_MAX_MB", "64") or "64")
+SUMMARY_CACHE_MAX_POINTS_PER_USER = int(os.getenv("SUMMARY_CACHE_MAX_POINTS_PER_USER", "1000") or "1000")
+
+# Пакетная запись из батч-джобов: эмбеддинги и upsert'ы пачками
+SUMMARY_EMBED_BATCH = max(1, int(os.getenv("SUMMARY_EMBED_BATCH", "64") or "64"))
+SUMMARY_UPSERT_BATCH = max(1, int(os.getenv("SUMMARY_UPSERT_BATCH", "128") or "128"))
+
+# Текст и период саммари берём из payload (raw), а не отдельным SELECT в Postgres
+SUMMARY_PAYLOAD_TEXT = os.getenv("SUMMARY_PAYLOAD_TEXT", "1") == "1"
+# Только нужные поля payload: без tags/len и прочего
+_SEARCH_PAYLOAD_FIELDS = ["kind", "period_start", "period_end"]
+_SEARCH_PAYLOAD_FIELDS_WITH_TEXT = _SEARCH_PAYLOAD_FIELDS + ["raw"]
+
 def _safe_print(*args: Any) -> None:
     try:
         print(*args)
@@ -41,26 +68,25 @@ def _ensure_collection() -> None:
 _LOGGED_SUMMARY_ONCE = False
 
 
-async def _maybe_embed(text: str) -> List[float]:
-    """
-    Поддержка и sync, и async embed() реализаций.
-    """
-    def _is_rate_limit_error(err: Exception) -> bool:
-        s = str(err).lower()
-        return "429" in s or "too many requests" in s or "rate limit" in s
-
+async def _with_embed_retry(call, bucket: Optional[TokenBucket] = None):
     max_retries = int(os.getenv("EMBED_RETRY_MAX", "5") or "5")
     base = float(os.getenv("EMBED_RETRY_BASE_SEC", "1") or "1")
     max_backoff = float(os.getenv("EMBED_RETRY_MAX_BACKOFF_SEC", "30") or "30")
 
     for attempt in range(max_retries + 1):
         try:
-            res = embed(text)
+            if bucket is not None:
+                await bucket.acquire()
+            res = call()
             if inspect.isawaitable(res):
-                return await res  # type: ignore
+                res = await res
+            if bucket is not None:
+                bucket.on_success()
             return res  # type: ignore
         except Exception as e:
-            if _is_rate_limit_error(e) and attempt < max_retries:
+            if is_rate_limit_error(e) and bucket is not None:
+                bucket.on_rate_limit()
+            if is_rate_limit_error(e) and attempt < max_retries:
                 delay = min(max_backoff, base * (2 ** attempt)) + random.random()
                 _safe_print(f"[summaries] embed 429 retry attempt={attempt+1} delay={delay:.2f}s")
                 await asyncio.sleep(delay)
@@ -68,6 +94,28 @@ async def _maybe_embed(text: str) -> List[float]:
             raise RuntimeError(f"embeddings failed: {e}") from e
 
 
+async def _maybe_embed(text: str) -> List[float]:
+    """
+    Поддержка и sync, и async embed() реализаций.
+    """
+    return await _with_embed_retry(lambda: embed(text))
+
+
+async def _maybe_embed_many(texts: List[str]) -> List[List[float]]:
+    """
+    Батч-эмбеддинг одним запросом к провайдеру (тот же ретрай на 429).
+    Идёт через общий bucket "embed" (SUMMARY_EMBED_RPM) — батч-джобы делят лимит провайдера.
+    """
+    if not texts:
+        return []
+    with SUMMARY_METRICS.time("embed"):
+        vecs = await _with_embed_retry(lambda: _embed_texts(list(texts)), bucket=get_bucket("embed"))
+    SUMMARY_METRICS.incr("embed_texts", len(texts))
+    if len(vecs) != len(texts):
+        raise RuntimeError(f"embeddings failed: got {len(vecs)} vectors for {len(texts)} texts")
+    return vecs
+
+
 def _call_search(
     client,
     *,
@@ -76,6 +124,8 @@ def _call_search(
     limit: int,
     use_named: bool,
     vector_name: Optional[str],
+    payload_fields: Optional[List[str]] = None,
+    shard_key: Optional[str] = None,
 ):
     """
     Унифицированный вызов поиска через qdrant_query (query_points/search_points/search).
@@ -88,9 +138,60 @@ def _call_search(
         limit=int(limit),
         with_payload=True,
         vector_name=(vector_name or "default") if use_named else vector_name,
+        payload_fields=payload_fields,
+        shard_key_selector=shard_key,
     )
 
 
+def _upsert_kwargs(user_id: int) -> Dict[str, Any]:
+    sk = summaries_shard_key(user_id)
+    return {"shard_key_selector": sk} if sk is not None else {}
+
+
+def _summary_payload(
+    user_id: int,
+    kind: str,
+    text: str,
+    period_start: datetime,
+    period_end: datetime,
+    tags: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    return {
+        **summaries_tenant_payload(user_id),
+        "kind": str(kind),
+        "period_start": period_start.isoformat(),
+        "period_end": period_end.isoformat(),
+        "len": len(text or ""),
+        "tags": tags or [],
+        "raw": text,
+    }
+
+
+async def mark_summaries_indexed(items: List[Dict[str, Any]]) -> None:
+    """
+    dialog_summaries.indexed_at = NOW() для записанных в Qdrant точек ([{summary_id, text}, ...]).
+    Только если в строке всё ещё тот же текст: строку могли переписать, пока шёл эмбеддинг.
+    По indexed_at make_daily решает, можно ли пропустить день как актуальный.
+    Best-effort: без отметки точка просто перезапишется при следующем прогоне.
+    """
+    if not items:
+        return
+    from sqlalchemy import text as sql
+    from app.db.core import async_session
+
+    try:
+        async with async_session() as s:
+            await s.execute(sql("""
+                UPDATE dialog_summaries d
+                SET indexed_at = NOW()
+                FROM unnest(CAST(:ids AS bigint[]), CAST(:texts AS text[])) AS u(id, text)
+                WHERE d.id = u.id AND d.text = u.text
+            """), {"ids": [int(it["summary_id"]) for it in items], "texts": [it["text"] for it in items]})
+            await s.commit()
+    except Exception as e:
+        _safe_print(f"[summaries] mark indexed failed n={len(items)}: {e!r}")
+
+
 async def upsert_summary_point(
     *,
     summary_id: int,
@@ -107,16 +208,9 @@ async def upsert_summary_point(
     """
     _ensure_collection()
 
-    vec = await _maybe_embed(text)
-    payload = {
-        "user_id": int(user_id),
-        "kind": str(kind),
-        "period_start": period_start.isoformat(),
-        "period_end": period_end.isoformat(),
-        "len": len(text or ""),
-        "tags": tags or [],
-        "raw": text,
-    }
+    with SUMMARY_METRICS.time("embed"):
+        vec = await _maybe_embed(text)
+    payload = _summary_payload(user_id, kind, text, period_start, period_end, tags)
 
     client = get_client()
     mode, vname = detect_vector_name(client, SUMMARIES_COLLECTION)
@@ -128,7 +222,9 @@ async def upsert_summary_point(
             pt = qm.PointStruct(id=int(summary_id), vector={vname: vec}, payload=payload)  # type: ignore
         else:
             pt = qm.PointStruct(id=int(summary_id), vector=vec, payload=payload)
-        client.upsert(collection_name=SUMMARIES_COLLECTION, points=[pt])
+        client.upsert(collection_name=SUMMARIES_COLLECTION, points=[pt], **_upsert_kwargs(user_id))
+        invalidate_user_summaries_cache(user_id)
+        await mark_summaries_indexed([{"summary_id": summary_id, "text": text}])
         return
     except Exception as e_first:
         _safe_print(f"[summaries] upsert primary mode failed, fallback: {e_first!r}")
@@ -139,18 +235,181 @@ async def upsert_summary_point(
             pt = qm.PointStruct(id=int(summary_id), vector=vec, payload=payload)
         else:
             pt = qm.PointStruct(id=int(summary_id), vector={vname: vec}, payload=payload)  # type: ignore
-        client.upsert(collection_name=SUMMARIES_COLLECTION, points=[pt])
+        client.upsert(collection_name=SUMMARIES_COLLECTION, points=[pt], **_upsert_kwargs(user_id))
     except Exception as e:
         raise RuntimeError(f"Qdrant upsert failed for summary_id={summary_id}: {e}") from e
+    invalidate_user_summaries_cache(user_id)
+    await mark_summaries_indexed([{"summary_id": summary_id, "text": text}])
+
+
+
+def _point(summary_id: int, vec: List[float], payload: Dict[str, Any], *, named: bool, vname: Optional[str]):
+    if named:
+        return qm.PointStruct(id=int(summary_id), vector={vname: vec}, payload=payload)  # type: ignore
+    return qm.PointStruct(id=int(summary_id), vector=vec, payload=payload)
+
+
+def _upsert_chunk(client, items: List[Dict[str, Any]], vecs: List[List[float]], *, wait: bool) -> None:
+    """
+    Один чанк: формат вектора (named/single) определяется один раз на чанк, при ошибке —
+    повтор всего чанка в другом формате. Точки группируются по shard key.
+    """
+    mode, vname = detect_vector_name(client, SUMMARIES_COLLECTION)
+    prefer_named = mode == "named"
+
+    def _send(named: bool) -> None:
+        groups: Dict[Optional[str], List[Any]] = {}
+        for it, vec in zip(items, vecs):
+            payload = _summary_payload(
+                it["user_id"], it["kind"], it["text"], it["period_start"], it["period_end"], it.get("tags")
+            )
+            pt = _point(it["summary_id"], vec, payload, named=named, vname=vname)
+            groups.setdefault(summaries_shard_key(int(it["user_id"])), []).append(pt)
+        for key, points in groups.items():
+            kwargs: Dict[str, Any] = {"shard_key_selector": key} if key is not None else {}
+            client.upsert(collection_name=SUMMARIES_COLLECTION, points=points, wait=wait, **kwargs)
+
+    try:
+        _send(prefer_named)
+        return
+    except Exception as e_first:
+        _safe_print(f"[summaries] bulk upsert primary mode failed, fallback: {e_first!r}")
+    try:
+        _send(not prefer_named)
+    except Exception as e:
+        ids = [it["summary_id"] for it in items]
+        raise RuntimeError(f"Qdrant bulk upsert failed for summary_ids={ids[:5]}...: {e}") from e
+
+
+async def upsert_summary_points_bulk(
+    items: List[Dict[str, Any]],
+    *,
+    embed_batch: Optional[int] = None,
+    upsert_batch: Optional[int] = None,
+) -> Dict[str, int]:
+    """
+    Пакетный аналог upsert_summary_point для батч-джобов.
+    items: [{summary_id, user_id, kind, text, period_start, period_end, tags?}, ...]
+
+    - коллекция проверяется один раз на вызов;
+    - эмбеддинги — пачками по embed_batch (SUMMARY_EMBED_BATCH);
+    - upsert — чанками по upsert_batch (SUMMARY_UPSERT_BATCH) с wait=False,
+      последний чанк ждём, чтобы к возврату все точки были применены.
+    """
+    stats = {"points": 0, "embed_calls": 0, "upsert_calls": 0}
+    items = [it for it in items or [] if (it.get("text") or "").strip()]
+    if not items:
+        return stats
+
+    embed_batch = max(1, int(embed_batch or SUMMARY_EMBED_BATCH))
+    upsert_batch = max(1, int(upsert_batch or SUMMARY_UPSERT_BATCH))
+
+    _ensure_collection()
+    client = get_client()
+
+    vecs: List[List[float]] = []
+    for i in range(0, len(items), embed_batch):
+        vecs.extend(await _maybe_embed_many([it["text"] for it in items[i : i + embed_batch]]))
+        stats["embed_calls"] += 1
+
+    for i in range(0, len(items), upsert_batch):
+        last = i + upsert_batch >= len(items)
+        with SUMMARY_METRICS.time("qdrant_upsert"):
+            await asyncio.to_thread(
+                _upsert_chunk, client, items[i : i + upsert_batch], vecs[i : i + upsert_batch], wait=last
+            )
+        stats["upsert_calls"] += 1
+
+    stats["points"] = len(items)
+    for uid in {int(it["user_id"]) for it in items}:
+        invalidate_user_summaries_cache(uid)
+    await mark_summaries_indexed(items)
+    return stats
+
+
+class SummaryBatch:
+    """
+    Накопитель точек для батч-джобов: make_daily/rollup_* кладут сюда готовые саммари
+    вместо поштучного upsert, сброс — пачкой через upsert_summary_points_bulk
+    (автоматически при flush_size или явно в конце джоба).
+    Неудачный сброс возвращает точки в начало буфера и пробрасывает ошибку: следующий flush
+    повторит их, а то, что осталось в буфере после финального flush (pending_ids), не записано.
+    """
+
+    def __init__(self, flush_size: Optional[int] = None):
+        self.flush_size = max(1, int(flush_size or SUMMARY_UPSERT_BATCH))
+        self.items: List[Dict[str, Any]] = []
+        self.stats: Dict[str, int] = {"points": 0, "embed_calls": 0, "upsert_calls": 0, "flushes": 0, "errors": 0}
+        self._lock = asyncio.Lock()
+        # после ошибки следующий авто-flush — только через flush_size новых точек,
+        # а не на каждом add (каждый повтор заново эмбеддит весь буфер)
+        self._auto_at = self.flush_size
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def pending_ids(self) -> List[int]:
+        """summary_id точек, которые ещё не записаны в Qdrant."""
+        return [int(it["summary_id"]) for it in self.items]
+
+    async def add(
+        self,
+        *,
+        summary_id: int,
+        user_id: int,
+        kind: str,
+        text: str,
+        period_start: datetime,
+        period_end: datetime,
+        tags: Optional[List[str]] = None,
+    ) -> None:
+        self.items.append({
+            "summary_id": summary_id, "user_id": user_id, "kind": kind, "text": text,
+            "period_start": period_start, "period_end": period_end, "tags": tags,
+        })
+        if len(self.items) >= self._auto_at:
+            await self.flush()
+
+    async def flush(self) -> Dict[str, int]:
+        async with self._lock:
+            items, self.items = self.items, []
+            if not items:
+                return {"points": 0}
+            try:
+                res = await upsert_summary_points_bulk(items)
+            except Exception:
+                # пока шёл upsert, add() мог добавить новые точки — неудачные встают перед ними
+                self.items[:0] = items
+                self.stats["errors"] += 1
+                self._auto_at = len(self.items) + self.flush_size
+                raise
+            self._auto_at = self.flush_size
+            for k, v in res.items():
+                self.stats[k] = self.stats.get(k, 0) + int(v)
+            self.stats["flushes"] += 1
+            return res
+
+
+async def _reset_indexed(user_id: int) -> None:
+    """Точек пользователя больше нет — indexed_at снимается, make_daily перепишет их (reindexed)."""
+    from sqlalchemy import text as sql
+    from app.db.core import async_session
+
+    async with async_session() as s:
+        await s.execute(
+            sql("UPDATE dialog_summaries SET indexed_at = NULL WHERE user_id = :uid AND indexed_at IS NOT NULL"),
+            {"uid": int(user_id)},
+        )
+        await s.commit()
 
 
 async def delete_user_summaries(user_id: int) -> None:
     """
-    Удаляет ВСЕ саммари пользователя из коллекции.
+    Удаляет ВСЕ саммари пользователя из коллекции (и сбрасывает их indexed_at в Postgres).
     """
     _ensure_collection()
     client = get_client()
-    f = qm.Filter(must=[qm.FieldCondition(key="user_id", match=qm.MatchValue(value=int(user_id)))])
+    f = qm.Filter(must=[summaries_user_condition(user_id)])
 
     # Новые клиенты ожидают FilterSelector, старые — словарь/ключ "filter"
     try:
@@ -158,6 +417,36 @@ async def delete_user_summaries(user_id: int) -> None:
         client.delete(collection_name=SUMMARIES_COLLECTION, points_selector=selector)
     except Exception:
         client.delete(collection_name=SUMMARIES_COLLECTION, points_selector={"filter": f})  # type: ignore
+    invalidate_user_summaries_cache(user_id)
+    await _reset_indexed(user_id)
+
+
+async def delete_summary_points(by_user: Dict[int, List[int]]) -> int:
+    """
+    Удаляет точки конкретных саммарей (id точки = dialog_summaries.id): {user_id: [summary_id, ...]}.
+    Группировка по shard key, как в upsert; кэш затронутых пользователей сбрасывается.
+    Возвращает число запрошенных к удалению точек.
+    """
+    _ensure_collection()
+    client = get_client()
+    groups: Dict[Optional[str], List[int]] = {}
+    for uid, ids in by_user.items():
+        if ids:
+            groups.setdefault(summaries_shard_key(int(uid)), []).extend(int(x) for x in ids)
+    total = 0
+    for key, ids in groups.items():
+        kwargs: Dict[str, Any] = {"shard_key_selector": key} if key is not None else {}
+        await asyncio.to_thread(
+            client.delete,
+            collection_name=SUMMARIES_COLLECTION,
+            points_selector=qm.PointIdsList(points=ids),
+            wait=True,
+            **kwargs,
+        )
+        total += len(ids)
+    for uid in by_user:
+        invalidate_user_summaries_cache(uid)
+    return total
 
 
 async def search_summaries(
@@ -166,18 +455,22 @@ async def search_summaries(
     query: str,
     top_k: int = 4,
     kinds: Optional[List[str]] = None,
+    with_text: Optional[bool] = None,
 ) -> List[Dict[str, Any]]:
     """
     Поиск релевантных саммарей пользователя. Можно сузить по видам (daily/weekly/monthly).
     Возвращает: summary_id, score, kind, period_start, period_end.
+    with_text=True (по умолчанию SUMMARY_PAYLOAD_TEXT) — ещё и "text" из payload.raw;
+    у старых точек без raw text=None, их добирают из Postgres.
     """
+    if with_text is None:
+        with_text = SUMMARY_PAYLOAD_TEXT
+    payload_fields = _SEARCH_PAYLOAD_FIELDS_WITH_TEXT if with_text else _SEARCH_PAYLOAD_FIELDS
     _ensure_collection()
     client = get_client()
     vec = await _maybe_embed(query)
 
-    must_filters: List[qm.FieldCondition] = [
-        qm.FieldCondition(key="user_id", match=qm.MatchValue(value=int(user_id)))
-    ]
+    must_filters: List[qm.FieldCondition] = [summaries_user_condition(user_id)]
     if kinds:
         try:
             must_filters.append(qm.FieldCondition(key="kind", match=qm.MatchAny(any=[str(k) for k in kinds])))
@@ -189,13 +482,14 @@ async def search_summaries(
 
     mode, vname = detect_vector_name(client, SUMMARIES_COLLECTION)
     prefer_named = mode == "named"
+    shard_key = summaries_shard_key(user_id)
 
     # Сначала пробуем primary режим, затем fallback
     try:
-        res = _call_search(client, vector=vec, flt=f, limit=int(top_k), use_named=prefer_named, vector_name=vname)
+        res = _call_search(client, vector=vec, flt=f, limit=int(top_k), use_named=prefer_named, vector_name=vname, payload_fields=payload_fields, shard_key=shard_key)
     except Exception as e_first:
         _safe_print(f"[summaries] search primary failed, fallback: {e_first!r}")
-        res = _call_search(client, vector=vec, flt=f, limit=int(top_k), use_named=not prefer_named, vector_name=vname)
+        res = _call_search(client, vector=vec, flt=f, limit=int(top_k), use_named=not prefer_named, vector_name=vname, payload_fields=payload_fields, shard_key=shard_key)
 
     raw_type = type(res)
     res = normalize_points(res)
@@ -212,13 +506,365 @@ async def search_summaries(
     out: List[Dict[str, Any]] = []
     for r in res or []:
         p = r.payload or {}
-        out.append(
-            {
-                "summary_id": int(r.id) if r.id is not None else None,
-                "score": float(r.score) if r.score is not None else 0.0,
-                "kind": p.get("kind"),
-                "period_start": p.get("period_start"),
-                "period_end": p.get("period_end"),
-            }
+        item = {
+            "summary_id": int(r.id) if r.id is not None else None,
+            "score": float(r.score) if r.score is not None else 0.0,
+            "kind": p.get("kind"),
+            "period_start": p.get("period_start"),
+            "period_end": p.get("period_end"),
+        }
+        if with_text:
+            item["text"] = p.get("raw") or None
+        out.append(item)
+    return out
+
+
+# === Пер-юзерный кэш долгой памяти ===
+# У пользователя максимум несколько сотен саммарей: держим их векторы и тексты в памяти
+# и считаем top-k косинусом локально — без filtered search в Qdrant и SELECT в Postgres.
+
+_USER_CACHE: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+_USER_CACHE_BYTES = 0
+SUMMARY_CACHE_STATS: Dict[str, int] = {
+    "hits": 0,
+    "misses": 0,
+    "empty_hits": 0,
+    "loads": 0,
+    "evicted": 0,
+    "invalidations": 0,
+    "too_large": 0,
+}
+
+
+def invalidate_user_summaries_cache(user_id: Optional[int] = None) -> None:
+    """
+    Сбрасывает кэш пользователя (или весь, если user_id=None).
+    Вызывается из upsert_summary_point / delete_user_summaries.
+    """
+    global _USER_CACHE_BYTES
+    if user_id is None:
+        _USER_CACHE.clear()
+        _USER_CACHE_BYTES = 0
+    else:
+        entry = _USER_CACHE.pop(int(user_id), None)
+        if entry is not None:
+            _USER_CACHE_BYTES -= int(entry.get("bytes") or 0)
+    SUMMARY_CACHE_STATS["invalidations"] += 1
+
+
+def _point_vector(p) -> Optional[List[float]]:
+    vec = getattr(p, "vector", None)
+    if isinstance(vec, dict):
+        vec = next(iter(vec.values()), None) if vec else None
+    if vec is None:
+        return None
+    return list(vec)
+
+
+def _scroll_user_points(client, user_id: int) -> List[Any]:
+    f = qm.Filter(must=[summaries_user_condition(user_id)])
+    out: List[Any] = []
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=SUMMARIES_COLLECTION,
+            scroll_filter=f,
+            with_payload=payload_selector(_SEARCH_PAYLOAD_FIELDS_WITH_TEXT),
+            with_vectors=True,
+            limit=256,
+            offset=offset,
         )
+        out.extend(points or [])
+        if len(out) > SUMMARY_CACHE_MAX_POINTS_PER_USER or not offset:
+            break
     return out
+
+
+async def _fetch_summary_rows(ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    if not ids:
+        return {}
+    from sqlalchemy import text as sql
+    from app.db.core import async_session
+
+    async with async_session() as s:
+        rows = (await s.execute(
+            sql("SELECT id, text, period_start, period_end FROM dialog_summaries WHERE id = ANY(:ids)"),
+            {"ids": [int(x) for x in ids]},
+        )).mappings().all()
+    return {int(r["id"]): dict(r) for r in rows}
+
+
+async def _load_user_entry(user_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Грузит все саммари пользователя одним scroll'ом. Для старых точек без payload.raw
+    тексты добираются одним SELECT'ом. None — пользователь слишком «большой» для кэша.
+    """
+    _ensure_collection()
+    client = get_client()
+    points = await asyncio.to_thread(_scroll_user_points, client, user_id)
+    if len(points) > SUMMARY_CACHE_MAX_POINTS_PER_USER:
+        SUMMARY_CACHE_STATS["too_large"] += 1
+        return None
+
+    items: List[Dict[str, Any]] = []
+    vecs: List[List[float]] = []
+    for p in points:
+        v = _point_vector(p)
+        if not v or p.id is None:
+            continue
+        pl = p.payload or {}
+        items.append({
+            "summary_id": int(p.id),
+            "kind": pl.get("kind"),
+            "period_start": pl.get("period_start"),
+            "period_end": pl.get("period_end"),
+            "text": pl.get("raw"),
+        })
+        vecs.append(v)
+
+    missing = [it["summary_id"] for it in items if not it.get("text")]
+    if missing:
+        by_id = await _fetch_summary_rows(missing)
+        for it in items:
+            if not it.get("text"):
+                it["text"] = (by_id.get(it["summary_id"]) or {}).get("text")
+
+    if vecs:
+        mat = np.asarray(vecs, dtype=np.float32)
+        norms = np.linalg.norm(mat, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        mat = mat / norms
+    else:
+        mat = np.zeros((0, 0), dtype=np.float32)
+
+    size = int(mat.nbytes) + sum(len(it.get("text") or "") * 2 + 200 for it in items)
+    return {"items": items, "mat": mat, "bytes": size, "expires_at": time.monotonic() + SUMMARY_CACHE_TTL_SEC}
+
+
+def _cache_store(user_id: int, entry: Dict[str, Any]) -> None:
+    global _USER_CACHE_BYTES
+    old = _USER_CACHE.pop(user_id, None)
+    if old is not None:
+        _USER_CACHE_BYTES -= int(old.get("bytes") or 0)
+    _USER_CACHE[user_id] = entry
+    _USER_CACHE_BYTES += int(entry.get("bytes") or 0)
+    cap = int(SUMMARY_CACHE_MAX_MB * 1024 * 1024)
+    while _USER_CACHE_BYTES > cap and len(_USER_CACHE) > 1:
+        _, ev = _USER_CACHE.popitem(last=False)
+        _USER_CACHE_BYTES -= int(ev.get("bytes") or 0)
+        SUMMARY_CACHE_STATS["evicted"] += 1
+
+
+def _cache_lookup(user_id: int) -> Optional[Dict[str, Any]]:
+    entry = _USER_CACHE.get(user_id)
+    if entry is None:
+        return None
+    if time.monotonic() > float(entry["expires_at"]):
+        invalidate_user_summaries_cache(user_id)
+        return None
+    _USER_CACHE.move_to_end(user_id)
+    return entry
+
+
+def _rank_local(entry: Dict[str, Any], qvec: List[float], *, top_k: int, kinds: Optional[List[str]]) -> List[Dict[str, Any]]:
+    items = entry["items"]
+    mat = entry["mat"]
+    if not items:
+        return []
+    q = np.asarray(qvec, dtype=np.float32)
+    qn = float(np.linalg.norm(q)) or 1.0
+    scores = mat @ (q / qn)
+    order = np.argsort(-scores)
+    allowed = {str(k) for k in kinds} if kinds else None
+    out: List[Dict[str, Any]] = []
+    for i in order:
+        it = items[int(i)]
+        if allowed is not None and str(it.get("kind")) not in allowed:
+            continue
+        out.append({**it, "score": float(scores[int(i)])})
+        if len(out) >= int(top_k):
+            break
+    return out
+
+
+async def search_summaries_cached(
+    *,
+    user_id: int,
+    query: str,
+    top_k: int = 4,
+    kinds: Optional[List[str]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Как search_summaries, но из пер-юзерного кэша; в результатах есть "text".
+    Пользователь без саммарей тоже кэшируется — для него не считаем даже эмбеддинг.
+    """
+    if not SUMMARY_CACHE_ENABLED:
+        return await search_summaries(user_id=user_id, query=query, top_k=top_k, kinds=kinds)
+
+    uid = int(user_id)
+    entry = _cache_lookup(uid)
+    if entry is None:
+        SUMMARY_CACHE_STATS["misses"] += 1
+        entry = await _load_user_entry(uid)
+        SUMMARY_CACHE_STATS["loads"] += 1
+        if entry is None:
+            return await search_summaries(user_id=uid, query=query, top_k=top_k, kinds=kinds)
+        _cache_store(uid, entry)
+    else:
+        SUMMARY_CACHE_STATS["hits"] += 1
+
+    if not entry["items"]:
+        SUMMARY_CACHE_STATS["empty_hits"] += 1
+        return []
+
+    vec = await _maybe_embed(query)
+    return _rank_local(entry, vec, top_k=top_k, kinds=kinds)
+
+
+# === Бэкфилл payload.raw для старых точек ===
+
+def _scroll_points_without_raw(client, *, limit: int, offset):
+    flt = qm.Filter(must=[qm.IsEmptyCondition(is_empty=qm.PayloadField(key="raw"))])
+    return client.scroll(
+        collection_name=SUMMARIES_COLLECTION,
+        scroll_filter=flt,
+        with_payload=False,
+        with_vectors=False,
+        limit=int(limit),
+        offset=offset,
+    )
+
+
+def _set_payloads(client, payloads: Dict[int, Dict[str, Any]]) -> None:
+    try:
+        ops = [
+            qm.SetPayloadOperation(set_payload=qm.SetPayload(payload=pl, points=[pid]))
+            for pid, pl in payloads.items()
+        ]
+        client.batch_update_points(collection_name=SUMMARIES_COLLECTION, update_operations=ops)
+    except Exception as e:
+        _safe_print(f"[summaries] batch set_payload failed, per-point fallback: {e!r}")
+        for pid, pl in payloads.items():
+            client.set_payload(collection_name=SUMMARIES_COLLECTION, payload=pl, points=[pid])
+
+
+async def backfill_summary_payloads(*, batch: int = 256, dry_run: bool = False) -> Dict[str, int]:
+    """
+    Дописывает raw/period_start/period_end/len в payload точек, созданных до того,
+    как текст стал храниться в Qdrant. Источник — dialog_summaries.
+    Возвращает счётчики: scanned, updated, missing_in_db; при dry_run вместо updated — would_update.
+    """
+    _ensure_collection()
+    client = get_client()
+    stats = {"scanned": 0, "updated": 0, "would_update": 0, "missing_in_db": 0}
+    offset = None
+    while True:
+        points, next_offset = await asyncio.to_thread(_scroll_points_without_raw, client, limit=batch, offset=offset)
+        ids = [int(p.id) for p in (points or []) if p.id is not None]
+        stats["scanned"] += len(ids)
+        rows = await _fetch_summary_rows(ids)
+        payloads: Dict[int, Dict[str, Any]] = {}
+        for pid in ids:
+            r = rows.get(pid)
+            if not r or not (r.get("text") or "").strip():
+                stats["missing_in_db"] += 1
+                continue
+            payloads[pid] = {
+                "raw": r["text"],
+                "len": len(r["text"]),
+                "period_start": r["period_start"].isoformat() if r.get("period_start") else None,
+                "period_end": r["period_end"].isoformat() if r.get("period_end") else None,
+            }
+        if dry_run:
+            stats["would_update"] += len(payloads)
+        elif payloads:
+            await asyncio.to_thread(_set_payloads, client, payloads)
+            stats["updated"] += len(payloads)
+        # без dry_run обновлённые точки выпадают из фильтра — offset нужен только для пропущенных
+        offset = next_offset
+        if not next_offset:
+            break
+    if stats["updated"]:
+        invalidate_user_summaries_cache()
+    _safe_print(f"[summaries] backfill payloads done: {stats}")
+    return stats
+
+
+# === Миграция на tenant-раскладку ===
+
+def _group_by_shard(points: List[Any], shards: int) -> Dict[Optional[str], List[Any]]:
+    groups: Dict[Optional[str], List[Any]] = {}
+    for p in points:
+        uid = (p.payload or {}).get("user_id")
+        key = summaries_shard_key(int(uid), shards=shards) if uid is not None else None
+        groups.setdefault(key, []).append(p)
+    return groups
+
+
+async def migrate_summaries_collection(
+    *,
+    target: str,
+    layout: str = "tenant",
+    shards: int = 0,
+    batch: int = 256,
+    dry_run: bool = False,
+) -> Dict[str, int]:
+    """
+    Пересоздаёт коллекцию саммарей в новой раскладке: создаёт `target`, переносит точки
+    батчами (векторы как есть, без повторного эмбеддинга), дописывает tenant_id.
+    Источник не трогаем — переключение через QDRANT_SUMMARIES_COLLECTION/QDRANT_SUMMARIES_LAYOUT.
+    Повторный запуск безопасен: существующий `target` той же раскладки переиспользуется,
+    точки с теми же id перезаписываются — прерванную миграцию можно просто запустить снова.
+    """
+    client = get_client()
+    if target == SUMMARIES_COLLECTION:
+        raise ValueError("target must differ from the source collection")
+    stats = {"scanned": 0, "moved": 0, "skipped_no_user": 0, "created": 0}
+    if not dry_run:
+        created = await asyncio.to_thread(
+            create_summaries_collection, client, target, layout=layout, shards=shards, exist_ok=True
+        )
+        stats["created"] = int(created)
+
+    offset = None
+    while True:
+        points, offset = await asyncio.to_thread(
+            client.scroll,
+            collection_name=SUMMARIES_COLLECTION,
+            with_payload=True,
+            with_vectors=True,
+            limit=int(batch),
+            offset=offset,
+        )
+        points = points or []
+        stats["scanned"] += len(points)
+        out: List[Any] = []
+        for p in points:
+            payload = dict(p.payload or {})
+            uid = payload.get("user_id")
+            if uid is None:
+                stats["skipped_no_user"] += 1
+                continue
+            payload.update(summaries_tenant_payload(int(uid)))
+            out.append(qm.PointStruct(id=p.id, vector=p.vector, payload=payload))
+        if out and not dry_run:
+            for key, group in _group_by_shard(out, shards).items():
+                kwargs: Dict[str, Any] = {"shard_key_selector": key} if key is not None else {}
+                # wait=False: индексация идёт в фоне, последний батч ниже — с ожиданием
+                await asyncio.to_thread(
+                    client.upsert, collection_name=target, points=group, wait=not offset, **kwargs
+                )
+        stats["moved"] += len(out)
+        if not offset:
+            break
+    _safe_print(f"[summaries] migrate {SUMMARIES_COLLECTION} -> {target} layout={layout} shards={shards}: {stats}")
+    return stats
+
+
+def get_summary_cache_stats() -> Dict[str, Any]:
+    stats: Dict[str, Any] = dict(SUMMARY_CACHE_STATS)
+    stats["users"] = len(_USER_CACHE)
+    stats["bytes"] = _USER_CACHE_BYTES
+    total = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / total, 3) if total else 0.0
+    return stats
@@ -0,0 +1,148 @@
+# app/services/message_filter.py
+from __future__ import annotations
+
+import re
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, Optional, Set, Tuple
+
+from app.services.near_dedup import NearDuplicateIndex, normalize_for_dedup
+
+# Очистка сообщений дня перед суммаризацией, по одному сообщению (потоково):
+# - логи нажатий "[cb] ..." от LogIncomingMiddleware, команды "/menu" и тексты кнопок меню —
+#   это навигация, а не разговор;
+# - точные повторы той же роли в недавнем окне (двойное логирование: mw_log_messages
+#   и LogIncomingMiddleware пишут одно и то же сообщение пользователя);
+# - почти-дубликаты длинных ответов бота (шаблоны пейволла/онбординга) — MinHash из near_dedup;
+# - длинные ответы бота обрезаются: для саммари важна суть, а не весь текст.
+# Считает токены до/после, чтобы видеть экономию на каждом пользователе-дне.
+
+_CMD_RE = re.compile(r"^/[a-z0-9_]+(@\w+)?(\s+\S+)?\s*$", re.IGNORECASE)
+
+# Кнопки reply/inline-клавиатур бота (после normalize_for_dedup: без эмодзи и регистра)
+DEFAULT_MENU_TEXTS = frozenset({
+    "поговорить",
+    "настройки",
+    "подписка",
+    "о проекте",
+    "открыть меню",
+    "меню",
+    "назад",
+    "вперёд",
+    "принимаю",
+    "тон общения",
+    "приватность",
+    "оформить подписку",
+    "отменить подписку",
+})
+
+
+def _default_tokens(text: str) -> int:
+    return (len(text or "") + 2) // 3
+
+
+class MessageFilter:
+    """
+    feed(msg) → очищенное сообщение или None (выброшено). msg — dict с role/text (и любыми
+    другими полями, они сохраняются). Экземпляр — на одного пользователя-день.
+    """
+
+    def __init__(
+        self,
+        *,
+        bot_max_chars: int = 1200,
+        dup_window: int = 8,
+        near_threshold: float = 0.9,
+        near_min_chars: int = 200,
+        menu_texts: Optional[Iterable[str]] = None,
+        count_tokens: Callable[[str], int] = _default_tokens,
+    ):
+        self.bot_max_chars = int(bot_max_chars)
+        self.near_min_chars = int(near_min_chars)
+        self.menu_texts: Set[str] = set(DEFAULT_MENU_TEXTS)
+        for t in menu_texts or ():
+            norm = normalize_for_dedup(t)
+            if norm:
+                self.menu_texts.add(norm)
+        self.count_tokens = count_tokens
+        self._recent: Dict[str, Deque[str]] = {}
+        self._dup_window = max(1, int(dup_window))
+        self._near = NearDuplicateIndex(threshold=near_threshold) if near_threshold > 0 else None
+        self.stats: Dict[str, int] = {
+            "messages_in": 0, "messages_out": 0, "tokens_in": 0, "tokens_out": 0,
+            "callbacks": 0, "commands": 0, "menu": 0, "empty": 0,
+            "exact_dups": 0, "near_dups": 0, "trimmed": 0,
+        }
+
+    def _drop_reason(self, role: str, text: str, norm: str) -> Optional[str]:
+        if not norm:
+            return "empty"
+        if role == "user":
+            if text.startswith("[cb]"):
+                return "callbacks"
+            if _CMD_RE.match(text):
+                return "commands"
+        if norm in self.menu_texts:
+            return "menu"
+        recent = self._recent.setdefault(role, deque(maxlen=self._dup_window))
+        if norm in recent:
+            return "exact_dups"
+        recent.append(norm)
+        if role != "user" and self._near is not None and len(text) >= self.near_min_chars:
+            if self._near.check(norm, self.stats["messages_in"]) is not None:
+                return "near_dups"
+        return None
+
+    def _trim(self, text: str) -> str:
+        if len(text) <= self.bot_max_chars:
+            return text
+        cut = text[: self.bot_max_chars]
+        space = cut.rfind(" ")
+        if space > self.bot_max_chars // 2:
+            cut = cut[:space]
+        self.stats["trimmed"] += 1
+        return cut.rstrip() + " …"
+
+    def feed(self, msg: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        text = (msg.get("text") or "").strip()
+        role = (msg.get("role") or "").lower()
+        role = "user" if role == "user" else "bot"
+        self.stats["messages_in"] += 1
+        self.stats["tokens_in"] += self.count_tokens(text)
+
+        reason = self._drop_reason(role, text, normalize_for_dedup(text))
+        if reason is not None:
+            self.stats[reason] += 1
+            return None
+
+        if role == "bot":
+            text = self._trim(text)
+        self.stats["messages_out"] += 1
+        self.stats["tokens_out"] += self.count_tokens(text)
+        return {**msg, "text": text}
+
+    def run(self, messages: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        for m in messages:
+            out = self.feed(m)
+            if out is not None:
+                yield out
+
+    def report(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = dict(self.stats)
+        tin = out["tokens_in"]
+        out["tokens_saved"] = tin - out["tokens_out"]
+        out["reduction"] = round(out["tokens_saved"] / tin, 3) if tin else 0.0
+        return out
+
+
+def filter_messages(messages: Iterable[Dict[str, Any]], **kwargs: Any) -> Tuple[list, Dict[str, Any]]:
+    """Удобная обёртка: (очищенные сообщения, отчёт)."""
+    f = MessageFilter(**kwargs)
+    out = list(f.run(messages))
+    return out, f.report()
+
+
+__all__ = [
+    "MessageFilter",
+    "filter_messages",
+    "DEFAULT_MENU_TEXTS",
+]
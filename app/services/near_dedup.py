@@ -0,0 +1,158 @@
+# app/services/near_dedup.py
+from __future__ import annotations
+
+import hashlib
+import re
+import zlib
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+# Поиск почти-дубликатов текста: шинглы по словам → MinHash-сигнатура → LSH-бакеты.
+# Работает онлайн (по одному чанку), память — O(число оставленных чанков × num_perm).
+# Корпус собирается из вики, страниц и машинного перевода, поэтому одинаковые абзацы
+# с разницей в пару слов встречаются часто.
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+# простое чуть больше 2^32: a*x (a < 2^31, x < 2^32) многократно «оборачивается» по модулю,
+# иначе при модуле ≫ a*x перестановка почти монотонна и минимум даёт один и тот же шингл
+_PRIME = np.uint64(4294967311)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_SHINGLE_BASE = np.uint64(1_000_003)
+
+
+def normalize_for_dedup(text: str) -> str:
+    return " ".join(_WORD_RE.findall((text or "").lower()))
+
+
+def shingle_hashes(text: str, k: int = 5) -> np.ndarray:
+    """
+    32-битные хэши k-словных шинглов (уникальные). Хэши слов считаются один раз,
+    шинглы собираются векторно полиномиальным хэшем.
+    """
+    words = _WORD_RE.findall((text or "").lower())
+    if not words:
+        return np.empty(0, dtype=np.uint64)
+    toks = np.fromiter((zlib.crc32(w.encode("utf-8")) for w in words), dtype=np.uint64, count=len(words))
+    if len(toks) <= k:
+        h = np.uint64(0)
+        for t in toks:
+            h = (h * _SHINGLE_BASE + t) & _MAX_HASH
+        return np.array([h], dtype=np.uint64)
+    n = len(toks) - k + 1
+    h = np.zeros(n, dtype=np.uint64)
+    for j in range(k):
+        h = (h * _SHINGLE_BASE + toks[j:j + n]) & _MAX_HASH
+    return np.unique(h)
+
+
+class MinHasher:
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = int(num_perm)
+        # a < 2^31, x < 2^32 → a*x + b < 2^63, без переполнения uint64
+        self.a = rng.randint(1, 1 << 31, size=(self.num_perm, 1)).astype(np.uint64)
+        self.b = rng.randint(0, 1 << 31, size=(self.num_perm, 1)).astype(np.uint64)
+
+    def signature(self, shingles: np.ndarray) -> np.ndarray:
+        if shingles.size == 0:
+            return np.full(self.num_perm, _PRIME, dtype=np.uint64)
+        return ((self.a * shingles[None, :] + self.b) % _PRIME).min(axis=1)
+
+
+def _bands_for(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """
+    Подбирает (bands, rows), чтобы порог LSH (1/b)^(1/r) был чуть ниже заданного:
+    кандидатов проверяем по сигнатуре, поэтому лучше лишний кандидат, чем пропуск.
+    """
+    best = (num_perm, 1)
+    best_err = None
+    for r in range(1, num_perm + 1):
+        if num_perm % r:
+            continue
+        b = num_perm // r
+        t = (1.0 / b) ** (1.0 / r)
+        if t > threshold:
+            continue
+        err = threshold - t
+        if best_err is None or err < best_err:
+            best, best_err = (b, r), err
+    return best
+
+
+class NearDuplicateIndex:
+    """
+    check(text, key) → None, если текст новый (он запоминается как представитель группы),
+    иначе (key_представителя, оценка_сходства).
+    """
+
+    def __init__(
+        self,
+        *,
+        threshold: float = 0.85,
+        num_perm: int = 64,
+        shingle: int = 5,
+        seed: int = 1,
+    ):
+        self.threshold = float(threshold)
+        self.shingle = int(shingle)
+        self.hasher = MinHasher(num_perm=num_perm, seed=seed)
+        self.bands, self.rows = _bands_for(self.hasher.num_perm, self.threshold)
+        self._buckets: Dict[Tuple[int, bytes], List[int]] = {}
+        self._sigs: List[np.ndarray] = []
+        self._keys: List[Hashable] = []
+        self._exact: Dict[str, Hashable] = {}
+        self.stats: Dict[str, int] = {"seen": 0, "kept": 0, "exact_dups": 0, "near_dups": 0, "candidates": 0}
+
+    def _band_keys(self, sig: np.ndarray) -> List[Tuple[int, bytes]]:
+        r = self.rows
+        return [(i, sig[i * r:(i + 1) * r].tobytes()) for i in range(self.bands)]
+
+    def check(self, text: str, key: Hashable) -> Optional[Tuple[Hashable, float]]:
+        self.stats["seen"] += 1
+
+        # быстрый путь: точные дубликаты (после нормализации) — без MinHash
+        norm = normalize_for_dedup(text)
+        digest = hashlib.sha1(norm.encode("utf-8")).hexdigest()
+        orig = self._exact.get(digest)
+        if orig is not None:
+            self.stats["exact_dups"] += 1
+            return orig, 1.0
+
+        sig = self.hasher.signature(shingle_hashes(norm, self.shingle))
+        bkeys = self._band_keys(sig)
+
+        checked = set()
+        for bk in bkeys:
+            for idx in self._buckets.get(bk, ()):
+                if idx in checked:
+                    continue
+                checked.add(idx)
+                sim = float(np.mean(self._sigs[idx] == sig))
+                if sim >= self.threshold:
+                    self.stats["candidates"] += len(checked)
+                    self.stats["near_dups"] += 1
+                    return self._keys[idx], round(sim, 3)
+        self.stats["candidates"] += len(checked)
+
+        idx = len(self._sigs)
+        self._sigs.append(sig)
+        self._keys.append(key)
+        self._exact[digest] = key
+        for bk in bkeys:
+            self._buckets.setdefault(bk, []).append(idx)
+        self.stats["kept"] += 1
+        return None
+
+    def report(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = dict(self.stats)
+        out.update({"threshold": self.threshold, "num_perm": self.hasher.num_perm, "bands": self.bands, "rows": self.rows})
+        return out
+
+
+__all__ = [
+    "NearDuplicateIndex",
+    "MinHasher",
+    "shingle_hashes",
+    "normalize_for_dedup",
+]
@@ -0,0 +1,133 @@
+# app/services/rate_limit.py
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from typing import Any, Callable, Dict, Optional
+
+# Общий на процесс лимит запросов к провайдеру (LLM / эмбеддинги) для батч-джобов.
+# Token bucket: ёмкость burst, пополнение rpm/60 токенов в секунду. На 429 темп режется
+# вдвое и все ждут паузу (AIMD), на успехах — плавно возвращается к базовому rpm.
+# rpm <= 0 — без лимита (acquire ничего не ждёт), но 429-пауза всё равно соблюдается.
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        v = os.getenv(name, "")
+        return float(v) if v else float(default)
+    except Exception:
+        return float(default)
+
+
+def is_rate_limit_error(err: BaseException) -> bool:
+    s = str(err).lower()
+    return "429" in s or "too many requests" in s or "rate limit" in s
+
+
+class TokenBucket:
+    def __init__(
+        self,
+        rpm: float,
+        *,
+        burst: Optional[float] = None,
+        min_rpm: Optional[float] = None,
+        cooldown_sec: float = 5.0,
+        recover_step: float = 0.05,
+        name: str = "",
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.base_rpm = max(0.0, float(rpm or 0.0))
+        self.rpm = self.base_rpm
+        self.min_rpm = float(min_rpm) if min_rpm is not None else max(1.0, self.base_rpm / 16.0)
+        self.capacity = float(burst) if burst else max(1.0, self.base_rpm / 60.0)
+        self.cooldown_sec = float(cooldown_sec)
+        self.recover_step = float(recover_step)
+        self._clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+        self.stats: Dict[str, Any] = {"acquired": 0, "waited_sec": 0.0, "rate_limited": 0}
+
+    @property
+    def limited(self) -> bool:
+        return self.base_rpm > 0
+
+    def _refill(self, now: float) -> None:
+        if self.rpm > 0:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rpm / 60.0)
+        self._updated = now
+
+    def _reserve(self, n: float) -> float:
+        """Списывает n токенов (можно в долг) и возвращает, сколько ждать до их наличия."""
+        now = self._clock()
+        self._refill(now)
+        wait = max(0.0, self._paused_until - now)
+        if not self.limited:
+            return wait
+        self._tokens -= n
+        if self._tokens < 0:
+            wait = max(wait, -self._tokens * 60.0 / self.rpm)
+        return wait
+
+    async def acquire(self, n: float = 1.0) -> float:
+        async with self._lock:
+            wait = self._reserve(float(n))
+        if wait > 0:
+            await asyncio.sleep(wait)
+            self.stats["waited_sec"] += wait
+        self.stats["acquired"] += 1
+        return wait
+
+    def on_rate_limit(self, retry_after: Optional[float] = None) -> None:
+        """429 от провайдера: мультипликативное снижение темпа и общая пауза."""
+        self.stats["rate_limited"] += 1
+        if self.limited:
+            self.rpm = max(self.min_rpm, self.rpm / 2.0)
+        pause = float(retry_after) if retry_after else self.cooldown_sec
+        self._paused_until = max(self._paused_until, self._clock() + pause)
+
+    def on_success(self) -> None:
+        """Аддитивное восстановление темпа до базового."""
+        if self.limited and self.rpm < self.base_rpm:
+            self.rpm = min(self.base_rpm, self.rpm + self.base_rpm * self.recover_step)
+
+    def snapshot(self) -> Dict[str, Any]:
+        out = dict(self.stats)
+        out["waited_sec"] = round(out["waited_sec"], 2)
+        out.update({"name": self.name, "rpm": round(self.rpm, 2), "base_rpm": self.base_rpm})
+        return out
+
+
+_BUCKETS: Dict[str, TokenBucket] = {}
+
+
+def get_bucket(name: str) -> TokenBucket:
+    """
+    Общий bucket по имени ресурса: "llm" → SUMMARY_LLM_RPM, "embed" → SUMMARY_EMBED_RPM (0 = без лимита).
+    """
+    b = _BUCKETS.get(name)
+    if b is None:
+        prefix = f"SUMMARY_{name.upper()}"
+        b = TokenBucket(
+            _env_float(f"{prefix}_RPM", 0.0),
+            burst=_env_float(f"{prefix}_BURST", 0.0) or None,
+            cooldown_sec=_env_float(f"{prefix}_COOLDOWN_SEC", 5.0),
+            name=name,
+        )
+        _BUCKETS[name] = b
+    return b
+
+
+def get_bucket_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: b.snapshot() for name, b in _BUCKETS.items()}
+
+
+__all__ = [
+    "TokenBucket",
+    "get_bucket",
+    "get_bucket_stats",
+    "is_rate_limit_error",
+]
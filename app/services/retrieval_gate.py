@@ -0,0 +1,206 @@
+# app/services/retrieval_gate.py
+from __future__ import annotations
+
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set
+
+from app.services.short_reply import is_short_reply
+
+# Гейт решает, стоит ли на этом ходу звать ретриверы (корпусный RAG и долгую память).
+# «да», «ок», «спасибо» и т.п. не несут новой темы: эмбеддинг + два запроса в Qdrant
+# для них — чистые расходы. Решение принимается дёшево, без сети.
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        v = os.getenv(name, "")
+        return int(v) if v else int(default)
+    except Exception:
+        return int(default)
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        v = os.getenv(name, "")
+        return float(v) if v else float(default)
+    except Exception:
+        return float(default)
+
+
+RAG_GATE_ENABLED = os.getenv("RAG_GATE_ENABLED", "1") == "1"
+# Реплики короче этого (в словах/символах) идут без свежего корпусного ретрива; долгую память
+# для них всё равно ищем — «мама умерла» коротко, но именно здесь память важна
+RAG_GATE_MIN_WORDS = _env_int("RAG_GATE_MIN_WORDS", 3)
+RAG_GATE_MIN_CHARS = _env_int("RAG_GATE_MIN_CHARS", 16)
+# Доля «содержательных» слов реплики, уже покрытых прошлым контекстом, при которой ретрив не повторяем
+RAG_GATE_OVERLAP = _env_float("RAG_GATE_OVERLAP", 0.6)
+# Подставлять прошлый контекст вместо пустого, если ретрив пропущен
+RAG_GATE_REUSE_LAST = os.getenv("RAG_GATE_REUSE_LAST", "1") == "1"
+RAG_GATE_REUSE_TTL_SEC = _env_float("RAG_GATE_REUSE_TTL_SEC", 900.0)
+RAG_GATE_MAX_CHATS = _env_int("RAG_GATE_MAX_CHATS", 5000)
+
+_WORD_RE = re.compile(r"[0-9a-zа-яё]+", re.IGNORECASE)
+
+# Служебные слова не считаем при оценке пересечения
+_STOPWORDS: Set[str] = {
+    "и", "в", "во", "не", "что", "он", "на", "я", "с", "со", "как", "а", "то", "все", "она",
+    "так", "его", "но", "да", "ты", "к", "у", "же", "вы", "за", "бы", "по", "только", "ее",
+    "мне", "было", "вот", "от", "меня", "еще", "нет", "о", "из", "ему", "теперь", "когда",
+    "даже", "ну", "ли", "если", "уже", "или", "ни", "быть", "был", "него", "до", "вас",
+    "нибудь", "опять", "уж", "вам", "ведь", "там", "потом", "себя", "ничего", "ей", "может",
+    "они", "тут", "где", "есть", "надо", "ней", "для", "мы", "тебя", "их", "чем", "была",
+    "сам", "чтоб", "без", "будто", "чего", "раз", "тоже", "себе", "под", "будет", "ж",
+    "тогда", "кто", "этот", "того", "потому", "этого", "какой", "совсем", "ним", "здесь",
+    "этом", "один", "почти", "мой", "тем", "чтобы", "нее", "сейчас", "были", "куда",
+    "зачем", "всех", "никогда", "можно", "при", "наконец", "два", "об", "другой", "хоть",
+    "после", "над", "больше", "тот", "через", "эти", "нас", "про", "всего", "них", "какая",
+    "много", "разве", "три", "эту", "моя", "впрочем", "хорошо", "свою", "этой", "перед",
+    "иногда", "лучше", "чуть", "том", "нельзя", "такой", "им", "более", "всегда", "конечно",
+    "всю", "между", "это", "просто", "очень", "ок", "угу", "ага",
+}
+
+# Фатические слова: реплика только из них (и служебных) новой темы не несёт
+_PHATIC: Set[str] = {
+    "спасибо", "спс", "благодарю", "понятно", "понял", "поняла", "ясно", "ладно", "окей", "okay", "ok",
+    "привет", "пока", "угу", "ага", "ммм", "хм", "согласен", "согласна", "норм", "нормально",
+    "класс", "супер", "отлично", "пожалуйста", "давай", "давайте", "продолжай", "продолжим", "yes", "thanks",
+}
+
+# Последний извлечённый контекст по чату (LRU), для пересечения и переиспользования
+_LAST: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+
+GATE_STATS: Dict[str, int] = {
+    "turns": 0,
+    "rag_run": 0,
+    "rag_skipped": 0,
+    "summaries_run": 0,
+    "summaries_skipped": 0,
+    "reused": 0,
+}
+
+
+def _content_tokens(text: str) -> Set[str]:
+    out: Set[str] = set()
+    for w in _WORD_RE.findall((text or "").lower()):
+        if len(w) < 3 or w in _STOPWORDS:
+            continue
+        # грубый стемминг: для русского хватает отрезать окончание
+        out.add(w[:6])
+    return out
+
+
+def is_phatic(text: str) -> bool:
+    """
+    Нет ни одного слова, кроме служебных/фатических («ок», «да, спасибо», эмодзи).
+    is_short_reply смотрит только на длину — «мама умерла» тоже короткая.
+    """
+    return all(len(w) < 3 or w in _STOPWORDS or w in _PHATIC for w in _WORD_RE.findall((text or "").lower()))
+
+
+def lexical_overlap(text: str, context: str) -> float:
+    """
+    Доля содержательных токенов `text`, встречающихся в `context` (0..1).
+    """
+    toks = _content_tokens(text)
+    if not toks:
+        return 0.0
+    ctx = _content_tokens(context)
+    if not ctx:
+        return 0.0
+    return len(toks & ctx) / float(len(toks))
+
+
+def _get_last(chat_id: Optional[int]) -> Optional[Dict[str, Any]]:
+    if chat_id is None:
+        return None
+    item = _LAST.get(chat_id)
+    if not item:
+        return None
+    if time.monotonic() - float(item.get("ts") or 0.0) > RAG_GATE_REUSE_TTL_SEC:
+        _LAST.pop(chat_id, None)
+        return None
+    return item
+
+
+def decide_retrieval(user_text: str, *, chat_id: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Решает для одного хода, какие ретриверы запускать.
+    Возвращает {"rag": bool, "summaries": bool, "reuse": bool, "reason": str, "overlap": float|None}.
+    reuse=True — вместо свежего поиска можно подставить прошлый контекст (reused_context()).
+    """
+    t = (user_text or "").strip()
+    words = [w for w in t.split() if w]
+    last = _get_last(chat_id)
+    decision: Dict[str, Any] = {"rag": True, "summaries": True, "reuse": False, "reason": "default", "overlap": None}
+
+    if not RAG_GATE_ENABLED:
+        decision["reason"] = "disabled"
+    elif not t:
+        decision.update({"rag": False, "summaries": False, "reason": "empty"})
+    elif is_short_reply(t) and is_phatic(t):
+        decision.update({"rag": False, "summaries": False, "reason": "short_reply"})
+    elif is_short_reply(t) or len(words) < RAG_GATE_MIN_WORDS or len(t) < RAG_GATE_MIN_CHARS:
+        # короткая, но со смыслом: корпус по 2 словам ищет плохо, а долгая память нужна
+        decision.update({"rag": False, "reason": "too_short"})
+    elif last is not None:
+        ov = lexical_overlap(t, f"{last.get('query') or ''}\n{last.get('rag_ctx') or ''}")
+        decision["overlap"] = round(ov, 3)
+        if ov >= RAG_GATE_OVERLAP:
+            # тема та же — прошлый контекст покрывает реплику, долгую память тоже не перезапрашиваем
+            decision.update({"rag": False, "summaries": False, "reason": "overlap"})
+
+    if not decision["rag"] and RAG_GATE_REUSE_LAST and last is not None:
+        decision["reuse"] = True
+
+    GATE_STATS["turns"] += 1
+    GATE_STATS["rag_run" if decision["rag"] else "rag_skipped"] += 1
+    GATE_STATS["summaries_run" if decision["summaries"] else "summaries_skipped"] += 1
+    if decision["reuse"]:
+        GATE_STATS["reused"] += 1
+    return decision
+
+
+def remember_context(chat_id: Optional[int], *, query: str, rag_ctx: str, sum_block: str) -> None:
+    """
+    Запоминает извлечённый на этом ходу контекст (только после реального ретрива).
+    """
+    if chat_id is None:
+        return
+    _LAST[chat_id] = {
+        "query": query or "",
+        "rag_ctx": rag_ctx or "",
+        "sum_block": sum_block or "",
+        "ts": time.monotonic(),
+    }
+    _LAST.move_to_end(chat_id)
+    while len(_LAST) > RAG_GATE_MAX_CHATS:
+        _LAST.popitem(last=False)
+
+
+def reused_context(chat_id: Optional[int]) -> Dict[str, str]:
+    """
+    Прошлый контекст чата: {"rag_ctx": ..., "sum_block": ...} (пустые строки, если истёк/нет).
+    """
+    last = _get_last(chat_id) or {}
+    return {"rag_ctx": last.get("rag_ctx") or "", "sum_block": last.get("sum_block") or ""}
+
+
+def get_gate_stats() -> Dict[str, Any]:
+    stats: Dict[str, Any] = dict(GATE_STATS)
+    turns = stats.get("turns") or 0
+    stats["rag_skip_rate"] = round(stats["rag_skipped"] / turns, 3) if turns else 0.0
+    return stats
+
+
+__all__ = [
+    "decide_retrieval",
+    "is_phatic",
+    "remember_context",
+    "reused_context",
+    "lexical_overlap",
+    "get_gate_stats",
+    "GATE_STATS",
+]
@@ -0,0 +1,104 @@
+# app/services/stage_metrics.py
+from __future__ import annotations
+
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Sequence
+
+# Живые метрики стадий батч-джобов саммарей в памяти процесса: по каждой стадии
+# (fetch / llm / embed / qdrant_upsert / db_upsert / user_total) — гистограмма длительностей
+# с фиксированными корзинами (мс) и окно последних значений для p50/p95; плюс счётчики
+# (токены, исходы задач и причины пропуска). Нужны, чтобы подобрать concurrency и найти
+# медленную стадию, пока джоб идёт. Каждый инстанс считает своё.
+
+DEFAULT_BOUNDS_MS: Sequence[float] = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+
+class Histogram:
+    def __init__(self, bounds: Sequence[float] = DEFAULT_BOUNDS_MS, window: int = 1024):
+        self.bounds = list(bounds)
+        self.counts: List[int] = [0] * (len(self.bounds) + 1)  # последняя — "+Inf"
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._recent: Deque[float] = deque(maxlen=int(window))
+
+    def observe(self, value: float) -> None:
+        v = max(0.0, float(value))
+        self.counts[bisect_left(self.bounds, v)] += 1
+        self.count += 1
+        self.total += v
+        self.max = max(self.max, v)
+        self._recent.append(v)
+
+    def _pct(self, q: float) -> float:
+        vals = sorted(self._recent)
+        return vals[min(len(vals) - 1, int(round(q * (len(vals) - 1))))] if vals else 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum_ms": round(self.total, 1),
+            "avg_ms": round(self.total / self.count, 1) if self.count else 0.0,
+            "p50_ms": round(self._pct(0.5), 1),
+            "p95_ms": round(self._pct(0.95), 1),
+            "max_ms": round(self.max, 1),
+            # корзины без накопления: [верхняя граница мс | "+Inf", число значений]
+            "buckets": [[b, n] for b, n in zip(self.bounds + ["+Inf"], self.counts)],
+        }
+
+
+class StageMetrics:
+    def __init__(self, bounds: Sequence[float] = DEFAULT_BOUNDS_MS):
+        self._bounds = bounds
+        self.stages: Dict[str, Histogram] = {}
+        self.counters: Dict[str, int] = {}
+        self.started_at = time.time()
+        self.updated_at = 0.0
+
+    def observe(self, stage: str, ms: float) -> None:
+        h = self.stages.get(stage)
+        if h is None:
+            h = self.stages[stage] = Histogram(self._bounds)
+        h.observe(ms)
+        self.updated_at = time.time()
+
+    def incr(self, name: str, n: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + int(n)
+        self.updated_at = time.time()
+
+    @contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        """with metrics.time("fetch"): ... — длительность блока в мс (и при исключении тоже)."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, (time.perf_counter() - t0) * 1000.0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "since": self.started_at,
+            "updated_at": self.updated_at,
+            "stages": {name: h.snapshot() for name, h in sorted(self.stages.items())},
+            "counters": dict(sorted(self.counters.items())),
+        }
+
+    def reset(self) -> None:
+        self.stages.clear()
+        self.counters.clear()
+        self.started_at = time.time()
+
+
+# Общие на процесс метрики конвейера саммарей
+SUMMARY_METRICS = StageMetrics()
+
+
+__all__ = [
+    "Histogram",
+    "StageMetrics",
+    "SUMMARY_METRICS",
+    "DEFAULT_BOUNDS_MS",
+]
@@ -1,19 +1,22 @@
 # app/site/summaries_api.py
 from __future__ import annotations
 from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from typing import Optional, List, Dict, Any
 from datetime import datetime, timedelta, timezone
 import os
+import json
 import asyncio
 import logging
 import time
-import uuid
-import random
 
 from sqlalchemy import text as sql
 from app.db.core import async_session
-from app.memory_summarizer import make_daily, rollup_weekly, rollup_monthly
+from app.memory_summarizer import make_daily, rollup_weekly, rollup_monthly, rollup_bulk, plan_daily_candidates, get_filter_stats
+from app.summary_jobs import create_or_resume_job, run_job_worker, job_status, recent_jobs
+from app.summary_compaction import run_compaction, SUMMARY_RETENTION
 from app.rag_summaries import delete_user_summaries
+from app.services.stage_metrics import SUMMARY_METRICS
 
 router = APIRouter(prefix="/api/admin/summaries", tags=["summaries"])
 logger = logging.getLogger(__name__)
@@ -65,245 +68,70 @@ def _env_float(name: str, default: float) -> float:
         return float(default)
 
 
-DAILY_BATCH_SIZE = _env_int("DAILY_SUMMARIES_BATCH_SIZE", 50)
 DAILY_MAX_RUNTIME_SEC = _env_float("DAILY_SUMMARIES_MAX_RUNTIME_SEC", 900.0)
+# Параллельных воркеров на инстанс (темп LLM/эмбеддингов — SUMMARY_LLM_RPM / SUMMARY_EMBED_RPM)
+DAILY_CONCURRENCY = _env_int("DAILY_SUMMARIES_CONCURRENCY", 8)
 
-DAILY_JOBS: Dict[str, Dict[str, Any]] = {}
-DAILY_LOCK_KEY = "summaries_daily"
+# Задачи воркеров этого процесса (чтобы фоновые таски не собрал GC); состояние — в summary_jobs/summary_tasks
+_LOCAL_WORKERS: Dict[str, "asyncio.Task[Any]"] = {}
 
 
-def _is_rate_limit_error(err: Exception) -> bool:
-    s = str(err).lower()
-    return "429" in s or "too many requests" in s or "rate limit" in s
-
-
-async def _try_advisory_lock(session, key: str) -> bool:
-    res = await session.execute(sql("SELECT pg_try_advisory_lock(hashtext(:k))"), {"k": key})
-    return bool(res.scalar())
-
-
-async def _advisory_unlock(session, key: str) -> None:
-    await session.execute(sql("SELECT pg_advisory_unlock(hashtext(:k))"), {"k": key})
+async def _run_daily_job(job_id: str, *, max_runtime_sec: float = DAILY_MAX_RUNTIME_SEC) -> Dict[str, Any]:
+    """
+    Локальный воркер джоба из очереди summary_tasks. Остановился по бюджету — задачи остаются
+    pending, следующий запуск (или другой инстанс) продолжит с того же места.
+    """
+    logger.info("[summaries/daily] worker start job_id=%s max_runtime_sec=%s", job_id, max_runtime_sec)
+    try:
+        res = await run_job_worker(
+            job_id,
+            concurrency=DAILY_CONCURRENCY,
+            deadline=time.monotonic() + max_runtime_sec,
+        )
+    except Exception:
+        logger.exception("[summaries/daily] worker failed job_id=%s", job_id)
+        return {"status": "failed", "job_id": job_id}
+    logger.info("[summaries/daily] worker done job_id=%s %s", job_id, res)
+    return res
 
 
-async def _iter_user_batches(batch_size: int):
-    last_id = 0
-    while True:
-        async with async_session() as s:
-            rows = (
-                await s.execute(
-                    sql(
-                        "SELECT id FROM users WHERE id > :last ORDER BY id ASC LIMIT :lim"
-                    ),
-                    {"last": int(last_id), "lim": int(batch_size)},
-                )
-            ).scalars().all()
-        if not rows:
-            break
-        ids = [int(x) for x in rows]
-        last_id = ids[-1]
-        yield ids
+def _spawn_worker(job_id: str) -> None:
+    t = _LOCAL_WORKERS.get(job_id)
+    if t is not None and not t.done():
+        return
+    _LOCAL_WORKERS[job_id] = asyncio.create_task(_run_daily_job(job_id))
 
 
-async def _run_daily_job(
-    lock_session,
-    *,
-    job_id: str,
+async def start_daily_job(
     target_day: datetime,
-    user_id: Optional[int],
-    user_ids: Optional[List[int]],
-    batch_size: int,
-    max_runtime_sec: float,
-):
-    started = time.monotonic()
-    counters = {
-        "checked_users": 0,
-        "processed_users": 0,
-        "summaries_written": 0,
-        "embedding_ok": 0,
-        "embedding_429": 0,
-        "skipped": 0,
-        "errors": 0,
-    }
-    status = "running"
-    remaining = None
-
-    DAILY_JOBS[job_id] = {
-        "status": status,
-        "started_at": datetime.now(timezone.utc).isoformat(),
-        "finished_at": None,
-        "counters": counters,
-        "target_day": target_day.date().isoformat(),
-        "user_id": user_id,
-        "user_ids_count": len(user_ids) if user_ids is not None else None,
-    }
-
-    logger.info(
-        "[summaries/daily] job start job_id=%s day=%s user_id=%s batch_size=%s max_runtime_sec=%s",
-        job_id,
-        target_day.date().isoformat(),
-        user_id,
-        len(user_ids) if user_ids is not None else None,
-        batch_size,
-        max_runtime_sec,
+    *,
+    user_ids: Optional[List[int]] = None,
+    source: str = "api",
+) -> Dict[str, Any]:
+    """
+    Планирует кандидатов, создаёт (или продолжает) джоб в очереди и запускает локальный воркер.
+    """
+    candidates = await plan_daily_candidates(target_day, user_ids=user_ids)
+    job_id, created = await create_or_resume_job(
+        "daily",
+        target_day,
+        [c["user_id"] for c in candidates],
+        source=source,
+        params={
+            "candidates": len(candidates),
+            "messages": sum(c["messages"] for c in candidates),
+            "bytes": sum(c["bytes"] for c in candidates),
+        },
     )
+    _spawn_worker(job_id)
+    return {
+        "status": "queued" if created else "resumed",
+        "kind": "daily",
+        "day": target_day.date().isoformat(),
+        "job_id": job_id,
+        "users": len(candidates),
+    }
 
-    try:
-        if user_ids is not None:
-            processed_list = 0
-            total_list = len(user_ids)
-            for i in range(0, total_list, int(batch_size)):
-                ids = [int(x) for x in user_ids[i : i + int(batch_size)]]
-                for uid in ids:
-                    counters["checked_users"] += 1
-                    processed_list += 1
-                    if time.monotonic() - started > max_runtime_sec:
-                        status = "partial"
-                        remaining = max(0, total_list - processed_list)
-                        logger.warning(
-                            "[summaries/daily] job budget exceeded job_id=%s remaining=%s",
-                            job_id,
-                            remaining,
-                        )
-                        raise asyncio.CancelledError()
-
-                    try:
-                        await make_daily(int(uid), target_day)
-                        counters["processed_users"] += 1
-                        counters["summaries_written"] += 1
-                        counters["embedding_ok"] += 1
-                    except Exception as e:
-                        if _is_rate_limit_error(e):
-                            counters["embedding_429"] += 1
-                            counters["skipped"] += 1
-                            logger.warning(
-                                "[summaries/daily] rate_limit user=%s day=%s err=%s",
-                                uid,
-                                target_day.date().isoformat(),
-                                repr(e),
-                            )
-                            await asyncio.sleep(0.5 + random.random())
-                            continue
-                        counters["errors"] += 1
-                        logger.exception(
-                            "[summaries/daily] user error user=%s day=%s",
-                            uid,
-                            target_day.date().isoformat(),
-                        )
-        elif user_id:
-            ids_batches = [ [int(user_id)] ]
-            for ids in ids_batches:
-                for uid in ids:
-                    counters["checked_users"] += 1
-                    if time.monotonic() - started > max_runtime_sec:
-                        status = "partial"
-                        remaining = 0
-                        logger.warning(
-                            "[summaries/daily] job budget exceeded job_id=%s remaining=%s",
-                            job_id,
-                            remaining,
-                        )
-                        raise asyncio.CancelledError()
-
-                    try:
-                        await make_daily(int(uid), target_day)
-                        counters["processed_users"] += 1
-                        counters["summaries_written"] += 1
-                        counters["embedding_ok"] += 1
-                    except Exception as e:
-                        if _is_rate_limit_error(e):
-                            counters["embedding_429"] += 1
-                            counters["skipped"] += 1
-                            logger.warning(
-                                "[summaries/daily] rate_limit user=%s day=%s err=%s",
-                                uid,
-                                target_day.date().isoformat(),
-                                repr(e),
-                            )
-                            await asyncio.sleep(0.5 + random.random())
-                            continue
-                        counters["errors"] += 1
-                        logger.exception(
-                            "[summaries/daily] user error user=%s day=%s",
-                            uid,
-                            target_day.date().isoformat(),
-                        )
-        else:
-            async for ids in _iter_user_batches(batch_size):
-                for uid in ids:
-                    counters["checked_users"] += 1
-                    if time.monotonic() - started > max_runtime_sec:
-                        status = "partial"
-                        async with async_session() as s:
-                            remaining = (
-                                await s.execute(
-                                    sql("SELECT COUNT(*) FROM users WHERE id > :last"),
-                                    {"last": int(uid)},
-                                )
-                            ).scalar()
-                        logger.warning(
-                            "[summaries/daily] job budget exceeded job_id=%s remaining=%s",
-                            job_id,
-                            remaining,
-                        )
-                        raise asyncio.CancelledError()
-
-                    try:
-                        await make_daily(int(uid), target_day)
-                        counters["processed_users"] += 1
-                        counters["summaries_written"] += 1
-                        counters["embedding_ok"] += 1
-                    except Exception as e:
-                        if _is_rate_limit_error(e):
-                            counters["embedding_429"] += 1
-                            counters["skipped"] += 1
-                            logger.warning(
-                                "[summaries/daily] rate_limit user=%s day=%s err=%s",
-                                uid,
-                                target_day.date().isoformat(),
-                                repr(e),
-                            )
-                            await asyncio.sleep(0.5 + random.random())
-                            continue
-                        counters["errors"] += 1
-                        logger.exception(
-                            "[summaries/daily] user error user=%s day=%s",
-                            uid,
-                            target_day.date().isoformat(),
-                        )
-    except asyncio.CancelledError:
-        pass
-    except Exception:
-        status = "failed"
-        counters["errors"] += 1
-        logger.exception("[summaries/daily] job failed job_id=%s", job_id)
-    finally:
-        try:
-            await _advisory_unlock(lock_session, DAILY_LOCK_KEY)
-        except Exception:
-            logger.exception("[summaries/daily] unlock failed job_id=%s", job_id)
-        try:
-            await lock_session.close()
-        except Exception:
-            logger.exception("[summaries/daily] lock session close failed job_id=%s", job_id)
-
-        if status == "running":
-            status = "ok"
-
-        DAILY_JOBS[job_id].update(
-            {
-                "status": status,
-                "finished_at": datetime.now(timezone.utc).isoformat(),
-                "remaining": remaining,
-            }
-        )
-        logger.info(
-            "[summaries/daily] job done job_id=%s status=%s counters=%s remaining=%s",
-            job_id,
-            status,
-            counters,
-            remaining,
-        )
 
 def _parse_date_yyyy_mm_dd(s: Optional[str], *, default: datetime) -> datetime:
     if not s:
@@ -349,41 +177,15 @@ async def run_daily(
         user_id,
     )
 
-    lock_session = async_session()
     try:
-        got_lock = await _try_advisory_lock(lock_session, DAILY_LOCK_KEY)
-        if not got_lock:
-            await lock_session.close()
-            return {
-                "status": "already_running",
-                "kind": "daily",
-                "day": target_day.date().isoformat(),
-            }
-    except Exception:
-        await lock_session.close()
-        logger.exception("[summaries/daily] lock check failed")
-        raise HTTPException(status_code=500, detail="lock_failed")
-
-    job_id = f"daily-{uuid.uuid4().hex[:12]}"
-    DAILY_JOBS[job_id] = {"status": "queued", "queued_at": datetime.now(timezone.utc).isoformat()}
-    asyncio.create_task(
-        _run_daily_job(
-            lock_session,
-            job_id=job_id,
-            target_day=target_day,
-            user_id=user_id,
-            user_ids=None,
-            batch_size=DAILY_BATCH_SIZE,
-            max_runtime_sec=DAILY_MAX_RUNTIME_SEC,
+        return await start_daily_job(
+            target_day,
+            user_ids=[int(user_id)] if user_id else None,
+            source="api",
         )
-    )
-
-    return {
-        "status": "queued",
-        "kind": "daily",
-        "day": target_day.date().isoformat(),
-        "job_id": job_id,
-    }
+    except Exception:
+        logger.exception("[summaries/daily] enqueue failed")
+        raise HTTPException(status_code=500, detail="enqueue_failed")
 
 
 @router.get("/status")
@@ -392,10 +194,81 @@ async def summaries_status(
     secret: Optional[str] = Query(default=None),
     job_id: Optional[str] = Query(default=None),
 ):
+    """
+    Прогресс из summary_jobs/summary_tasks (переживает рестарт, видит все инстансы).
+    Без job_id — последние джобы и экономия токенов фильтра сообщений в этом процессе.
+    metrics — гистограммы стадий (fetch/llm/embed/db_upsert/...) и счётчики этого процесса.
+    """
     _check_secret(request, secret)
     if not job_id:
-        return {"status": "bad_request", "error": "job_id is required"}
-    return {"job_id": job_id, "data": DAILY_JOBS.get(job_id)}
+        return {"jobs": await recent_jobs(), "filter": get_filter_stats(), "metrics": SUMMARY_METRICS.snapshot()}
+    return {"job_id": job_id, "data": await job_status(job_id), "metrics": SUMMARY_METRICS.snapshot()}
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+@router.get("/status/stream")
+async def summaries_status_stream(
+    request: Request,
+    secret: Optional[str] = Query(default=None),
+    job_id: str = Query(...),
+    interval: float = Query(default=2.0, ge=0.5, le=30.0),
+):
+    """
+    Server-sent events для идущего джоба: event "progress" (job_status + metrics) при изменениях,
+    комментарий keep-alive между ними, event "end", когда джоб завершён.
+    """
+    _check_secret(request, secret)
+    if not await job_status(job_id):
+        raise HTTPException(status_code=404, detail="job_not_found")
+
+    async def _events():
+        last = None
+        while not await request.is_disconnected():
+            try:
+                job = await job_status(job_id)
+            except Exception as e:
+                yield _sse("error", {"error": repr(e)})
+                await asyncio.sleep(interval)
+                continue
+            if not job:
+                yield _sse("end", {"job_id": job_id, "status": "missing"})
+                return
+            payload = {"job": job, "metrics": SUMMARY_METRICS.snapshot()}
+            fingerprint = json.dumps(payload, sort_keys=True, default=str)
+            if fingerprint != last:
+                last = fingerprint
+                yield _sse("progress", {**payload, "ts": time.time()})
+            else:
+                yield ": keep-alive\n\n"
+            if job.get("status") in ("done", "failed"):
+                yield _sse("end", {"job_id": job_id, "status": job.get("status")})
+                return
+            await asyncio.sleep(interval)
+
+    return StreamingResponse(
+        _events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/jobs/{job_id}/work")
+async def join_job(
+    request: Request,
+    job_id: str,
+    secret: Optional[str] = Query(default=None),
+):
+    """
+    Подключить воркер этого инстанса к существующему джобу (горизонтальное масштабирование/resume).
+    """
+    _check_secret(request, secret)
+    if not await job_status(job_id):
+        raise HTTPException(status_code=404, detail="job_not_found")
+    _spawn_worker(job_id)
+    return {"status": "working", "job_id": job_id}
 
 # --- WEEKLY -------------------------------------------------------------------
 
@@ -405,32 +278,32 @@ async def run_weekly(
     secret: Optional[str] = Query(default=None),
     monday: Optional[str] = Query(default=None, description="YYYY-MM-DD (понедельник недели), по умолчанию прошлый понедельник (UTC)"),
     user_id: Optional[int] = Query(default=None),
+    concurrency: Optional[int] = Query(default=None, ge=1, le=64),
 ):
     """
     Собирает WEEKLY из daily за 7 дней, начиная с указанного понедельника (UTC).
+    В ответе stats — пропускная способность пакетного роллапа.
     """
     _check_secret(request, secret)
 
     now_utc = datetime.now(timezone.utc)
     monday_dt = _parse_date_yyyy_mm_dd(monday, default=_prev_monday_utc(now_utc))
 
-    ids = [user_id] if user_id else await _all_user_ids()
-    ok, fail = 0, 0
-    for uid in ids:
-        try:
-            await rollup_weekly(uid, monday_dt)
-            ok += 1
-        except Exception as e:
-            fail += 1
-            print(f"[summaries/weekly] user={uid} monday={monday_dt.date()} ERROR: {e}")
+    # один потоковый запрос источников, свёртки параллельно, запись пачками
+    res = await rollup_bulk(
+        "weekly", monday_dt,
+        user_ids=[user_id] if user_id else None,
+        concurrency=concurrency or DAILY_CONCURRENCY,
+    )
 
     return {
-        "status": "ok",
+        "status": res["status"],
         "kind": "weekly",
         "monday": monday_dt.date().isoformat(),
-        "processed": ok + fail,
-        "ok": ok,
-        "fail": fail,
+        "processed": res["users"],
+        "ok": res["written"],
+        "fail": res["errors"] + res["rate_limited"],
+        "stats": res,
     }
 
 # --- MONTHLY (topic) ----------------------------------------------------------
@@ -441,9 +314,11 @@ async def run_monthly(
     secret: Optional[str] = Query(default=None),
     month: Optional[str] = Query(default=None, description="YYYY-MM (первое число месяца), по умолчанию прошлый месяц (UTC)"),
     user_id: Optional[int] = Query(default=None),
+    concurrency: Optional[int] = Query(default=None, ge=1, le=64),
 ):
     """
-    Делает тематическую MONTHLY (kind='topic') за прошлый месяц либо за month=YYYY-MM.
+    Делает MONTHLY (из weekly, fallback daily/legacy 'topic') за прошлый месяц либо за month=YYYY-MM.
+    В ответе stats — пропускная способность пакетного роллапа.
     """
     _check_secret(request, secret)
 
@@ -457,23 +332,21 @@ async def run_monthly(
     else:
         month_start = _month_start_utc(now_utc)
 
-    ids = [user_id] if user_id else await _all_user_ids()
-    ok, fail = 0, 0
-    for uid in ids:
-        try:
-            await rollup_monthly(uid, month_start)
-            ok += 1
-        except Exception as e:
-            fail += 1
-            print(f"[summaries/monthly] user={uid} month={month_start.date()} ERROR: {e}")
+    # один потоковый запрос источников, свёртки параллельно, запись пачками
+    res = await rollup_bulk(
+        "monthly", month_start,
+        user_ids=[user_id] if user_id else None,
+        concurrency=concurrency or DAILY_CONCURRENCY,
+    )
 
     return {
-        "status": "ok",
+        "status": res["status"],
         "kind": "topic",
         "month": month_start.strftime("%Y-%m"),
-        "processed": ok + fail,
-        "ok": ok,
-        "fail": fail,
+        "processed": res["users"],
+        "ok": res["written"],
+        "fail": res["errors"] + res["rate_limited"],
+        "stats": res,
     }
 
 # --- Сервисные (перестроить/очистить) ----------------------------------------
@@ -528,3 +401,30 @@ async def rebuild_for_user(
             print(f"[rebuild/monthly] user={user_id} month={ms.date()} ERROR: {e}")
 
     return {"status": "ok", "user_id": user_id}
+
+
+@router.post("/compact")
+async def compact_summaries(
+    request: Request,
+    secret: Optional[str] = Query(default=None),
+    user_id: Optional[int] = Query(default=None),
+    daily_days: Optional[int] = Query(default=None, ge=0),
+    weekly_days: Optional[int] = Query(default=None, ge=0),
+    dry_run: bool = Query(default=False),
+    top: int = Query(50, ge=0, le=1000),
+):
+    """
+    Компакция памяти: daily/weekly старше срока хранения и покрытые monthly уходят из Qdrant
+    и dialog_summaries (копия — в dialog_summaries_archive). В ответе — сколько точек снято
+    у каждого пользователя (первые top по убыванию).
+    """
+    _check_secret(request, secret)
+
+    retention = dict(SUMMARY_RETENTION)
+    if daily_days is not None:
+        retention["daily"] = daily_days
+    if weekly_days is not None:
+        retention["weekly"] = weekly_days
+    res = await run_compaction(retention=retention, user_ids=[user_id] if user_id else None, dry_run=dry_run)
+    res["per_user"] = res["per_user"][:top]
+    return {"status": "ok", **res}
@@ -0,0 +1,237 @@
+# app/summary_compaction.py
+# -*- coding: utf-8 -*-
+"""
+Компакция долговременной памяти: ограничивает число саммарей пользователя в индексе.
+
+- daily/weekly старше срока хранения своего вида удаляются из Qdrant и из dialog_summaries,
+  но только если их период целиком покрыт monthly (или legacy 'topic') того же пользователя —
+  содержание уже свёрнуто в месячную выжимку, retrieval не теряет темы;
+- перед удалением строка копируется в dialog_summaries_archive (с run_id прогона);
+- порядок на пачку: Qdrant → Postgres. Если Qdrant упал, строки остаются и уйдут в следующий
+  прогон; если упал Postgres — повторное удаление точек безвредно;
+- отчёт: сколько точек каждого вида снято у каждого пользователя.
+
+ENV:
+- SUMMARY_RETENTION      — "daily=60,weekly=180": дней после конца периода; 0 — вид не компактится
+- SUMMARY_COMPACT_BATCH  — записей за пачку (500)
+"""
+from __future__ import annotations
+
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text as sql
+
+from app.db.core import async_session
+from app.rag_summaries import delete_summary_points
+
+COMPACTABLE_KINDS = ("daily", "weekly")
+DEFAULT_RETENTION: Dict[str, int] = {"daily": 60, "weekly": 180}
+
+
+def _safe_print(*args: Any) -> None:
+    try:
+        print(*args)
+    except Exception:
+        pass
+
+
+def parse_retention(spec: Optional[str]) -> Dict[str, int]:
+    """'daily=30,weekly=90' → {"daily": 30, "weekly": 90}; непереданные виды — по умолчанию."""
+    out = dict(DEFAULT_RETENTION)
+    for part in (spec or "").split(","):
+        if "=" not in part:
+            continue
+        kind, days = part.split("=", 1)
+        kind = kind.strip().lower()
+        if kind not in COMPACTABLE_KINDS:
+            continue
+        try:
+            out[kind] = max(0, int(days.strip()))
+        except ValueError:
+            continue
+    return out
+
+
+SUMMARY_RETENTION = parse_retention(os.getenv("SUMMARY_RETENTION"))
+SUMMARY_COMPACT_BATCH = max(1, int(os.getenv("SUMMARY_COMPACT_BATCH", "500") or "500"))
+
+# Период d целиком внутри месяцев с monthly: и начало, и конец попадают в месячные записи
+# (неделя на стыке месяцев компактится, когда готовы оба месяца).
+_COVERED_BY_MONTHLY = """
+    EXISTS (
+        SELECT 1 FROM dialog_summaries m
+        WHERE m.user_id = d.user_id AND m.kind IN ('monthly','topic')
+          AND m.period_start <= d.period_start AND d.period_start < m.period_end
+    )
+    AND EXISTS (
+        SELECT 1 FROM dialog_summaries m
+        WHERE m.user_id = d.user_id AND m.kind IN ('monthly','topic')
+          AND m.period_start < d.period_end AND d.period_end <= m.period_end
+    )
+"""
+
+
+async def select_compactable(
+    retention: Dict[str, int],
+    now: datetime,
+    *,
+    user_ids: Optional[List[int]] = None,
+    after_id: int = 0,
+    limit: int = SUMMARY_COMPACT_BATCH,
+) -> List[Dict[str, Any]]:
+    """Следующая пачка (id, user_id, kind) под компакцию, по возрастанию id."""
+    params: Dict[str, Any] = {"after": int(after_id), "limit": int(limit)}
+    conds: List[str] = []
+    for kind in COMPACTABLE_KINDS:
+        days = int(retention.get(kind) or 0)
+        if days <= 0:
+            continue
+        conds.append(f"(d.kind = '{kind}' AND d.period_end <= :cut_{kind})")
+        params[f"cut_{kind}"] = now - timedelta(days=days)
+    if not conds:
+        return []
+    only = ""
+    if user_ids is not None:
+        if not user_ids:
+            return []
+        only = "AND d.user_id = ANY(:uids)"
+        params["uids"] = [int(x) for x in user_ids]
+
+    async with async_session() as s:
+        rows = (await s.execute(sql(f"""
+            SELECT d.id, d.user_id, d.kind
+            FROM dialog_summaries d
+            WHERE d.id > :after
+              AND ({' OR '.join(conds)})
+              {only}
+              AND {_COVERED_BY_MONTHLY}
+            ORDER BY d.id ASC
+            LIMIT :limit
+        """), params)).mappings().all()
+    return [{"id": int(r["id"]), "user_id": int(r["user_id"]), "kind": r["kind"]} for r in rows]
+
+
+async def archive_and_delete(ids: List[int], run_id: str) -> List[int]:
+    """Копия в dialog_summaries_archive и удаление из dialog_summaries одним запросом; вернёт удалённые id."""
+    if not ids:
+        return []
+    async with async_session() as s:
+        deleted = (await s.execute(sql("""
+            WITH moved AS (
+                INSERT INTO dialog_summaries_archive
+                    (id, user_id, kind, period_start, period_end, text, tokens, source_count, source_last_id,
+                     created_at, updated_at, archived_at, run_id)
+                SELECT id, user_id, kind, period_start, period_end, text, tokens, source_count, source_last_id,
+                       created_at, updated_at, NOW(), :run
+                FROM dialog_summaries
+                WHERE id = ANY(:ids)
+                ON CONFLICT (id) DO NOTHING
+                RETURNING id
+            )
+            DELETE FROM dialog_summaries
+            WHERE id = ANY(:ids)
+            RETURNING id
+        """), {"ids": [int(x) for x in ids], "run": run_id})).scalars().all()
+        await s.commit()
+    return [int(x) for x in deleted]
+
+
+async def delete_user_summary_rows(s, user_id: int) -> int:
+    """
+    Все строки саммарей пользователя в Postgres, включая архив компакции (очистка памяти,
+    privacy=none). Коммит — на вызывающем. Возвращает число удалённых из dialog_summaries.
+    """
+    res = await s.execute(sql("DELETE FROM dialog_summaries WHERE user_id = :uid"), {"uid": int(user_id)})
+    await s.execute(sql("DELETE FROM dialog_summaries_archive WHERE user_id = :uid"), {"uid": int(user_id)})
+    try:
+        return int(getattr(res, "rowcount", 0) or 0)
+    except Exception:
+        return 0
+
+
+async def run_compaction(
+    *,
+    retention: Optional[Dict[str, int]] = None,
+    user_ids: Optional[List[int]] = None,
+    dry_run: bool = False,
+    batch: int = SUMMARY_COMPACT_BATCH,
+    now: Optional[datetime] = None,
+) -> Dict[str, Any]:
+    """
+    Прогон компакции по всем пользователям (или user_ids). dry_run — только посчитать.
+    Возвращает итоги и per_user: [{user_id, daily, weekly, total}] по убыванию total.
+    """
+    retention = dict(retention or SUMMARY_RETENTION)
+    now = now or datetime.now(timezone.utc)
+    run_id = uuid.uuid4().hex[:12]
+    per_user: Dict[int, Dict[str, int]] = {}
+    stats: Dict[str, int] = {"candidates": 0, "points_removed": 0, "archived": 0, "qdrant_errors": 0, "db_errors": 0}
+    started = time.perf_counter()
+
+    after = 0
+    while True:
+        rows = await select_compactable(retention, now, user_ids=user_ids, after_id=after, limit=batch)
+        if not rows:
+            break
+        after = rows[-1]["id"]
+        stats["candidates"] += len(rows)
+
+        done = rows
+        if not dry_run:
+            by_user: Dict[int, List[int]] = {}
+            for r in rows:
+                by_user.setdefault(r["user_id"], []).append(r["id"])
+            try:
+                stats["points_removed"] += await delete_summary_points(by_user)
+            except Exception as e:
+                # строки в Postgres не трогаем — пачка уйдёт в следующий прогон
+                stats["qdrant_errors"] += 1
+                _safe_print(f"[compaction] qdrant delete error rows={len(rows)}: {e!r}")
+                continue
+            try:
+                deleted = set(await archive_and_delete([r["id"] for r in rows], run_id))
+            except Exception as e:
+                stats["db_errors"] += 1
+                _safe_print(f"[compaction] archive/delete error rows={len(rows)}: {e!r}")
+                continue
+            stats["archived"] += len(deleted)
+            done = [r for r in rows if r["id"] in deleted]
+
+        for r in done:
+            u = per_user.setdefault(r["user_id"], {k: 0 for k in COMPACTABLE_KINDS})
+            u[r["kind"]] = u.get(r["kind"], 0) + 1
+
+    report = [
+        {"user_id": uid, **counts, "total": sum(counts.values())}
+        for uid, counts in per_user.items()
+    ]
+    report.sort(key=lambda x: (-x["total"], x["user_id"]))
+    out: Dict[str, Any] = {
+        "run_id": run_id,
+        "dry_run": dry_run,
+        "retention": retention,
+        **stats,
+        "users": len(report),
+        "wall_sec": round(time.perf_counter() - started, 2),
+        "per_user": report,
+    }
+    _safe_print(
+        f"[compaction] run={run_id} dry_run={dry_run} retention={retention} candidates={stats['candidates']} "
+        f"points_removed={stats['points_removed']} archived={stats['archived']} users={len(report)}"
+    )
+    return out
+
+
+__all__ = [
+    "COMPACTABLE_KINDS",
+    "SUMMARY_RETENTION",
+    "parse_retention",
+    "select_compactable",
+    "archive_and_delete",
+    "delete_user_summary_rows",
+    "run_compaction",
+]
@@ -0,0 +1,498 @@
+# app/summary_jobs.py
+# -*- coding: utf-8 -*-
+"""
+Долговечная очередь батч-джобов саммарей в Postgres (таблицы summary_jobs / summary_tasks).
+
+- джоб = (kind, период), задачи = по одной на пользователя;
+- воркеры забирают задачи через FOR UPDATE SKIP LOCKED и держат аренду (lease) heartbeat'ом —
+  несколько инстансов обрабатывают один джоб параллельно, задачи упавшего инстанса
+  подхватываются после истечения аренды;
+- ошибки — повтор с экспоненциальным бэкоффом до SUMMARY_TASK_MAX_ATTEMPTS, потом failed;
+- повторный запуск того же (kind, период) продолжает активный джоб с места остановки;
+- прогресс и тайминги читаются из таблиц (job_status), а не из памяти процесса.
+
+ENV:
+- SUMMARY_TASK_LEASE_SEC        — аренда задачи, сек (120); heartbeat — каждые lease/3
+- SUMMARY_TASK_MAX_ATTEMPTS     — попыток на задачу (4)
+- SUMMARY_TASK_BACKOFF_SEC      — база бэкоффа (30), удваивается с каждой попыткой
+- SUMMARY_TASK_BACKOFF_MAX_SEC  — потолок бэкоффа (900)
+"""
+from __future__ import annotations
+
+import os
+import json
+import time
+import uuid
+import socket
+import random
+import asyncio
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import text as sql
+
+from app.db.core import async_session
+from app.memory_summarizer import make_daily, rollup_weekly, rollup_monthly, DAILY_SUMMARIES_CONCURRENCY
+from app.rag_summaries import SummaryBatch, upsert_summary_points_bulk, SUMMARY_UPSERT_BATCH
+from app.services.rate_limit import is_rate_limit_error
+from app.services.stage_metrics import SUMMARY_METRICS
+
+SUMMARY_TASK_LEASE_SEC = float(os.getenv("SUMMARY_TASK_LEASE_SEC", "120") or "120")
+SUMMARY_TASK_MAX_ATTEMPTS = max(1, int(os.getenv("SUMMARY_TASK_MAX_ATTEMPTS", "4") or "4"))
+SUMMARY_TASK_BACKOFF_SEC = float(os.getenv("SUMMARY_TASK_BACKOFF_SEC", "30") or "30")
+SUMMARY_TASK_BACKOFF_MAX_SEC = float(os.getenv("SUMMARY_TASK_BACKOFF_MAX_SEC", "900") or "900")
+
+
+def _safe_print(*args: Any) -> None:
+    try:
+        print(*args)
+    except Exception:
+        pass
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def target_key(kind: str, period_start: datetime) -> str:
+    return period_start.strftime("%Y-%m") if kind == "monthly" else period_start.date().isoformat()
+
+
+def _period_from_key(kind: str, key: str) -> datetime:
+    fmt = "%Y-%m" if kind == "monthly" else "%Y-%m-%d"
+    dt = datetime.strptime(key, fmt)
+    return datetime(dt.year, dt.month, dt.day, tzinfo=timezone.utc)
+
+
+def backoff_delay(attempts: int) -> float:
+    """Задержка перед попыткой attempts+1: base·2^(attempts-1) с джиттером ±20%, не больше потолка."""
+    d = min(SUMMARY_TASK_BACKOFF_MAX_SEC, SUMMARY_TASK_BACKOFF_SEC * (2 ** max(0, attempts - 1)))
+    return d * (0.8 + 0.4 * random.random())
+
+
+# --- Обработчики задач по видам джоба: (user_id, начало периода, batch, trace) -> id саммари | None
+# trace["outcome"] — исход (written | up_to_date | no_messages | ...), пишется в summary_tasks.outcome
+
+TaskHandler = Callable[[int, datetime, SummaryBatch, Dict[str, Any]], Awaitable[Optional[int]]]
+
+# Исходы, после которых задача не done, а повтор (ошибки LLM обработчики пробрасывают сами)
+RETRY_OUTCOMES = frozenset({"llm_error", "llm_empty"})
+
+
+async def _daily_task(uid: int, period: datetime, batch: SummaryBatch, trace: Dict[str, Any]) -> Optional[int]:
+    # задачи daily строятся из plan_daily_candidates — privacy уже отфильтрован
+    return await make_daily(uid, period, batch=batch, privacy_checked=True, trace=trace)
+
+
+async def _weekly_task(uid: int, period: datetime, batch: SummaryBatch, trace: Dict[str, Any]) -> Optional[int]:
+    return await rollup_weekly(uid, period, batch=batch, trace=trace)
+
+
+async def _monthly_task(uid: int, period: datetime, batch: SummaryBatch, trace: Dict[str, Any]) -> Optional[int]:
+    return await rollup_monthly(uid, period, batch=batch, trace=trace)
+
+
+TASK_HANDLERS: Dict[str, TaskHandler] = {
+    "daily": _daily_task,
+    "weekly": _weekly_task,
+    "monthly": _monthly_task,
+}
+
+
+# === Джобы ===
+
+async def create_or_resume_job(
+    kind: str,
+    period_start: datetime,
+    user_ids: List[int],
+    *,
+    source: Optional[str] = None,
+    params: Optional[Dict[str, Any]] = None,
+) -> Tuple[str, bool]:
+    """
+    Создаёт джоб с задачами на user_ids или, если активный джоб на (kind, период) уже есть,
+    дописывает в него недостающих пользователей и возвращает его. -> (job_id, created)
+    """
+    if kind not in TASK_HANDLERS:
+        raise ValueError(f"unknown summary job kind: {kind}")
+    key = target_key(kind, period_start)
+    new_id = f"{kind}-{uuid.uuid4().hex[:12]}"
+    async with async_session() as s:
+        job_id = (await s.execute(sql("""
+            INSERT INTO summary_jobs (id, kind, target_key, params, status, source, created_at, updated_at)
+            VALUES (:id, :kind, :key, CAST(:params AS jsonb), 'queued', :source, NOW(), NOW())
+            ON CONFLICT (kind, target_key) WHERE status IN ('queued','running') DO NOTHING
+            RETURNING id
+        """), {"id": new_id, "kind": kind, "key": key, "params": json.dumps(params or {}), "source": source})).scalar_one_or_none()
+        created = job_id is not None
+        if not created:
+            job_id = (await s.execute(sql("""
+                SELECT id FROM summary_jobs
+                WHERE kind=:kind AND target_key=:key AND status IN ('queued','running')
+                LIMIT 1
+            """), {"kind": kind, "key": key})).scalar_one()
+
+        if user_ids:
+            await s.execute(sql("""
+                INSERT INTO summary_tasks (job_id, user_id)
+                SELECT :job, x FROM unnest(CAST(:uids AS bigint[])) AS x
+                ON CONFLICT (job_id, user_id) DO NOTHING
+            """), {"job": job_id, "uids": [int(u) for u in user_ids]})
+        await s.execute(sql("""
+            UPDATE summary_jobs
+            SET total = (SELECT COUNT(*) FROM summary_tasks WHERE job_id=:job), updated_at=NOW()
+            WHERE id=:job
+        """), {"job": job_id})
+        await s.commit()
+    return str(job_id), created
+
+
+async def _load_job(job_id: str) -> Optional[Dict[str, Any]]:
+    async with async_session() as s:
+        row = (await s.execute(sql("""
+            SELECT id, kind, target_key, params, status, source, total, created_at, updated_at, finished_at
+            FROM summary_jobs WHERE id=:job
+        """), {"job": job_id})).mappings().first()
+    return dict(row) if row else None
+
+
+async def finalize_job(job_id: str) -> Optional[str]:
+    """
+    Закрывает джоб, если открытых задач (pending/running) не осталось. Возвращает текущий статус.
+    """
+    async with async_session() as s:
+        await s.execute(sql("""
+            UPDATE summary_jobs
+            SET status='done', finished_at=NOW(), updated_at=NOW()
+            WHERE id=:job AND status IN ('queued','running')
+              AND NOT EXISTS (
+                  SELECT 1 FROM summary_tasks
+                  WHERE job_id=:job AND status IN ('pending','running')
+              )
+        """), {"job": job_id})
+        status = (await s.execute(sql("SELECT status FROM summary_jobs WHERE id=:job"), {"job": job_id})).scalar_one_or_none()
+        await s.commit()
+    return status
+
+
+# === Задачи: claim / heartbeat / ack ===
+
+async def claim_tasks(job_id: str, worker_id: str, *, limit: int = 1, lease_sec: float = SUMMARY_TASK_LEASE_SEC) -> List[Dict[str, Any]]:
+    """
+    Забирает до limit задач: готовые pending и running с истёкшей арендой (упавший воркер).
+    SKIP LOCKED — параллельные воркеры/инстансы не ждут друг друга и не берут одно и то же.
+    """
+    async with async_session() as s:
+        rows = (await s.execute(sql("""
+            UPDATE summary_tasks t
+            SET status='running', worker_id=:w, attempts=t.attempts + 1,
+                lease_until=NOW() + make_interval(secs => :lease), updated_at=NOW()
+            WHERE t.id IN (
+                SELECT id FROM summary_tasks
+                WHERE job_id=:job
+                  AND (
+                      (status='pending' AND next_attempt_at <= NOW())
+                      OR (status='running' AND lease_until < NOW())
+                  )
+                ORDER BY id
+                LIMIT :lim
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING t.id, t.user_id, t.attempts
+        """), {"job": job_id, "w": worker_id, "lease": float(lease_sec), "lim": int(limit)})).mappings().all()
+        if rows:
+            await s.execute(sql("""
+                UPDATE summary_jobs SET status='running', updated_at=NOW()
+                WHERE id=:job AND status='queued'
+            """), {"job": job_id})
+        await s.commit()
+    return [dict(r) for r in rows]
+
+
+async def heartbeat(task_ids: List[int], worker_id: str, *, lease_sec: float = SUMMARY_TASK_LEASE_SEC) -> int:
+    if not task_ids:
+        return 0
+    async with async_session() as s:
+        res = await s.execute(sql("""
+            UPDATE summary_tasks
+            SET lease_until=NOW() + make_interval(secs => :lease), updated_at=NOW()
+            WHERE id = ANY(CAST(:ids AS bigint[])) AND worker_id=:w AND status='running'
+        """), {"ids": [int(x) for x in task_ids], "w": worker_id, "lease": float(lease_sec)})
+        await s.commit()
+    return int(getattr(res, "rowcount", 0) or 0)
+
+
+async def complete_tasks(done: List[Tuple[int, Optional[int], int, Optional[str]]], worker_id: str) -> None:
+    """done: [(task_id, result_id | None, duration_ms, outcome | None)] — одним UPDATE."""
+    if not done:
+        return
+    async with async_session() as s:
+        await s.execute(sql("""
+            UPDATE summary_tasks t
+            SET status='done', result_id=v.rid, duration_ms=v.ms, outcome=v.outcome,
+                lease_until=NULL, last_error=NULL, updated_at=NOW()
+            FROM (
+                SELECT unnest(CAST(:ids AS bigint[])) AS id,
+                       unnest(CAST(:rids AS bigint[])) AS rid,
+                       unnest(CAST(:ms AS int[])) AS ms,
+                       unnest(CAST(:outcomes AS text[])) AS outcome
+            ) v
+            WHERE t.id = v.id AND t.worker_id=:w
+        """), {
+            "ids": [int(d[0]) for d in done],
+            "rids": [None if d[1] is None else int(d[1]) for d in done],
+            "ms": [int(d[2]) for d in done],
+            "outcomes": [d[3] for d in done],
+            "w": worker_id,
+        })
+        await s.commit()
+
+
+async def fail_task(task_id: int, worker_id: str, *, attempts: int, error: str, duration_ms: int) -> str:
+    """
+    Ошибка задачи: pending с бэкоффом или failed после SUMMARY_TASK_MAX_ATTEMPTS попыток.
+    """
+    final = attempts >= SUMMARY_TASK_MAX_ATTEMPTS
+    async with async_session() as s:
+        await s.execute(sql("""
+            UPDATE summary_tasks
+            SET status=:st, last_error=:err, duration_ms=:ms, lease_until=NULL,
+                next_attempt_at=NOW() + make_interval(secs => :delay), updated_at=NOW()
+            WHERE id=:id AND worker_id=:w
+        """), {
+            "st": "failed" if final else "pending",
+            "err": (error or "")[:1000],
+            "ms": int(duration_ms),
+            "delay": 0.0 if final else backoff_delay(attempts),
+            "id": int(task_id),
+            "w": worker_id,
+        })
+        await s.commit()
+    return "failed" if final else "retry"
+
+
+async def _next_pending_in(job_id: str) -> Optional[float]:
+    """Через сколько секунд станет готова ближайшая pending-задача (None — таких нет)."""
+    async with async_session() as s:
+        v = (await s.execute(sql("""
+            SELECT EXTRACT(EPOCH FROM (MIN(next_attempt_at) - NOW()))
+            FROM summary_tasks WHERE job_id=:job AND status='pending'
+        """), {"job": job_id})).scalar_one_or_none()
+    return None if v is None else max(0.0, float(v))
+
+
+# === Воркер ===
+
+async def run_job_worker(
+    job_id: str,
+    *,
+    concurrency: int = DAILY_SUMMARIES_CONCURRENCY,
+    deadline: Optional[float] = None,
+    worker_id: Optional[str] = None,
+    lease_sec: float = SUMMARY_TASK_LEASE_SEC,
+    max_idle_wait_sec: float = 30.0,
+) -> Dict[str, Any]:
+    """
+    Обрабатывает задачи джоба, пока они есть (или до deadline по time.monotonic()).
+    Можно запускать на нескольких инстансах одновременно. Точки Qdrant копятся и пишутся
+    пачками; задача подтверждается (done) только после того, как её точка записана.
+    """
+    job = await _load_job(job_id)
+    if not job:
+        raise ValueError(f"summary job not found: {job_id}")
+    handler = TASK_HANDLERS[job["kind"]]
+    period = _period_from_key(job["kind"], job["target_key"])
+    worker_id = worker_id or default_worker_id()
+
+    # flush_size не достигается: сбрасываем сами, чтобы подтверждать задачи после записи точек
+    batch = SummaryBatch(flush_size=1 << 30)
+    unacked: List[Tuple[int, Optional[int], int, int, Optional[str]]] = []  # (task_id, result_id, ms, attempts, outcome)
+    in_flight: set = set()
+    flush_lock = asyncio.Lock()
+    stats: Dict[str, Any] = {"worker_id": worker_id, "done": 0, "retry": 0, "failed": 0, "rate_limited": 0, "flushes": 0}
+    stop = asyncio.Event()
+
+    async def flush() -> None:
+        async with flush_lock:
+            # забираем буфер и подтверждения синхронно — без await между ними
+            items, acks = batch.items, list(unacked)
+            batch.items = []
+            unacked.clear()
+            if not acks:
+                return
+            try:
+                if items:
+                    await upsert_summary_points_bulk(items)
+                    stats["flushes"] += 1
+            except Exception as e:
+                _safe_print(f"[summary_jobs] qdrant flush failed job={job_id}: {e!r}")
+                for task_id, _, ms, attempts, _ in acks:
+                    stats[await fail_task(task_id, worker_id, attempts=attempts, error=f"qdrant: {e!r}", duration_ms=ms)] += 1
+                    in_flight.discard(task_id)
+                return
+            await complete_tasks([(t, r, ms, oc) for t, r, ms, _, oc in acks], worker_id)
+            stats["done"] += len(acks)
+            for task_id, *_ in acks:
+                in_flight.discard(task_id)
+
+    async def beat() -> None:
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=max(1.0, lease_sec / 3.0))
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await heartbeat(list(in_flight), worker_id, lease_sec=lease_sec)
+            except Exception as e:
+                _safe_print(f"[summary_jobs] heartbeat failed job={job_id}: {e!r}")
+
+    async def work() -> None:
+        while True:
+            if deadline is not None and time.monotonic() > deadline:
+                return
+            tasks = await claim_tasks(job_id, worker_id, limit=1, lease_sec=lease_sec)
+            if not tasks:
+                wait = await _next_pending_in(job_id)
+                if wait is None or (deadline is not None and time.monotonic() + wait > deadline):
+                    return
+                await asyncio.sleep(min(wait, max_idle_wait_sec) + random.random())
+                continue
+            task = tasks[0]
+            in_flight.add(task["id"])
+            t0 = time.perf_counter()
+            trace: Dict[str, Any] = {}
+            try:
+                rid = await handler(int(task["user_id"]), period, batch, trace)
+                if trace.get("outcome") in RETRY_OUTCOMES:
+                    # пустой ответ LLM — не «готово»: задача уйдёт на повтор с бэкоффом
+                    raise RuntimeError(f"{job['kind']} outcome={trace['outcome']}")
+            except Exception as e:
+                ms = int((time.perf_counter() - t0) * 1000)
+                SUMMARY_METRICS.observe("user_total", ms)
+                if is_rate_limit_error(e):
+                    stats["rate_limited"] += 1
+                    SUMMARY_METRICS.incr(f"{job['kind']}_rate_limited")
+                else:
+                    SUMMARY_METRICS.incr(f"{job['kind']}_error")
+                stats[await fail_task(task["id"], worker_id, attempts=int(task["attempts"]), error=repr(e), duration_ms=ms)] += 1
+                in_flight.discard(task["id"])
+                continue
+            ms = (time.perf_counter() - t0) * 1000
+            SUMMARY_METRICS.observe("user_total", ms)
+            unacked.append((task["id"], rid, int(ms), int(task["attempts"]), trace.get("outcome")))
+            # буфер пуст — ждать записи нечего (нет точки или up_to_date), подтверждаем сразу
+            if len(batch.items) >= SUMMARY_UPSERT_BATCH or not batch.items:
+                await flush()
+
+    hb = asyncio.create_task(beat())
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(work() for _ in range(max(1, concurrency))))
+    finally:
+        try:
+            await flush()
+        finally:
+            stop.set()
+            await hb
+    stats["wall_sec"] = round(time.perf_counter() - started, 2)
+    stats["job_status"] = await finalize_job(job_id)
+    _safe_print(f"[summary_jobs] worker done job={job_id} {stats}")
+    return stats
+
+
+# === Прогресс из таблиц ===
+
+async def job_status(job_id: str) -> Optional[Dict[str, Any]]:
+    job = await _load_job(job_id)
+    if not job:
+        return None
+    async with async_session() as s:
+        by_status = {
+            r["status"]: int(r["n"])
+            for r in (await s.execute(sql("""
+                SELECT status, COUNT(*) AS n FROM summary_tasks WHERE job_id=:job GROUP BY status
+            """), {"job": job_id})).mappings().all()
+        }
+        outcomes = {
+            (r["outcome"] or "unknown"): int(r["n"])
+            for r in (await s.execute(sql("""
+                SELECT outcome, COUNT(*) AS n FROM summary_tasks
+                WHERE job_id=:job AND status='done' GROUP BY outcome
+            """), {"job": job_id})).mappings().all()
+        }
+        # outcome пишется с 20261019_summary_tasks_outcome; у старых задач — только result_id
+        agg = (await s.execute(sql("""
+            SELECT COUNT(*) FILTER (WHERE outcome = 'written' OR (outcome IS NULL AND result_id IS NOT NULL)) AS written,
+                   COALESCE(SUM(GREATEST(attempts - 1, 0)), 0) AS retries,
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY duration_ms) FILTER (WHERE status='done') AS p50,
+                   percentile_cont(0.95) WITHIN GROUP (ORDER BY duration_ms) FILTER (WHERE status='done') AS p95,
+                   COUNT(DISTINCT worker_id) FILTER (WHERE status='running' AND lease_until > NOW()) AS workers
+            FROM summary_tasks WHERE job_id=:job
+        """), {"job": job_id})).mappings().first()
+        slowest = (await s.execute(sql("""
+            SELECT user_id, duration_ms FROM summary_tasks
+            WHERE job_id=:job AND status='done'
+            ORDER BY duration_ms DESC NULLS LAST LIMIT 5
+        """), {"job": job_id})).mappings().all()
+        errors = (await s.execute(sql("""
+            SELECT user_id, status, attempts, last_error FROM summary_tasks
+            WHERE job_id=:job AND last_error IS NOT NULL
+            ORDER BY updated_at DESC LIMIT 5
+        """), {"job": job_id})).mappings().all()
+
+    done = by_status.get("done", 0)
+    failed = by_status.get("failed", 0)
+    for k in ("created_at", "updated_at", "finished_at"):
+        if job.get(k) is not None:
+            job[k] = job[k].isoformat()
+    return {
+        **job,
+        "tasks": by_status,
+        "remaining": by_status.get("pending", 0) + by_status.get("running", 0),
+        "counters": {
+            "checked_users": done + failed,
+            "processed_users": done,
+            "summaries_written": int(agg["written"] or 0),
+            "retries": int(agg["retries"] or 0),
+            "errors": failed,
+        },
+        "outcomes": outcomes,
+        "timing": {
+            "user_ms": {"p50": agg["p50"], "p95": agg["p95"]},
+            "slowest": [dict(r) for r in slowest],
+            "active_workers": int(agg["workers"] or 0),
+        },
+        "last_errors": [dict(r) for r in errors],
+    }
+
+
+async def recent_jobs(limit: int = 20) -> List[Dict[str, Any]]:
+    async with async_session() as s:
+        rows = (await s.execute(sql("""
+            SELECT id, kind, target_key, status, source, total, created_at, finished_at
+            FROM summary_jobs ORDER BY created_at DESC LIMIT :lim
+        """), {"lim": int(limit)})).mappings().all()
+    out = []
+    for r in rows:
+        d = dict(r)
+        for k in ("created_at", "finished_at"):
+            if d.get(k) is not None:
+                d[k] = d[k].isoformat()
+        out.append(d)
+    return out
+
+
+__all__ = [
+    "TASK_HANDLERS",
+    "create_or_resume_job",
+    "claim_tasks",
+    "heartbeat",
+    "complete_tasks",
+    "fail_task",
+    "finalize_job",
+    "run_job_worker",
+    "job_status",
+    "recent_jobs",
+    "backoff_delay",
+    "target_key",
+]
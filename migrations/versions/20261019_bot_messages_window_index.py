@@ -0,0 +1,39 @@
+"""bot_messages (created_at, user_id) index for daily summary planning (idempotent)"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# Alembic identifiers
+revision = "20261019_bot_messages_window_index"
+down_revision = "20260122_add_tg_blocked_fields"
+branch_labels = None
+depends_on = None
+
+INDEX_NAME = "ix_bot_messages_created_at_user_id"
+
+
+def _insp():
+    bind = op.get_bind()
+    return sa.inspect(bind)
+
+
+def _has_table(name: str) -> bool:
+    return name in _insp().get_table_names()
+
+
+def _has_index(table: str, index_name: str) -> bool:
+    if not _has_table(table):
+        return False
+    idxs = [i["name"] for i in _insp().get_indexes(table)]
+    return index_name in idxs
+
+
+def upgrade() -> None:
+    # plan_daily_candidates: диапазон по created_at + GROUP BY user_id за сутки
+    if _has_table("bot_messages") and not _has_index("bot_messages", INDEX_NAME):
+        op.create_index(INDEX_NAME, "bot_messages", ["created_at", "user_id"])
+
+
+def downgrade() -> None:
+    if _has_index("bot_messages", INDEX_NAME):
+        op.drop_index(INDEX_NAME, table_name="bot_messages")
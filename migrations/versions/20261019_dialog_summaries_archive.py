@@ -0,0 +1,47 @@
+"""dialog_summaries_archive: Postgres copy of summaries removed by compaction (idempotent)"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# Alembic identifiers
+revision = "20261019_dialog_summaries_archive"
+down_revision = "20261019_dialog_summaries_upsert_index"
+branch_labels = None
+depends_on = None
+
+
+def _insp():
+    bind = op.get_bind()
+    return sa.inspect(bind)
+
+
+def _has_table(name: str) -> bool:
+    return name in _insp().get_table_names()
+
+
+def upgrade() -> None:
+    if not _has_table("dialog_summaries_archive"):
+        op.create_table(
+            "dialog_summaries_archive",
+            # id — тот же, что был в dialog_summaries (и у точки в Qdrant)
+            sa.Column("id", sa.BigInteger, primary_key=True, autoincrement=False),
+            sa.Column("user_id", sa.BigInteger, nullable=False),
+            sa.Column("kind", sa.String(16), nullable=False),
+            sa.Column("period_start", sa.DateTime(timezone=True), nullable=False),
+            sa.Column("period_end", sa.DateTime(timezone=True), nullable=False),
+            sa.Column("text", sa.Text, nullable=False),
+            sa.Column("tokens", sa.Integer, nullable=True),
+            sa.Column("source_count", sa.Integer, nullable=True),
+            sa.Column("source_last_id", sa.BigInteger, nullable=True),
+            sa.Column("created_at", sa.DateTime(timezone=True), nullable=True),
+            sa.Column("updated_at", sa.DateTime(timezone=True), nullable=True),
+            sa.Column("archived_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+            sa.Column("run_id", sa.String(32), nullable=True),
+        )
+        op.create_index("ix_dialog_summaries_archive_user_period", "dialog_summaries_archive", ["user_id", "period_start"])
+        op.create_index("ix_dialog_summaries_archive_run", "dialog_summaries_archive", ["run_id"])
+
+
+def downgrade() -> None:
+    if _has_table("dialog_summaries_archive"):
+        op.drop_table("dialog_summaries_archive")
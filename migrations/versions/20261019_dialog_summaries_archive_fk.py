@@ -0,0 +1,46 @@
+"""dialog_summaries_archive.user_id → users.id ON DELETE CASCADE, как у dialog_summaries (idempotent)"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# Alembic identifiers
+revision = "20261019_dialog_summaries_archive_fk"
+down_revision = "20261019_dialog_summaries_indexed_at"
+branch_labels = None
+depends_on = None
+
+_FK_NAME = "fk_dialog_summaries_archive_user_id_users"
+
+
+def _insp():
+    bind = op.get_bind()
+    return sa.inspect(bind)
+
+
+def _has_table(name: str) -> bool:
+    return name in _insp().get_table_names()
+
+
+def _has_user_fk() -> bool:
+    for fk in _insp().get_foreign_keys("dialog_summaries_archive"):
+        if fk.get("referred_table") == "users" and fk.get("constrained_columns") == ["user_id"]:
+            return True
+    return False
+
+
+def upgrade() -> None:
+    if not _has_table("dialog_summaries_archive") or _has_user_fk():
+        return
+    # архив удалённых пользователей не должен пережить их удаление
+    op.execute(sa.text("""
+        DELETE FROM dialog_summaries_archive a
+        WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.id = a.user_id)
+    """))
+    op.create_foreign_key(
+        _FK_NAME, "dialog_summaries_archive", "users", ["user_id"], ["id"], ondelete="CASCADE"
+    )
+
+
+def downgrade() -> None:
+    if _has_table("dialog_summaries_archive") and _has_user_fk():
+        op.drop_constraint(_FK_NAME, "dialog_summaries_archive", type_="foreignkey")
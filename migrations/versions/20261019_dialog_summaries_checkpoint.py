@@ -0,0 +1,37 @@
+"""dialog_summaries.source_last_id: checkpoint for incremental daily summaries (idempotent)"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# Alembic identifiers
+revision = "20261019_dialog_summaries_checkpoint"
+down_revision = "20261019_summary_jobs"
+branch_labels = None
+depends_on = None
+
+
+def _insp():
+    bind = op.get_bind()
+    return sa.inspect(bind)
+
+
+def _has_table(name: str) -> bool:
+    return name in _insp().get_table_names()
+
+
+def _has_column(table: str, column_name: str) -> bool:
+    if not _has_table(table):
+        return False
+    cols = [c["name"] for c in _insp().get_columns(table)]
+    return column_name in cols
+
+
+def upgrade() -> None:
+    # последний bot_messages.id, учтённый в саммари (NULL — старые записи, пересоберутся целиком)
+    if _has_table("dialog_summaries") and not _has_column("dialog_summaries", "source_last_id"):
+        op.add_column("dialog_summaries", sa.Column("source_last_id", sa.BigInteger(), nullable=True))
+
+
+def downgrade() -> None:
+    if _has_column("dialog_summaries", "source_last_id"):
+        op.drop_column("dialog_summaries", "source_last_id")
@@ -0,0 +1,38 @@
+"""dialog_summaries.indexed_at: when the row's text was last written to Qdrant (idempotent)"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# Alembic identifiers
+revision = "20261019_dialog_summaries_indexed_at"
+down_revision = "20261019_summary_tasks_outcome"
+branch_labels = None
+depends_on = None
+
+
+def _insp():
+    bind = op.get_bind()
+    return sa.inspect(bind)
+
+
+def _has_table(name: str) -> bool:
+    return name in _insp().get_table_names()
+
+
+def _has_column(table: str, column_name: str) -> bool:
+    if not _has_table(table):
+        return False
+    cols = [c["name"] for c in _insp().get_columns(table)]
+    return column_name in cols
+
+
+def upgrade() -> None:
+    # Чекпоинт source_last_id коммитится до записи точки; NULL — точки для текущего текста может не быть,
+    # make_daily перепишет её вместо пропуска "up_to_date". У старых строк NULL: один лишний эмбеддинг.
+    if _has_table("dialog_summaries") and not _has_column("dialog_summaries", "indexed_at"):
+        op.add_column("dialog_summaries", sa.Column("indexed_at", sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    if _has_column("dialog_summaries", "indexed_at"):
+        op.drop_column("dialog_summaries", "indexed_at")
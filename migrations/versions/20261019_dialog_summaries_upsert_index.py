@@ -0,0 +1,62 @@
+"""dialog_summaries: unique (user_id, kind, period_start, period_end) for INSERT ... ON CONFLICT (idempotent)"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# Alembic identifiers
+revision = "20261019_dialog_summaries_upsert_index"
+down_revision = "20261019_dialog_summaries_checkpoint"
+branch_labels = None
+depends_on = None
+
+INDEX_NAME = "uq_dialog_summaries_user_kind_period"
+SPAN_COLUMNS = ["user_id", "kind", "period_start", "period_end"]
+
+
+def _insp():
+    bind = op.get_bind()
+    return sa.inspect(bind)
+
+
+def _has_table(name: str) -> bool:
+    return name in _insp().get_table_names()
+
+
+def _has_index(table: str, index_name: str) -> bool:
+    if not _has_table(table):
+        return False
+    idxs = [i["name"] for i in _insp().get_indexes(table)]
+    return index_name in idxs
+
+
+def _has_unique_span(table: str) -> bool:
+    # уникальность могла прийти констрейнтом из 20251002 (uq_dialog_summaries_span) или индексом
+    insp = _insp()
+    for uc in insp.get_unique_constraints(table):
+        if list(uc.get("column_names") or []) == SPAN_COLUMNS:
+            return True
+    for ix in insp.get_indexes(table):
+        if ix.get("unique") and list(ix.get("column_names") or []) == SPAN_COLUMNS:
+            return True
+    return False
+
+
+def upgrade() -> None:
+    if not _has_table("dialog_summaries") or _has_unique_span("dialog_summaries"):
+        return
+    # дубли, накопленные гонками SELECT → INSERT: оставляем самую свежую запись периода
+    op.execute(sa.text("""
+        DELETE FROM dialog_summaries d
+        USING dialog_summaries k
+        WHERE d.user_id = k.user_id
+          AND d.kind = k.kind
+          AND d.period_start = k.period_start
+          AND d.period_end = k.period_end
+          AND d.id < k.id
+    """))
+    op.create_index(INDEX_NAME, "dialog_summaries", SPAN_COLUMNS, unique=True)
+
+
+def downgrade() -> None:
+    if _has_index("dialog_summaries", INDEX_NAME):
+        op.drop_index(INDEX_NAME, table_name="dialog_summaries")
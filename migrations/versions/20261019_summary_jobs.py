@@ -0,0 +1,72 @@
+"""summary_jobs / summary_tasks: durable queue for summaries jobs (idempotent)"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# Alembic identifiers
+revision = "20261019_summary_jobs"
+down_revision = "20261019_bot_messages_window_index"
+branch_labels = None
+depends_on = None
+
+
+def _insp():
+    bind = op.get_bind()
+    return sa.inspect(bind)
+
+
+def _has_table(name: str) -> bool:
+    return name in _insp().get_table_names()
+
+
+def upgrade() -> None:
+    if not _has_table("summary_jobs"):
+        op.create_table(
+            "summary_jobs",
+            sa.Column("id", sa.String(64), primary_key=True),
+            sa.Column("kind", sa.String(16), nullable=False),          # daily | weekly | monthly
+            sa.Column("target_key", sa.String(32), nullable=False),    # 2025-01-31 / 2025-01
+            sa.Column("params", postgresql.JSONB, nullable=False, server_default=sa.text("'{}'::jsonb")),
+            sa.Column("status", sa.String(16), nullable=False, server_default="queued"),  # queued | running | done | failed
+            sa.Column("source", sa.String(32), nullable=True),
+            sa.Column("total", sa.Integer, nullable=False, server_default="0"),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+            sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+            sa.Column("finished_at", sa.DateTime(timezone=True), nullable=True),
+        )
+        # одна активная задача на (kind, период): повторный запуск подхватывает её, а не плодит дубликат
+        op.create_index(
+            "uq_summary_jobs_active",
+            "summary_jobs",
+            ["kind", "target_key"],
+            unique=True,
+            postgresql_where=sa.text("status IN ('queued','running')"),
+        )
+
+    if not _has_table("summary_tasks"):
+        op.create_table(
+            "summary_tasks",
+            sa.Column("id", sa.BigInteger, primary_key=True, autoincrement=True),
+            sa.Column("job_id", sa.String(64), sa.ForeignKey("summary_jobs.id", ondelete="CASCADE"), nullable=False),
+            sa.Column("user_id", sa.BigInteger, nullable=False),
+            sa.Column("status", sa.String(16), nullable=False, server_default="pending"),  # pending | running | done | failed
+            sa.Column("attempts", sa.Integer, nullable=False, server_default="0"),
+            sa.Column("worker_id", sa.String(64), nullable=True),
+            sa.Column("lease_until", sa.DateTime(timezone=True), nullable=True),
+            sa.Column("next_attempt_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+            sa.Column("result_id", sa.BigInteger, nullable=True),
+            sa.Column("duration_ms", sa.Integer, nullable=True),
+            sa.Column("last_error", sa.Text, nullable=True),
+            sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+            sa.UniqueConstraint("job_id", "user_id", name="uq_summary_tasks_job_user"),
+        )
+        op.create_index("ix_summary_tasks_claim", "summary_tasks", ["job_id", "status", "next_attempt_at"])
+
+
+def downgrade() -> None:
+    if _has_table("summary_tasks"):
+        op.drop_table("summary_tasks")
+    if _has_table("summary_jobs"):
+        op.drop_index("uq_summary_jobs_active", table_name="summary_jobs")
+        op.drop_table("summary_jobs")
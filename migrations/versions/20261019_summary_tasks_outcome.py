@@ -0,0 +1,37 @@
+"""summary_tasks.outcome: how a finished task ended (written / up_to_date / no_messages ...) (idempotent)"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# Alembic identifiers
+revision = "20261019_summary_tasks_outcome"
+down_revision = "20261019_dialog_summaries_archive"
+branch_labels = None
+depends_on = None
+
+
+def _insp():
+    bind = op.get_bind()
+    return sa.inspect(bind)
+
+
+def _has_table(name: str) -> bool:
+    return name in _insp().get_table_names()
+
+
+def _has_column(table: str, column_name: str) -> bool:
+    if not _has_table(table):
+        return False
+    cols = [c["name"] for c in _insp().get_columns(table)]
+    return column_name in cols
+
+
+def upgrade() -> None:
+    # result_id есть и у «ничего не писали» (up_to_date) — счёт записанных саммари идёт по outcome
+    if _has_table("summary_tasks") and not _has_column("summary_tasks", "outcome"):
+        op.add_column("summary_tasks", sa.Column("outcome", sa.String(32), nullable=True))
+
+
+def downgrade() -> None:
+    if _has_column("summary_tasks", "outcome"):
+        op.drop_column("summary_tasks", "outcome")
@@ -0,0 +1,144 @@
+# scripts/bench_collection_profiles.py
+# -*- coding: utf-8 -*-
+"""
+Профили корпусной коллекции (default / scalar / scalar-disk / binary): recall@k против точного
+поиска, задержка и оценка памяти. Векторы берём из боевой коллекции (--source, scroll)
+или генерируем (--synthetic N). Для каждого профиля создаётся временная коллекция
+bench_profile_<name> в локальном Qdrant; точный поиск (exact=True) — эталон.
+
+  python scripts/bench_collection_profiles.py --url http://localhost:6333 --source reflectai_corpus_v2
+  python scripts/bench_collection_profiles.py --url http://localhost:6333 --synthetic 50000 --dim 1536 --ef 64,128
+"""
+from __future__ import annotations
+
+import sys
+import time
+import argparse
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from qdrant_client import QdrantClient
+from qdrant_client.http import models as qm
+
+from app.qdrant_client import (
+    COLLECTION_PROFILES,
+    get_collection_profile,
+    profile_search_params,
+    _quantization_config,
+)
+
+
+def _load_vectors(client: QdrantClient, source: Optional[str], synthetic: int, dim: int, limit: int) -> np.ndarray:
+    if not source:
+        rng = np.random.default_rng(3)
+        v = rng.standard_normal((synthetic, dim), dtype=np.float32)
+        return v / np.linalg.norm(v, axis=1, keepdims=True)
+    out: List[List[float]] = []
+    offset = None
+    while len(out) < limit:
+        points, offset = client.scroll(source, with_payload=False, with_vectors=True, limit=512, offset=offset)
+        for p in points or []:
+            vec = p.vector
+            if isinstance(vec, dict):
+                vec = next(iter(vec.values()))
+            out.append(vec)
+        if not offset:
+            break
+    return np.asarray(out[:limit], dtype=np.float32)
+
+
+def _memory_estimate(n: int, dim: int, profile: dict) -> str:
+    f32 = n * dim * 4
+    q = profile["quantization"]
+    q_bytes = 0
+    if q and q.get("type") == "scalar":
+        q_bytes = n * dim
+    elif q and q.get("type") == "binary":
+        q_bytes = n * dim // 8
+    ram = q_bytes + (0 if profile["on_disk"] else f32)
+    graph = n * profile["hnsw"]["m"] * 2 * 4
+    return f"ram≈{(ram + graph) / 2**20:.0f}MB (vectors {ram / 2**20:.0f}MB + graph {graph / 2**20:.0f}MB), disk≈{f32 / 2**20:.0f}MB"
+
+
+def _wait_green(client: QdrantClient, name: str, timeout: float = 3600.0) -> None:
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < timeout:
+        if str(client.get_collection(name).status).lower().endswith("green"):
+            return
+        time.sleep(2.0)
+
+
+def _pct(vals: List[float], q: float) -> float:
+    vals = sorted(vals)
+    return vals[min(len(vals) - 1, int(round(q * (len(vals) - 1))))] if vals else 0.0
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Recall@k vs latency vs memory for collection profiles")
+    ap.add_argument("--url", default="http://localhost:6333")
+    ap.add_argument("--source", default=None, help="коллекция-источник векторов")
+    ap.add_argument("--limit", type=int, default=100000, help="максимум векторов из источника")
+    ap.add_argument("--synthetic", type=int, default=20000)
+    ap.add_argument("--dim", type=int, default=1536)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=6)
+    ap.add_argument("--profiles", default=",".join(COLLECTION_PROFILES))
+    ap.add_argument("--ef", default="", help="через запятую: перебрать hnsw_ef поверх профиля")
+    ap.add_argument("--keep", action="store_true")
+    a = ap.parse_args()
+
+    client = QdrantClient(url=a.url, timeout=300)
+    vecs = _load_vectors(client, a.source, a.synthetic, a.dim, a.limit)
+    n, dim = vecs.shape
+    rng = np.random.default_rng(5)
+    # запросы — слегка зашумлённые точки корпуса (ближе к реальным, чем чистый шум)
+    qidx = rng.choice(n, size=min(a.queries, n), replace=False)
+    queries = vecs[qidx] + rng.normal(0, 0.02, size=(len(qidx), dim)).astype(np.float32)
+    print(f"vectors={n} dim={dim} queries={len(queries)} k={a.k}")
+
+    efs = [int(x) for x in a.ef.split(",") if x.strip()] or [None]
+    for pname in [p.strip() for p in a.profiles.split(",") if p.strip()]:
+        prof = get_collection_profile(pname)
+        name = f"bench_profile_{prof['name'].replace('-', '_')}"
+        if client.collection_exists(name):
+            client.delete_collection(name)
+        client.create_collection(
+            collection_name=name,
+            vectors_config=qm.VectorParams(size=dim, distance=qm.Distance.COSINE, on_disk=bool(prof["on_disk"])),
+            hnsw_config=qm.HnswConfigDiff(**prof["hnsw"]),
+            quantization_config=_quantization_config(prof["quantization"]),
+        )
+        for start in range(0, n, 512):
+            client.upsert(name, points=qm.Batch(ids=list(range(start, min(n, start + 512))),
+                                                vectors=vecs[start:start + 512].tolist()), wait=False)
+        _wait_green(client, name)
+
+        truth = [
+            {p.id for p in client.query_points(name, query=q.tolist(), limit=a.k,
+                                               search_params=qm.SearchParams(exact=True)).points}
+            for q in queries
+        ]
+        for ef in efs:
+            params = profile_search_params(prof["name"], hnsw_ef=ef)
+            lat, rec = [], []
+            for q, want in zip(queries, truth):
+                t0 = time.perf_counter()
+                res = client.query_points(name, query=q.tolist(), limit=a.k, search_params=params)
+                lat.append((time.perf_counter() - t0) * 1000.0)
+                rec.append(len({p.id for p in res.points} & want) / max(1, len(want)))
+            print(
+                f"{prof['name']:<12} ef={getattr(params, 'hnsw_ef', None)!s:<5} recall@{a.k}={float(np.mean(rec)):.3f} "
+                f"p50={_pct(lat, 0.5):6.2f}ms p95={_pct(lat, 0.95):6.2f}ms | {_memory_estimate(n, dim, prof)}"
+            )
+        if not a.keep:
+            client.delete_collection(name)
+
+
+if __name__ == "__main__":
+    main()
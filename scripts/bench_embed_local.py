@@ -0,0 +1,119 @@
+# scripts/bench_embed_local.py
+# -*- coding: utf-8 -*-
+"""
+Локальные эмбеддинги (sentence-transformers, torch/onnx/onnx-int8) против HTTP-провайдера.
+Меряем: одиночные запросы (как в рантайме на каждый ход), параллельные одиночные
+(как при нескольких пользователях — тут работает батчинг) и пакетное кодирование (как в ingest).
+
+  python scripts/bench_embed_local.py --n 64 --concurrency 16
+  LOCAL_EMBED_BACKEND=onnx-int8 python scripts/bench_embed_local.py --skip-http
+"""
+from __future__ import annotations
+
+import sys
+import time
+import argparse
+import asyncio
+from pathlib import Path
+from typing import Awaitable, Callable, List
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from app.embed_local import LocalEmbedder, get_local_embed_stats
+
+SAMPLES = [
+    "мне тревожно",
+    "не могу уснуть",
+    "Я зацикливаюсь на мыслях перед сном",
+    "Прокрастинирую и не могу начать дела",
+    "как справиться с паникой",
+    "поссорилась с мамой и чувствую вину",
+    "на работе всё валится из рук, ничего не хочется",
+    "как перестать сравнивать себя с другими",
+]
+
+
+def _pct(vals: List[float], q: float) -> float:
+    vals = sorted(vals)
+    return vals[min(len(vals) - 1, int(round(q * (len(vals) - 1))))] if vals else 0.0
+
+
+async def _measure(name: str, one: Callable[[str], Awaitable[List[float]]], texts: List[str], concurrency: int) -> None:
+    lat: List[float] = []
+
+    async def timed(t: str) -> None:
+        t0 = time.perf_counter()
+        await one(t)
+        lat.append((time.perf_counter() - t0) * 1000.0)
+
+    # последовательно — задержка одного хода
+    for t in texts[: max(4, len(texts) // 4)]:
+        await timed(t)
+    seq = list(lat)
+    lat.clear()
+
+    # параллельно — пропускная способность
+    sem = asyncio.Semaphore(concurrency)
+
+    async def guarded(t: str) -> None:
+        async with sem:
+            await timed(t)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(guarded(t) for t in texts))
+    wall = time.perf_counter() - t0
+    print(
+        f"{name:<14} single p50={_pct(seq, 0.5):7.1f}ms p95={_pct(seq, 0.95):7.1f}ms | "
+        f"x{concurrency} p50={_pct(lat, 0.5):7.1f}ms p95={_pct(lat, 0.95):7.1f}ms "
+        f"throughput={len(texts) / wall:7.1f} texts/s"
+    )
+
+
+async def run(n: int, concurrency: int, skip_http: bool) -> None:
+    texts = [f"{SAMPLES[i % len(SAMPLES)]} ({i})" for i in range(n)]
+
+    local = LocalEmbedder()
+    t0 = time.perf_counter()
+    await asyncio.to_thread(local.warmup)
+    print(f"local warmup: {(time.perf_counter() - t0):.1f}s")
+
+    async def local_one(t: str) -> List[float]:
+        return (await local.aembed([t]))[0]
+
+    await _measure("local", local_one, texts, concurrency)
+
+    t0 = time.perf_counter()
+    await local.aembed(texts)
+    print(f"{'local batch':<14} {n} texts in {(time.perf_counter() - t0) * 1000:.0f}ms")
+    print(f"local stats: {dict(get_local_embed_stats(), **local.stats)}")
+    local.close()
+
+    if skip_http:
+        return
+    from app.llm_adapter import embed_texts
+
+    async def http_one(t: str) -> List[float]:
+        return (await asyncio.to_thread(embed_texts, [t]))[0]
+
+    await _measure("http", http_one, texts, concurrency)
+    t0 = time.perf_counter()
+    await asyncio.to_thread(embed_texts, texts)
+    print(f"{'http batch':<14} {n} texts in {(time.perf_counter() - t0) * 1000:.0f}ms")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Local CPU embeddings vs HTTP embeddings provider")
+    ap.add_argument("--n", type=int, default=64, help="сколько текстов")
+    ap.add_argument("--concurrency", type=int, default=16, help="одновременных одиночных запросов")
+    ap.add_argument("--skip-http", action="store_true", help="не мерить HTTP-провайдера (офлайн)")
+    a = ap.parse_args()
+    asyncio.run(run(a.n, a.concurrency, a.skip_http))
+
+
+if __name__ == "__main__":
+    main()
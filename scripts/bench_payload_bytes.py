@@ -0,0 +1,81 @@
+# scripts/bench_payload_bytes.py
+# -*- coding: utf-8 -*-
+"""
+Сколько байт payload приходит из Qdrant на один запрос: весь payload vs только поля рантайма.
+Размер считаем по JSON-сериализации payload'ов (по сети gRPC/REST — того же порядка).
+
+  python scripts/bench_payload_bytes.py --limit 24
+"""
+from __future__ import annotations
+
+import sys
+import json
+import time
+import argparse
+import asyncio
+from pathlib import Path
+from typing import Any, List
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from app.qdrant_client import get_client, qdrant_query, detect_vector_name
+from app.rag_qdrant import embed, RAG_PAYLOAD_FIELDS, QDRANT_COLLECTION
+
+DEFAULT_QUERIES = [
+    "мне тревожно",
+    "не могу уснуть",
+    "Я зацикливаюсь на мыслях перед сном",
+    "Прокрастинирую и не могу начать дела",
+    "как справиться с паникой",
+]
+
+
+def _payload_bytes(points: List[Any]) -> int:
+    total = 0
+    for p in points or []:
+        total += len(json.dumps(getattr(p, "payload", None) or {}, ensure_ascii=False).encode("utf-8"))
+    return total
+
+
+async def run(limit: int, queries: List[str]) -> None:
+    client = get_client()
+    _, vname = detect_vector_name(client, QDRANT_COLLECTION)
+    full_b, slim_b, full_t, slim_t = 0, 0, 0.0, 0.0
+    for q in queries:
+        vec = await embed(q)
+        t0 = time.perf_counter()
+        full = qdrant_query(client, collection_name=QDRANT_COLLECTION, query_vector=vec, limit=limit,
+                            with_payload=True, vector_name=vname)
+        t1 = time.perf_counter()
+        slim = qdrant_query(client, collection_name=QDRANT_COLLECTION, query_vector=vec, limit=limit,
+                            with_payload=True, vector_name=vname, payload_fields=RAG_PAYLOAD_FIELDS)
+        t2 = time.perf_counter()
+        fb, sb = _payload_bytes(full), _payload_bytes(slim)
+        full_b += fb
+        slim_b += sb
+        full_t += t1 - t0
+        slim_t += t2 - t1
+        print(f"{q[:40]!r:44} full={fb:>8}B  fields={sb:>8}B  saved={100.0 * (fb - sb) / max(1, fb):5.1f}%")
+    n = max(1, len(queries))
+    print("-" * 80)
+    print(f"fields={RAG_PAYLOAD_FIELDS}")
+    print(f"avg bytes/query: full={full_b // n} fields={slim_b // n} "
+          f"saved={100.0 * (full_b - slim_b) / max(1, full_b):.1f}%")
+    print(f"avg latency: full={1000 * full_t / n:.1f}ms fields={1000 * slim_t / n:.1f}ms")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Bytes of payload per RAG query: full vs selected fields")
+    ap.add_argument("--limit", type=int, default=24, help="кандидатов на запрос (как initial_limit в MMR)")
+    ap.add_argument("--query", action="append", help="можно несколько раз; по умолчанию — встроенный набор")
+    a = ap.parse_args()
+    asyncio.run(run(a.limit, a.query or DEFAULT_QUERIES))
+
+
+if __name__ == "__main__":
+    main()
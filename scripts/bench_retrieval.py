@@ -0,0 +1,244 @@
+# scripts/bench_retrieval.py
+# -*- coding: utf-8 -*-
+"""
+Воспроизводимый бенчмарк ретрива: фиксированный набор запросов (scripts/rag_bench/queries.json,
+у каждого — ожидаемые теги/источники) прогоняется через rag_qdrant.search_with_meta.
+
+Метрики:
+- recall@k — доля ожидаемых тегов/источников, покрытых выбранными чанками;
+- MRR      — 1/ранг первого релевантного чанка;
+- diversity — доля уникальных источников среди выбранных;
+- ctx_chars — длина собранного контекста;
+- p50/p95 по стадиям: embed, search, cand_embed, mmr, trim (+ compress, cache) и total.
+
+Бэкенды (--backend):
+- qdrant — как в проде, мимо кэша контекстов;
+- local  — точки коллекции один раз выгружаются в память, поиск — точный косинус в numpy
+           (отделяет качество эмбеддингов/MMR от HNSW и сети);
+- cached — прогрев + повторный прогон через кэш контекстов.
+
+Бейзлайны: --save-baseline пишет scripts/rag_bench/baseline_<backend>.json;
+--check сравнивает с ним и завершает процесс с кодом 1 при регрессии (для проверки перед деплоем).
+
+  python scripts/bench_retrieval.py --backend qdrant --save-baseline
+  python scripts/bench_retrieval.py --backend qdrant --check --max-latency-regression 0.25
+"""
+from __future__ import annotations
+
+import sys
+import json
+import time
+import argparse
+import asyncio
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from app import rag_qdrant as rq
+from app.qdrant_client import get_client, QDRANT_COLLECTION
+
+BENCH_DIR = ROOT / "scripts" / "rag_bench"
+STAGES = ["embed", "search", "cand_embed", "mmr", "trim", "compress", "cache", "total"]
+
+
+def _pct(vals: List[float], q: float) -> float:
+    vals = sorted(vals)
+    return vals[min(len(vals) - 1, int(round(q * (len(vals) - 1))))] if vals else 0.0
+
+
+def _hit_labels(payload: Dict[str, Any], source: str) -> set:
+    tags = payload.get("tags") or ((payload.get("meta") or {}).get("tags")) or []
+    labels = {f"tag:{str(t).lower()}" for t in tags}
+    if source:
+        labels.add(f"src:{source.lower()}")
+    return labels
+
+
+def _expected(q: Dict[str, Any]) -> set:
+    return {f"tag:{t.lower()}" for t in q.get("expect_tags", [])} | {f"src:{s.lower()}" for s in q.get("expect_sources", [])}
+
+
+def _matches(expected: set, labels: set) -> set:
+    out = set()
+    for e in expected:
+        if e.startswith("src:"):
+            # источник — подстрока (путь файла/URL)
+            if any(lbl.startswith("src:") and e[4:] in lbl for lbl in labels):
+                out.add(e)
+        elif e in labels:
+            out.add(e)
+    return out
+
+
+class LocalIndex:
+    """
+    Вся коллекция в памяти: точный косинус по numpy. Подменяет rag_qdrant._qdrant_search_async.
+    """
+
+    def __init__(self, limit: int = 200000):
+        client = get_client()
+        ids, vecs, payloads = [], [], []
+        offset = None
+        while len(ids) < limit:
+            points, offset = client.scroll(
+                QDRANT_COLLECTION, with_payload=True, with_vectors=True, limit=512, offset=offset
+            )
+            for p in points or []:
+                v = p.vector
+                if isinstance(v, dict):
+                    v = next(iter(v.values()))
+                ids.append(p.id)
+                vecs.append(v)
+                payloads.append(p.payload or {})
+            if not offset:
+                break
+        m = np.asarray(vecs, dtype=np.float32)
+        self.matrix = m / np.maximum(np.linalg.norm(m, axis=1, keepdims=True), 1e-9)
+        self.ids = ids
+        self.payloads = payloads
+        print(f"[local] loaded {len(ids)} points from {QDRANT_COLLECTION}")
+
+    async def search(self, client, *, vector, limit, flt=None, with_payload=True, vector_name=None, payload_fields=None):
+        q = np.asarray(vector, dtype=np.float32)
+        q /= max(float(np.linalg.norm(q)), 1e-9)
+        scores = self.matrix @ q
+        top = np.argsort(-scores)[: int(limit)]
+        return [SimpleNamespace(id=self.ids[i], score=float(scores[i]), payload=self.payloads[i]) for i in top]
+
+
+async def run(backend: str, queries: List[Dict[str, Any]], k: int, max_chars: int, repeat: int) -> Dict[str, Any]:
+    # теги нужны только бенчмарку для разметки релевантности
+    for f in ("tags", "meta"):
+        if f not in rq.RAG_PAYLOAD_FIELDS:
+            rq.RAG_PAYLOAD_FIELDS.append(f)
+
+    if backend == "local":
+        rq._qdrant_search_async = LocalIndex().search  # type: ignore[assignment]
+    use_cache = backend == "cached"
+    if use_cache:
+        rq.invalidate_ctx_cache()
+        for q in queries:
+            await rq.search_with_meta(q["query"], k=k, max_chars=max_chars, use_cache=True)
+
+    stage_ms: Dict[str, List[float]] = {s: [] for s in STAGES}
+    per_query: List[Dict[str, Any]] = []
+    for _ in range(max(1, repeat)):
+        per_query = []
+        for q in queries:
+            timings: Dict[str, float] = {}
+            t0 = time.perf_counter()
+            ctx, meta = await rq.search_with_meta(q["query"], k=k, max_chars=max_chars, timings=timings, use_cache=use_cache)
+            timings["total"] = (time.perf_counter() - t0) * 1000.0
+            for s, v in timings.items():
+                stage_ms.setdefault(s, []).append(v)
+
+            expected = _expected(q)
+            covered: set = set()
+            rr = 0.0
+            for rank, m in enumerate(meta, 1):
+                got = _matches(expected, _hit_labels(m.get("payload") or {}, m.get("source") or ""))
+                if got and rr == 0.0:
+                    rr = 1.0 / rank
+                covered |= got
+            sources = [m.get("source") or "" for m in meta]
+            per_query.append({
+                "id": q.get("id") or q["query"][:32],
+                "recall": len(covered) / max(1, len(expected)),
+                "rr": rr,
+                "diversity": len(set(sources)) / max(1, len(sources)),
+                "ctx_chars": len(ctx or ""),
+                "selected": len(meta),
+            })
+
+    n = max(1, len(per_query))
+    report: Dict[str, Any] = {
+        "backend": backend,
+        "k": k,
+        "max_chars": max_chars,
+        "queries": len(per_query),
+        "ts": int(time.time()),
+        "quality": {
+            f"recall@{k}": round(sum(r["recall"] for r in per_query) / n, 4),
+            "mrr": round(sum(r["rr"] for r in per_query) / n, 4),
+            "diversity": round(sum(r["diversity"] for r in per_query) / n, 4),
+            "ctx_chars": round(sum(r["ctx_chars"] for r in per_query) / n, 1),
+        },
+        "latency_ms": {
+            s: {"p50": round(_pct(v, 0.5), 2), "p95": round(_pct(v, 0.95), 2)}
+            for s, v in stage_ms.items() if v
+        },
+        "per_query": per_query,
+    }
+    return report
+
+
+def _print(report: Dict[str, Any]) -> None:
+    print(f"backend={report['backend']} queries={report['queries']} k={report['k']}")
+    print("quality: " + " ".join(f"{k}={v}" for k, v in report["quality"].items()))
+    for s, v in report["latency_ms"].items():
+        print(f"  {s:<11} p50={v['p50']:8.2f}ms p95={v['p95']:8.2f}ms")
+
+
+def _check(report: Dict[str, Any], baseline: Dict[str, Any], max_lat: float, max_drop: float) -> List[str]:
+    problems: List[str] = []
+    for key, base in baseline.get("quality", {}).items():
+        if key in ("ctx_chars",):
+            continue
+        cur = report["quality"].get(key)
+        if cur is not None and cur < base - max_drop:
+            problems.append(f"quality {key}: {cur} < baseline {base} - {max_drop}")
+    for stage in ("total", "search", "embed"):
+        base = (baseline.get("latency_ms", {}).get(stage) or {}).get("p95")
+        cur = (report["latency_ms"].get(stage) or {}).get("p95")
+        if base and cur and cur > base * (1.0 + max_lat):
+            problems.append(f"latency {stage} p95: {cur}ms > baseline {base}ms (+{int(max_lat * 100)}%)")
+    return problems
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="RAG retrieval quality/latency benchmark with baselines")
+    ap.add_argument("--backend", choices=["qdrant", "local", "cached"], default="qdrant")
+    ap.add_argument("--queries", default=str(BENCH_DIR / "queries.json"))
+    ap.add_argument("--k", type=int, default=6)
+    ap.add_argument("--max-chars", type=int, default=1200)
+    ap.add_argument("--repeat", type=int, default=3, help="прогонов для латентности (качество — по последнему)")
+    ap.add_argument("--out", default=None, help="куда сохранить отчёт JSON")
+    ap.add_argument("--save-baseline", action="store_true")
+    ap.add_argument("--check", action="store_true", help="сравнить с бейзлайном, exit 1 при регрессии")
+    ap.add_argument("--baseline", default=None)
+    ap.add_argument("--max-latency-regression", type=float, default=0.25)
+    ap.add_argument("--max-quality-drop", type=float, default=0.05)
+    a = ap.parse_args()
+
+    queries = json.loads(Path(a.queries).read_text(encoding="utf-8"))
+    report = asyncio.run(run(a.backend, queries, a.k, a.max_chars, a.repeat))
+    _print(report)
+
+    baseline_path = Path(a.baseline) if a.baseline else BENCH_DIR / f"baseline_{a.backend}.json"
+    if a.out:
+        Path(a.out).write_text(json.dumps(report, ensure_ascii=False, indent=1), encoding="utf-8")
+    if a.save_baseline:
+        baseline_path.write_text(json.dumps(report, ensure_ascii=False, indent=1), encoding="utf-8")
+        print(f"baseline saved: {baseline_path}")
+    if a.check:
+        if not baseline_path.exists():
+            print(f"no baseline at {baseline_path}")
+            sys.exit(2)
+        problems = _check(report, json.loads(baseline_path.read_text(encoding="utf-8")), a.max_latency_regression, a.max_quality_drop)
+        if problems:
+            print("REGRESSION:\n  " + "\n  ".join(problems))
+            sys.exit(1)
+        print("OK: no regression vs baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# scripts/bench_summaries_tenants.py
+# -*- coding: utf-8 -*-
+"""
+Фильтрованный поиск по саммарям: раскладка default (общий HNSW + фильтр по user_id)
+против tenant (is_tenant-индекс tenant_id, m=0/payload_m). Синтетика в локальном Qdrant:
+--users пользователей по --per-user точек, случайные нормированные векторы размерности --dim.
+
+  python scripts/bench_summaries_tenants.py --url http://localhost:6333 --users 10000
+  python scripts/bench_summaries_tenants.py --url http://localhost:6333 --users 100000 --per-user 8
+
+Коллекции bench_summaries_default / bench_summaries_tenant пересоздаются и удаляются в конце
+(--keep — оставить).
+"""
+from __future__ import annotations
+
+import sys
+import time
+import argparse
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from qdrant_client import QdrantClient
+from qdrant_client.http import models as qm
+
+from app.qdrant_client import summaries_user_condition, summaries_tenant_payload
+
+VNAME = "default"
+
+
+def _create(client: QdrantClient, name: str, layout: str, dim: int, payload_m: int) -> None:
+    if client.collection_exists(name):
+        client.delete_collection(name)
+    kwargs: Dict = {"collection_name": name, "vectors_config": {VNAME: qm.VectorParams(size=dim, distance=qm.Distance.COSINE)}}
+    if layout == "tenant":
+        kwargs["hnsw_config"] = qm.HnswConfigDiff(m=0, payload_m=payload_m)
+    client.create_collection(**kwargs)
+    client.create_payload_index(name, "user_id", qm.PayloadSchemaType.INTEGER, wait=True)
+    if layout == "tenant":
+        client.create_payload_index(name, "tenant_id", qm.KeywordIndexParams(type="keyword", is_tenant=True), wait=True)
+
+
+def _fill(client: QdrantClient, names: List[str], users: int, per_user: int, dim: int, batch: int) -> np.ndarray:
+    rng = np.random.default_rng(7)
+    total = users * per_user
+    vecs = rng.standard_normal((total, dim), dtype=np.float32)
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    t0 = time.perf_counter()
+    for start in range(0, total, batch):
+        end = min(total, start + batch)
+        points = [
+            qm.PointStruct(
+                id=i,
+                vector={VNAME: vecs[i].tolist()},
+                payload={**summaries_tenant_payload(i // per_user), "kind": "daily"},
+            )
+            for i in range(start, end)
+        ]
+        for name in names:
+            client.upsert(name, points=points, wait=False)
+    print(f"filled {total} points x{len(names)} in {time.perf_counter() - t0:.1f}s")
+    return vecs
+
+
+def _wait_indexed(client: QdrantClient, name: str, timeout: float = 1800.0) -> None:
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < timeout:
+        info = client.get_collection(name)
+        if str(info.status).lower().endswith("green"):
+            return
+        time.sleep(2.0)
+    print(f"[warn] {name} not green after {timeout:.0f}s")
+
+
+def _pct(vals: List[float], q: float) -> float:
+    vals = sorted(vals)
+    return vals[min(len(vals) - 1, int(round(q * (len(vals) - 1))))] if vals else 0.0
+
+
+def _bench(client: QdrantClient, name: str, tenant: bool, users: int, queries: int, k: int, dim: int) -> None:
+    rng = np.random.default_rng(11)
+    lat: List[float] = []
+    recall: List[float] = []
+    for _ in range(queries):
+        uid = int(rng.integers(0, users))
+        q = rng.standard_normal(dim).astype(np.float32)
+        q /= np.linalg.norm(q)
+        flt = qm.Filter(must=[summaries_user_condition(uid, tenant=tenant)])
+        t0 = time.perf_counter()
+        res = client.query_points(name, query=q.tolist(), using=VNAME, query_filter=flt, limit=k, with_payload=False)
+        lat.append((time.perf_counter() - t0) * 1000.0)
+        exact = client.query_points(
+            name, query=q.tolist(), using=VNAME, query_filter=flt, limit=k, with_payload=False,
+            search_params=qm.SearchParams(exact=True),
+        )
+        got = {p.id for p in res.points}
+        want = {p.id for p in exact.points}
+        recall.append(len(got & want) / max(1, len(want)))
+    print(
+        f"{name:<28} p50={_pct(lat, 0.5):6.2f}ms p95={_pct(lat, 0.95):6.2f}ms "
+        f"recall@{k}={float(np.mean(recall)):.3f} ({queries} queries)"
+    )
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Filtered summaries search: default vs tenant layout")
+    ap.add_argument("--url", default="http://localhost:6333")
+    ap.add_argument("--users", type=int, default=10000)
+    ap.add_argument("--per-user", type=int, default=10)
+    ap.add_argument("--dim", type=int, default=128, help="размерность синтетики (прод: 1536)")
+    ap.add_argument("--queries", type=int, default=500)
+    ap.add_argument("--k", type=int, default=4)
+    ap.add_argument("--payload-m", type=int, default=16)
+    ap.add_argument("--batch", type=int, default=1024)
+    ap.add_argument("--keep", action="store_true")
+    a = ap.parse_args()
+
+    client = QdrantClient(url=a.url, timeout=120)
+    layouts = {"bench_summaries_default": "default", "bench_summaries_tenant": "tenant"}
+    for name, layout in layouts.items():
+        _create(client, name, layout, a.dim, a.payload_m)
+    _fill(client, list(layouts), a.users, a.per_user, a.dim, a.batch)
+    for name in layouts:
+        _wait_indexed(client, name)
+
+    print(f"users={a.users} per_user={a.per_user} dim={a.dim}")
+    for name, layout in layouts.items():
+        _bench(client, name, layout == "tenant", a.users, a.queries, a.k, a.dim)
+
+    if not a.keep:
+        for name in layouts:
+            client.delete_collection(name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# scripts/bench_summarize.py
+# -*- coding: utf-8 -*-
+"""
+Single-shot против map-reduce суммаризации длинного дня.
+
+Источник — реальные сообщения пользователя за день из bot_messages (--user-id/--day)
+или JSON-файл [{role, text}, ...] (--file). Оба режима прогоняются --repeat раз.
+
+Метрики:
+- латентность: total, map, reduce (мс); число кусков; оценка входных токенов;
+- качество (прокси): покрытие ключевых слов по третям дня — из каждой трети берутся
+  самые частые содержательные слова и проверяется, упомянуты ли они в итоговом саммари.
+  Single-shot режет день до последних 500 сообщений, поэтому проседает ранняя треть.
+
+  python scripts/bench_summarize.py --user-id 123 --day 2025-01-31
+  python scripts/bench_summarize.py --file day.json --repeat 3 --chunk-tokens 2000
+"""
+from __future__ import annotations
+
+import re
+import sys
+import json
+import argparse
+import asyncio
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from app import memory_summarizer as ms
+
+_WORD_RE = re.compile(r"[а-яёa-z]{5,}", re.IGNORECASE)
+_STOP = {"который", "которая", "которые", "потому", "сейчас", "просто", "только", "можно", "нужно", "очень", "когда", "чтобы", "этого", "будет"}
+
+
+def _key_terms(messages: List[Dict[str, Any]], top: int) -> List[str]:
+    cnt: Counter = Counter()
+    for m in messages:
+        for w in _WORD_RE.findall((m.get("text") or "").lower()):
+            if w not in _STOP:
+                cnt[w[:6]] += 1
+    return [w for w, _ in cnt.most_common(top)]
+
+
+def _coverage(summary: str, messages: List[Dict[str, Any]], top: int) -> List[float]:
+    low = (summary or "").lower()
+    n = len(messages)
+    thirds = [messages[: n // 3], messages[n // 3: 2 * n // 3], messages[2 * n // 3:]]
+    out = []
+    for part in thirds:
+        terms = _key_terms(part, top)
+        out.append(round(sum(1 for t in terms if t in low) / max(1, len(terms)), 3))
+    return out
+
+
+async def _load(a: argparse.Namespace) -> List[Dict[str, Any]]:
+    if a.file:
+        return json.loads(Path(a.file).read_text(encoding="utf-8"))
+    dt = datetime.strptime(a.day, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    start, end = ms._utc_day_bounds(dt)
+    report: Dict[str, Any] = {}
+    msgs = await ms._fetch_raw_messages(int(a.user_id), start, end, report=report)
+    if report:
+        print(f"filter: {report}")
+    return msgs
+
+
+async def run(a: argparse.Namespace) -> None:
+    ms.SUMMARY_CHUNK_TOKENS = a.chunk_tokens
+    ms.SUMMARY_MAP_CONCURRENCY = a.map_concurrency
+    messages = await _load(a)
+    tokens = sum(ms.estimate_tokens(ms._msg_line(m)) for m in messages if (m.get("text") or "").strip())
+    print(f"messages={len(messages)} est_tokens={tokens} chunk_tokens={a.chunk_tokens} map_concurrency={a.map_concurrency}")
+
+    for mode in ("single", "mapreduce"):
+        for i in range(a.repeat):
+            st: Dict[str, Any] = {}
+            out = await ms._llm_summarize(messages, mode=mode, stats=st)
+            cov = _coverage(out or "", messages, a.top_terms)
+            print(
+                f"{mode:<10} run={i + 1} total={st.get('total_ms', 0):8.0f}ms "
+                f"map={st.get('map_ms', 0):8.0f}ms reduce={st.get('reduce_ms', 0):8.0f}ms "
+                f"chunks={st.get('chunks')} in_tok={st.get('input_tokens')} out_chars={len(out or '')} "
+                f"coverage(early/mid/late)={cov}"
+            )
+            if a.show and i == 0:
+                print((out or "").strip() + "\n")
+    print(f"stats: {ms.get_summarize_stats()}")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Single-shot vs map-reduce summarisation of a long day")
+    src = ap.add_mutually_exclusive_group(required=True)
+    src.add_argument("--user-id", type=int)
+    src.add_argument("--file", help="JSON: [{role, text}, ...]")
+    ap.add_argument("--day", default=None, help="YYYY-MM-DD (UTC), нужен с --user-id")
+    ap.add_argument("--repeat", type=int, default=1)
+    ap.add_argument("--chunk-tokens", type=int, default=ms.SUMMARY_CHUNK_TOKENS)
+    ap.add_argument("--map-concurrency", type=int, default=ms.SUMMARY_MAP_CONCURRENCY)
+    ap.add_argument("--top-terms", type=int, default=15)
+    ap.add_argument("--show", action="store_true", help="напечатать саммари")
+    a = ap.parse_args()
+    if a.user_id is not None and not a.day:
+        ap.error("--day is required with --user-id")
+    asyncio.run(run(a))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,11 @@
 # scripts/ingest_qdrant.py
 # -*- coding: utf-8 -*-
-import os, json, glob, re, uuid, asyncio
+import os, json, glob, re, uuid, asyncio, hashlib
 from typing import List, Dict, Any, Iterable, Tuple, Optional
 
 import httpx
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import PointStruct
+from qdrant_client.http.models import PointStruct, PointIdsList
 from dotenv import load_dotenv
 
 # ensure project root on sys.path when run as a file
@@ -17,7 +17,7 @@ if str(_ROOT) not in sys.path:
 
 load_dotenv()
 
-from app.qdrant_client import normalize_lang_code
+from app.qdrant_client import normalize_lang_code, sentence_end_offsets
 from app.llm_adapter import build_llm_headers, get_router_api_key, get_router_base_url, resolve_model_name
 
 # ---------- Qdrant / Embeddings config ----------
@@ -37,11 +37,42 @@ EMBED_MODEL = resolve_model_name(
 # ---------- Chunking / batching ----------
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 1200))          # рекомендовано 900–1200
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 180))      # 150–200
-BATCH = int(os.getenv("QDRANT_UPSERT_BATCH", 64))
+# 256 точек × 1536 float ≈ 1.5 МБ на запрос: заметно меньше round-trip'ов, чем при 64,
+# и ещё далеко от лимита тела запроса Qdrant (32 МБ)
+BATCH = int(os.getenv("QDRANT_UPSERT_BATCH", 256))
+
+# ---------- Pipeline ----------
+# чтение/чанкование → N воркеров эмбеддинга (общий лимит RPM) → апсерт (wait=False)
+EMBED_BATCH = int(os.getenv("INGEST_EMBED_BATCH", 128))
+EMBED_WORKERS = max(1, int(os.getenv("INGEST_EMBED_WORKERS", 4)))
+EMBED_RPM = float(os.getenv("INGEST_EMBED_RPM", 0))          # 0 — без ограничения
+QUEUE_SIZE = max(1, int(os.getenv("INGEST_QUEUE_SIZE", 8)))  # батчей между стадиями
+UPSERT_WAIT = os.getenv("QDRANT_UPSERT_WAIT", "0") == "1"
 
 # где лежит корпус: по умолчанию corpus/, но читаем и data/*.txt для обратной совместимости
 CORPUS_DIR = os.getenv("CORPUS_DIR", "corpus")
 
+# full — как раньше (теги в корне payload); compact — в корне только то, что читает рантайм
+# (text/title/source/lang), а теги и прочие метаданные уходят в отдельный блок "meta"
+INGEST_PAYLOAD_MODE = os.getenv("INGEST_PAYLOAD_MODE", "full").strip().lower()
+
+# ---------- Incremental ingest ----------
+# INGEST_INCREMENTAL=1: эмбеддим/апсертим только чанки, чьих id ещё нет в коллекции; точки,
+# которых нет в корпусе (удалённые/изменённые чанки, старые случайные uuid4), удаляем.
+# Состояние — сама коллекция (scroll id), а не локальный файл: одинаково на любой машине,
+# прерванный прогон продолжается сам — уже записанные точки пропускаются.
+INGEST_INCREMENTAL = os.getenv("INGEST_INCREMENTAL", "0") == "1"
+# фиксированный namespace: одинаковый чанк → одинаковый id между прогонами и машинами
+_POINT_NAMESPACE = uuid.UUID("6f1f3c2e-6b0a-4f59-9a64-5d0f2b7c1e11")
+
+# ---------- Near-duplicate dedup ----------
+# INGEST_DEDUP=1: из группы почти одинаковых чанков (MinHash/LSH, сходство ≥ порога) грузим один
+INGEST_DEDUP = os.getenv("INGEST_DEDUP", "1") == "1"
+INGEST_DEDUP_THRESHOLD = float(os.getenv("INGEST_DEDUP_THRESHOLD", 0.85))
+INGEST_DEDUP_NUM_PERM = int(os.getenv("INGEST_DEDUP_NUM_PERM", 64))
+INGEST_DEDUP_SHINGLE = int(os.getenv("INGEST_DEDUP_SHINGLE", 5))
+INGEST_DEDUP_REPORT = os.getenv("INGEST_DEDUP_REPORT", f".ingest_dedup_report.{QDRANT_COLLECTION}.json")
+
 # ---------- bilingual tags ----------
 TAG_BILINGUAL: Dict[str, List[str]] = {
     "breathing": ["дыхание"],
@@ -181,7 +212,39 @@ async def embed_many(texts: List[str]) -> List[List[float]]:
         return await _RUNTIME_EMBED(texts)
     return await _openai_embed_many(texts)
 
-def iter_corpus() -> Iterable[Dict[str, Any]]:
+def embed_requests_for(n_texts: int) -> int:
+    """
+    Сколько HTTP-запросов уйдёт на батч: рантайм-эмбеддер шлёт по одному тексту.
+    """
+    return n_texts if _RUNTIME_EMBED is not None else 1
+
+class RateLimiter:
+    """
+    Общий для всех воркеров лимит запросов в минуту (равномерный интервал между запросами).
+    """
+    def __init__(self, rpm: float):
+        self.interval = 60.0 / rpm if rpm and rpm > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, n: int = 1) -> None:
+        if self.interval <= 0:
+            return
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            start = max(now, self._next)
+            self._next = start + self.interval * max(1, n)
+        if start > now:
+            await asyncio.sleep(start - now)
+
+def _pct(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    vals = sorted(values)
+    return vals[min(len(vals) - 1, int(round(q * (len(vals) - 1))))]
+
+def iter_corpus_raw() -> Iterable[Dict[str, Any]]:
     """
     Источники:
       1) Все .txt из CORPUS_DIR/ и data/ (для совместимости)
@@ -209,13 +272,14 @@ def iter_corpus() -> Iterable[Dict[str, Any]]:
             raw_tags = [t.strip() for t in re.split(r"[;,]", meta["tags"]) if t.strip()]
         tags = expand_tags_bilingual(raw_tags)
 
-        for part in split_text(body):
+        for idx, part in enumerate(split_text(body)):
             yield {
                 "text": part,
                 "title": title,
                 "source": source,
                 "lang": lang,
                 "tags": tags,
+                "chunk_index": idx,
             }
 
     # 2) embeddings_index.json (если есть)
@@ -231,6 +295,7 @@ def iter_corpus() -> Iterable[Dict[str, Any]]:
         else:
             items = []
 
+        per_source_idx: Dict[str, int] = {}
         for raw in items:
             if not isinstance(raw, dict):
                 continue
@@ -244,65 +309,245 @@ def iter_corpus() -> Iterable[Dict[str, Any]]:
             lang = normalize_lang_code(raw.get("lang")) or "ru"
             tags = expand_tags_bilingual([t for t in (raw.get("tags") or [])]) if isinstance(raw.get("tags"), list) else []
 
-            if isinstance(vec, list) and isinstance(text, str) and text.strip():
-                yield {"text": text, "title": title, "source": source, "lang": lang, "tags": tags, "embedding": vec}
-            elif isinstance(text, str) and text.strip():
-                yield {"text": text, "title": title, "source": source, "lang": lang, "tags": tags}
+            if not (isinstance(text, str) and text.strip()):
+                continue
+            idx = per_source_idx.get(source, 0)
+            per_source_idx[source] = idx + 1
+
+            if isinstance(vec, list):
+                yield {"text": text, "title": title, "source": source, "lang": lang, "tags": tags, "chunk_index": idx, "embedding": vec}
+            else:
+                yield {"text": text, "title": title, "source": source, "lang": lang, "tags": tags, "chunk_index": idx}
+
+def iter_corpus(dedup: bool = INGEST_DEDUP) -> Iterable[Dict[str, Any]]:
+    """
+    Корпус без почти-дубликатов: первый встреченный чанк группы остаётся, остальные
+    пропускаются (индексы чанков назначены до дедупа, поэтому id точек стабильны).
+    Отчёт о выброшенных чанках пишется в INGEST_DEDUP_REPORT.
+    """
+    if not dedup:
+        yield from iter_corpus_raw()
+        return
+
+    from app.services.near_dedup import NearDuplicateIndex
+    index = NearDuplicateIndex(
+        threshold=INGEST_DEDUP_THRESHOLD,
+        num_perm=INGEST_DEDUP_NUM_PERM,
+        shingle=INGEST_DEDUP_SHINGLE,
+    )
+    dropped: List[Dict[str, Any]] = []
+    for doc in iter_corpus_raw():
+        key = (doc.get("source"), doc.get("chunk_index"))
+        dup = index.check(doc["text"], key)
+        if dup is None:
+            yield doc
+            continue
+        (orig_source, orig_idx), sim = dup
+        dropped.append({
+            "source": doc.get("source"),
+            "chunk_index": doc.get("chunk_index"),
+            "duplicate_of": {"source": orig_source, "chunk_index": orig_idx},
+            "similarity": sim,
+            "chars": len(doc["text"]),
+        })
+
+    report = index.report()
+    report["dropped_chars"] = sum(d["chars"] for d in dropped)
+    print(
+        f"[ingest] dedup: seen={report['seen']} kept={report['kept']} "
+        f"exact={report['exact_dups']} near={report['near_dups']} (threshold={report['threshold']})"
+    )
+    if INGEST_DEDUP_REPORT:
+        try:
+            with open(INGEST_DEDUP_REPORT, "w", encoding="utf-8") as f:
+                json.dump({"summary": report, "dropped": dropped}, f, ensure_ascii=False, indent=1)
+        except Exception as e:
+            print(f"[ingest] dedup report write failed: {e!r}")
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256((text or "").strip().encode("utf-8")).hexdigest()
+
+def point_id_for(doc: Dict[str, Any]) -> str:
+    """
+    Детерминированный id точки: (source, индекс чанка, хэш содержимого).
+    Повторный ingest того же корпуса перезаписывает точки, а не дублирует их.
+    """
+    h = doc.get("content_hash") or content_hash(doc["text"])
+    key = f"{doc.get('source') or ''}|{int(doc.get('chunk_index') or 0)}|{h}"
+    return str(uuid.uuid5(_POINT_NAMESPACE, key))
+
+def collection_point_ids(client: QdrantClient, collection: str = QDRANT_COLLECTION, batch: int = 1024) -> Dict[str, Any]:
+    """
+    Все id точек коллекции: {str(id): id как в Qdrant}. Только id — без payload и векторов.
+    """
+    out: Dict[str, Any] = {}
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection, with_payload=False, with_vectors=False, limit=batch, offset=offset
+        )
+        for p in points or []:
+            out[str(p.id)] = p.id
+        if not offset:
+            return out
+
+def build_payload(doc: Dict[str, Any], mode: str = INGEST_PAYLOAD_MODE) -> Dict[str, Any]:
+    """
+    Payload точки корпуса. lang остаётся в корне — по нему payload-индекс и фильтр.
+    """
+    payload: Dict[str, Any] = {
+        "text": doc["text"],
+        "title": doc.get("title"),
+        "source": doc.get("source"),
+        "lang": doc.get("lang", "ru"),
+    }
+    # "chunk" рантайм читает как запасное поле с текстом — индекс кладём под своим именем
+    if doc.get("chunk_index") is not None:
+        payload["chunk_index"] = int(doc["chunk_index"])
+    # концы предложений: рантайм режет чанк бинарным поиском, без регэкспа на каждый запрос
+    payload["sent_ends"] = sentence_end_offsets(doc["text"])
+    if mode == "compact":
+        payload["meta"] = {"tags": doc.get("tags", [])}
+    else:
+        payload["tags"] = doc.get("tags", [])
+    if doc.get("content_hash"):
+        payload.setdefault("meta", {})["hash"] = doc["content_hash"]
+    return payload
 
 async def main():
-    from app.qdrant_client import get_client, ensure_collection
+    from app.qdrant_client import get_client, ensure_collection, bump_corpus_version
     ensure_collection()
     client: QdrantClient = get_client()
 
-    buffer_texts: List[str] = []
-    buffer_payloads: List[Dict[str, Any]] = []
-    points_batch: List[PointStruct] = []
+    existing: Dict[str, Any] = collection_point_ids(client) if INGEST_INCREMENTAL else {}
+    if existing:
+        print(f"[ingest] incremental: {len(existing)} points already in {QDRANT_COLLECTION}")
+
+    seen: set = set()
+    stats = {"chunks": 0, "skipped": 0, "embedded": 0, "precomputed": 0, "upserted": 0, "deleted": 0}
+    embed_lat: List[float] = []
+    upsert_lat: List[float] = []
+
+    # ограниченные очереди: быстрый ридер не раздувает память, пока эмбеддер догоняет
+    embed_q: "asyncio.Queue[Optional[List[Tuple[str, str, Dict[str, Any]]]]]" = asyncio.Queue(maxsize=QUEUE_SIZE)
+    upsert_q: "asyncio.Queue[Optional[List[PointStruct]]]" = asyncio.Queue(maxsize=QUEUE_SIZE * 2)
+    limiter = RateLimiter(EMBED_RPM)
+    loop = asyncio.get_running_loop()
+    t_start = loop.time()
+
+    async def read_stage():
+        # Идём по корпусу: для частей без готовых векторов — в очередь эмбеддинга; с готовыми — сразу в апсерт
+        pending: List[Tuple[str, str, Dict[str, Any]]] = []
+        for doc in iter_corpus():
+            stats["chunks"] += 1
+            doc["content_hash"] = content_hash(doc["text"])
+            pid = point_id_for(doc)
+            seen.add(pid)
+
+            if pid in existing:
+                stats["skipped"] += 1
+                continue
 
-    async def flush_with_embeddings():
-        nonlocal buffer_texts, buffer_payloads, points_batch
-        if not buffer_texts:
-            return
-        vectors = await embed_many(buffer_texts)
-        for vec, payload in zip(vectors, buffer_payloads):
-            pid = str(uuid.uuid4())
-            points_batch.append(PointStruct(id=pid, vector=vec, payload=payload))
-        buffer_texts, buffer_payloads = [], []
-
-        if len(points_batch) >= BATCH:
-            client.upsert(collection_name=QDRANT_COLLECTION, points=points_batch)
-            points_batch = []
-
-    async def flush_points_only():
-        nonlocal points_batch
-        if points_batch:
-            client.upsert(collection_name=QDRANT_COLLECTION, points=points_batch)
-            points_batch = []
-
-    # Идём по корпусу: для частей без готовых векторов — считаем; с готовыми — грузим сразу
-    for doc in iter_corpus():
-        payload = {
-            "text": doc["text"],
-            "title": doc.get("title"),
-            "source": doc.get("source"),
-            "lang": doc.get("lang", "ru"),
-            "tags": doc.get("tags", []),
-        }
-
-        if "embedding" in doc and isinstance(doc["embedding"], list):
-            points_batch.append(PointStruct(id=str(uuid.uuid4()), vector=doc["embedding"], payload=payload))
-            if len(points_batch) >= BATCH:
-                client.upsert(collection_name=QDRANT_COLLECTION, points=points_batch)
-                points_batch = []
-        else:
-            buffer_texts.append(doc["text"])
-            buffer_payloads.append(payload)
-            # крупнее батч на /embeddings = меньше overhead
-            if len(buffer_texts) >= 128:
-                await flush_with_embeddings()
-
-    await flush_with_embeddings()
-    await flush_points_only()
-    print("Ingest finished ✅")
+            payload = build_payload(doc)
+            if "embedding" in doc and isinstance(doc["embedding"], list):
+                stats["precomputed"] += 1
+                await upsert_q.put([PointStruct(id=pid, vector=doc["embedding"], payload=payload)])
+            else:
+                pending.append((pid, doc["text"], payload))
+                # крупнее батч на /embeddings = меньше overhead
+                if len(pending) >= EMBED_BATCH:
+                    await embed_q.put(pending)
+                    pending = []
+        if pending:
+            await embed_q.put(pending)
+
+    async def embed_worker():
+        while True:
+            batch = await embed_q.get()
+            if batch is None:
+                return
+            texts = [t for _, t, _ in batch]
+            await limiter.acquire(embed_requests_for(len(texts)))
+            t0 = loop.time()
+            vectors = await embed_many(texts)
+            embed_lat.append(loop.time() - t0)
+            stats["embedded"] += len(texts)
+            await upsert_q.put([
+                PointStruct(id=pid, vector=vec, payload=payload)
+                for (pid, _, payload), vec in zip(batch, vectors)
+            ])
+
+    async def upsert_points(points: List[PointStruct], wait: bool):
+        t0 = loop.time()
+        # wait=False: Qdrant подтверждает запись в WAL, индексация идёт в фоне
+        await asyncio.to_thread(client.upsert, collection_name=QDRANT_COLLECTION, points=points, wait=wait)
+        upsert_lat.append(loop.time() - t0)
+        stats["upserted"] += len(points)
+
+    async def upsert_stage():
+        buf: List[PointStruct] = []
+        while True:
+            points = await upsert_q.get()
+            if points is None:
+                # последний батч — с ожиданием, чтобы версия корпуса бампалась после применения всех точек
+                if buf:
+                    await upsert_points(buf, wait=True)
+                return
+            buf.extend(points)
+            while len(buf) >= BATCH:
+                head, buf = buf[:BATCH], buf[BATCH:]
+                await upsert_points(head, wait=UPSERT_WAIT)
+
+    async def run_pipeline():
+        await read_stage()
+        for _ in workers:
+            await embed_q.put(None)
+        await asyncio.gather(*workers)
+        await upsert_q.put(None)
+        await upserter
+
+    upserter = asyncio.create_task(upsert_stage())
+    workers = [asyncio.create_task(embed_worker()) for _ in range(EMBED_WORKERS)]
+    pipeline = asyncio.create_task(run_pipeline())
+    # падение любой стадии не должно оставить остальные висеть на полной очереди
+    tasks = [pipeline, upserter] + workers
+    done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    failed = [t for t in done if not t.cancelled() and t.exception() is not None]
+    if failed:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise failed[0].exception()
+
+    if INGEST_INCREMENTAL:
+        # точки, которых нет в корпусе: файл удалён, текст изменился или id от прежней схемы (uuid4)
+        removed = [pid for key, pid in existing.items() if key not in seen]
+        if removed and not stats["chunks"]:
+            # пустой корпус (не тот CORPUS_DIR?) — не сносим коллекцию целиком
+            print(f"[ingest] corpus is empty — skip deleting {len(removed)} points")
+            removed = []
+        for i in range(0, len(removed), 256):
+            part = removed[i:i + 256]
+            client.delete(collection_name=QDRANT_COLLECTION, points_selector=PointIdsList(points=part))
+            stats["deleted"] += len(part)
+
+    elapsed = max(1e-6, loop.time() - t_start)
+    ver = None
+    if stats["upserted"] or stats["deleted"]:
+        # новая версия корпуса → рантайм сбросит кэш RAG-контекстов
+        ver = bump_corpus_version(client, QDRANT_COLLECTION)
+    print(
+        f"Ingest finished ✅ corpus_version={ver} chunks={stats['chunks']} embedded={stats['embedded']} "
+        f"precomputed={stats['precomputed']} upserted={stats['upserted']} deleted={stats['deleted']} "
+        f"skipped={stats['skipped']} (unchanged chunks, not re-upserted)"
+    )
+    print(
+        f"[ingest] throughput: {stats['chunks'] / elapsed:.1f} chunks/s, {stats['upserted'] / elapsed:.1f} points/s "
+        f"in {elapsed:.1f}s | workers={EMBED_WORKERS} embed_batch={EMBED_BATCH} upsert_batch={BATCH} "
+        f"| embed p50={_pct(embed_lat, 0.5) * 1000:.0f}ms p95={_pct(embed_lat, 0.95) * 1000:.0f}ms "
+        f"({len(embed_lat)} calls) | upsert p50={_pct(upsert_lat, 0.5) * 1000:.0f}ms "
+        f"p95={_pct(upsert_lat, 0.95) * 1000:.0f}ms ({len(upsert_lat)} calls)"
+    )
 
 if __name__ == "__main__":
     asyncio.run(main())
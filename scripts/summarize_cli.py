@@ -36,7 +36,11 @@ async def _run():
         day = datetime.strptime(a.day, "%Y-%m-%d").replace(tzinfo=timezone.utc) if a.day else (now - timedelta(days=1))
         ids = [a.user_id] if a.user_id else await _all_user_ids()
         for uid in ids:
-            await make_daily(uid, day)
+            try:
+                await make_daily(uid, day)
+            except Exception as e:
+                # ошибка LLM одного пользователя не останавливает остальных
+                print(f"[{a.cmd}] user_id={uid} error: {e!r}")
 
     elif a.cmd == "weekly":
         monday = datetime.strptime(a.monday, "%Y-%m-%d").replace(tzinfo=timezone.utc) if a.monday else (
@@ -44,7 +48,11 @@ async def _run():
         )
         ids = [a.user_id] if a.user_id else await _all_user_ids()
         for uid in ids:
-            await rollup_weekly(uid, monday)
+            try:
+                await rollup_weekly(uid, monday)
+            except Exception as e:
+                # ошибка LLM одного пользователя не останавливает остальных
+                print(f"[{a.cmd}] user_id={uid} error: {e!r}")
 
     elif a.cmd == "monthly":
         if a.month:
@@ -57,7 +65,11 @@ async def _run():
                 month_start = datetime(now.year, now.month-1, 1, tzinfo=timezone.utc)
         ids = [a.user_id] if a.user_id else await _all_user_ids()
         for uid in ids:
-            await rollup_topic_month(uid, month_start)
+            try:
+                await rollup_topic_month(uid, month_start)
+            except Exception as e:
+                # ошибка LLM одного пользователя не останавливает остальных
+                print(f"[{a.cmd}] user_id={uid} error: {e!r}")
 
 if __name__ == "__main__":
     asyncio.run(_run())
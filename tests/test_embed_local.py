@@ -0,0 +1,42 @@
+import asyncio
+
+from app.embed_local import LocalEmbedder
+
+
+def _fake_encode(texts):
+    return [[float(len(t)), 1.0] for t in texts]
+
+
+def test_concurrent_single_requests_are_batched() -> None:
+    emb = LocalEmbedder(batch_size=8, batch_wait_ms=20, procs=0, encode_fn=_fake_encode)
+
+    async def run():
+        return await asyncio.gather(*(emb.aembed(["x" * i]) for i in range(1, 11)))
+
+    try:
+        res = asyncio.run(run())
+    finally:
+        emb.close()
+
+    assert [r[0][0] for r in res] == [float(i) for i in range(1, 11)]
+    assert emb.stats["texts"] == 10
+    assert emb.stats["batches"] == 2 and emb.stats["max_batch"] == 8
+
+
+def test_encode_error_propagates_to_waiters() -> None:
+    def boom(texts):
+        raise ValueError("model failed")
+
+    emb = LocalEmbedder(batch_wait_ms=0, encode_fn=boom)
+
+    async def run():
+        try:
+            await emb.aembed(["a"])
+        except ValueError as e:
+            return str(e)
+        return None
+
+    try:
+        assert asyncio.run(run()) == "model failed"
+    finally:
+        emb.close()
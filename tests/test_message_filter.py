@@ -0,0 +1,42 @@
+from app.services.message_filter import MessageFilter, filter_messages
+
+
+def test_drops_navigation_noise_and_double_logged_rows():
+    msgs = [
+        {"id": 1, "role": "user", "text": "/start"},
+        {"id": 2, "role": "user", "text": "💬 Поговорить"},
+        {"id": 3, "role": "user", "text": "Мне тревожно перед экзаменом"},
+        {"id": 4, "role": "user", "text": "Мне тревожно перед экзаменом"},  # двойное логирование
+        {"id": 5, "role": "bot", "text": "Понимаю. Что пугает сильнее всего?"},
+        {"id": 6, "role": "user", "text": "[cb] menu:main"},
+        {"id": 7, "role": "user", "text": "да"},
+        {"id": 8, "role": "bot", "text": "Хорошо."},
+        {"id": 9, "role": "user", "text": "/menu"},
+        {"id": 10, "role": "user", "text": "⚙️ Настройки"},
+        {"id": 11, "role": "user", "text": "/start как мне быть с сессией, если я не успеваю"},
+    ]
+    out, rep = filter_messages(msgs)
+
+    assert [m["id"] for m in out] == [3, 5, 7, 8, 11]
+    assert rep["callbacks"] == 1 and rep["commands"] == 2 and rep["menu"] == 2 and rep["exact_dups"] == 1
+    assert rep["messages_in"] == 11 and rep["messages_out"] == 5
+    assert rep["tokens_out"] < rep["tokens_in"] and rep["reduction"] > 0
+
+
+def test_near_duplicate_bot_templates_and_trim():
+    template = " ".join(f"слово{i}" for i in range(120))
+    long_reply = "Очень длинный ответ. " * 200
+    f = MessageFilter(bot_max_chars=300, menu_texts=["Мой пункт"])
+    fed = [
+        {"role": "bot", "text": template},
+        {"role": "user", "text": "ок"},
+        {"role": "user", "text": "Мой пункт 🌟"},
+        {"role": "bot", "text": template.replace("слово60", "другое")},
+        {"role": "bot", "text": long_reply},
+    ]
+    out = list(f.run(fed))
+
+    assert [m["text"][:6] for m in out] == ["слово0", "ок", "Очень "]
+    assert f.stats["near_dups"] == 1 and f.stats["menu"] == 1
+    assert out[-1]["text"].endswith(" …") and len(out[-1]["text"]) <= 302
+    assert f.stats["trimmed"] == 2  # шаблон тоже длиннее 300
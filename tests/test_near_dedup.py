@@ -0,0 +1,35 @@
+import random
+
+from app.services.near_dedup import NearDuplicateIndex, shingle_hashes
+
+
+def _text(seed: int, n: int = 200) -> str:
+    rnd = random.Random(seed)
+    return " ".join(f"слово{rnd.randint(0, 5000)}" for _ in range(n))
+
+
+def test_exact_duplicate_after_normalization():
+    idx = NearDuplicateIndex(threshold=0.85)
+    base = _text(1)
+    assert idx.check(base, "a") is None
+    assert idx.check("  " + base.upper() + "!!", "b") == ("a", 1.0)
+    assert idx.stats["exact_dups"] == 1
+
+
+def test_near_duplicate_detected_and_distinct_kept():
+    idx = NearDuplicateIndex(threshold=0.8)
+    base = _text(2).split()
+    assert idx.check(" ".join(base), "orig") is None
+
+    edited = list(base)
+    edited[100] = "другое"  # одна правка на 200 слов
+    dup = idx.check(" ".join(edited), "copy")
+    assert dup is not None and dup[0] == "orig" and dup[1] >= 0.8
+
+    assert idx.check(_text(3), "other") is None
+    assert idx.stats["kept"] == 2 and idx.stats["near_dups"] == 1
+
+
+def test_shingles_short_text():
+    assert shingle_hashes("").size == 0
+    assert shingle_hashes("два слова", k=5).size == 1
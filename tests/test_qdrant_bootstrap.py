@@ -47,3 +47,167 @@ def test_ensure_summaries_collection_creates_expected_indexes(monkeypatch) -> No
 
     assert qc.ensure_summaries_collection() is True
     assert [item["field_name"] for item in fake.created_indexes] == ["user_id", "kind"]
+
+
+def test_normalize_query_for_context_cache() -> None:
+    assert rq._normalize_query("  Мне  тревожно!!! ") == "мне тревожно"
+    assert rq._normalize_query("Ёжик, ёлка") == "ежик елка"
+
+
+def test_ctx_cache_lru_eviction(monkeypatch) -> None:
+    rq.invalidate_ctx_cache()
+    monkeypatch.setattr(rq, "RAG_CACHE_MAX_ITEMS", 2)
+    rq._cache_put(("a",), "ctx-a", [], 10.0)
+    rq._cache_put(("b",), "ctx-b", [], 10.0)
+    assert rq._cache_get(("a",)) is not None
+    rq._cache_put(("c",), "ctx-c", [], 10.0)
+    assert rq._cache_get(("b",)) is None
+    assert rq._cache_get(("a",))["ctx"] == "ctx-a"
+    rq.invalidate_ctx_cache()
+
+
+def test_qdrant_query_passes_payload_field_selector() -> None:
+    captured = {}
+
+    class _QueryClient:
+        def query_points(self, **kwargs):
+            captured.update(kwargs)
+            return []
+
+    qc.qdrant_query(
+        _QueryClient(),
+        collection_name="c",
+        query_vector=[0.1],
+        limit=3,
+        payload_fields=["text", "title"],
+    )
+    selector = captured["with_payload"]
+    assert list(getattr(selector, "include", selector)) == ["text", "title"]
+
+
+def test_sentence_offsets_trim_matches_regex_fallback() -> None:
+    chunk = "Первое предложение. Второе чуть длиннее! Третье? Четвёртое."
+    ends = qc.sentence_end_offsets(chunk)
+    assert [chunk[:e].rstrip()[-1] for e in ends] == [".", "!", "?", "."]
+
+    for need in (5, 20, 30, 45, 58):
+        fast = rq._trim_to_sentences(chunk, need, ends)
+        slow = rq._trim_to_sentences(chunk, need, None)
+        assert fast == slow
+
+    # битые offsets → fallback на регэксп
+    assert rq._trim_to_sentences(chunk, 30, [100]) == rq._trim_to_sentences(chunk, 30, None)
+
+
+def test_compress_context_deadline_falls_back_and_warms_cache(monkeypatch) -> None:
+    import asyncio
+
+    async def slow_call(ctx, query, *, max_chars):
+        await asyncio.sleep(0.05)
+        return "сжато"
+
+    monkeypatch.setattr(rq, "RAG_COMPRESS", True)
+    monkeypatch.setattr(rq, "RAG_COMPRESS_TIMEOUT_SEC", 0.01)
+    monkeypatch.setattr(rq, "_compress_call", slow_call)
+    rq._COMPRESS_CACHE.clear()
+
+    ctx = "длинный контекст " * 20
+
+    async def run():
+        first = await rq.compress_context(ctx, "как справиться с тревогой", max_chars=500, chunk_ids=["b", "a"])
+        await asyncio.sleep(0.1)  # фоновое сжатие досчиталось и легло в кэш
+        # тот же набор чанков, запрос из того же кластера
+        second = await rq.compress_context(ctx, "тревогой справиться как", max_chars=500, chunk_ids=["a", "b"])
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == ctx
+    assert second == "сжато"
+    assert rq.COMPRESS_STATS["timeouts"] >= 1 and rq.COMPRESS_STATS["cache_hits"] >= 1
+
+
+def test_ctx_cache_skips_uncompressed_result_after_timeout(monkeypatch) -> None:
+    import asyncio
+
+    ctx = "длинный контекст " * 20
+    retrievals = []
+
+    async def fake_build(query, **kwargs):
+        retrievals.append(query)
+        return ctx, [{"id": "a"}]
+
+    async def slow_call(ctx, query, *, max_chars):
+        await asyncio.sleep(0.05)
+        return "сжато"
+
+    async def fixed_version():
+        return "v1"
+
+    monkeypatch.setattr(rq, "RAG_COMPRESS", True)
+    monkeypatch.setattr(rq, "RAG_COMPRESS_TIMEOUT_SEC", 0.01)
+    monkeypatch.setattr(rq, "_compress_call", slow_call)
+    monkeypatch.setattr(rq, "build_context_mmr", fake_build)
+    monkeypatch.setattr(rq, "_corpus_version", fixed_version)
+    rq._COMPRESS_CACHE.clear()
+    rq._CTX_CACHE.clear()
+
+    async def run():
+        first, _ = await rq.search_with_meta("как уснуть", use_cache=True)
+        await asyncio.sleep(0.1)
+        second, _ = await rq.search_with_meta("как уснуть", use_cache=True)
+        third, _ = await rq.search_with_meta("как уснуть", use_cache=True)
+        return first, second, third
+
+    first, second, third = asyncio.run(run())
+    # несжатый ответ после таймаута не закрывает собой сжатый
+    assert first == ctx and second == "сжато" and third == "сжато"
+    assert len(retrievals) == 2
+
+
+def test_create_summaries_collection_tenant_layout() -> None:
+    fake = _FakeClient()
+    shard_keys = []
+    fake.create_shard_key = lambda name, key: shard_keys.append(key)
+
+    qc.create_summaries_collection(fake, "dialog_summaries_v2", layout="tenant", shards=2)
+
+    created = fake.created_collections[0]
+    assert created["hnsw_config"].m == 0 and created["hnsw_config"].payload_m == qc.QDRANT_SUMMARIES_PAYLOAD_M
+    assert created["sharding_method"] == qm.ShardingMethod.CUSTOM
+    assert shard_keys == ["u0", "u1"]
+    tenant_idx = [i for i in fake.created_indexes if i["field_name"] == "tenant_id"][0]
+    assert tenant_idx["field_schema"].is_tenant is True
+
+    cond = qc.summaries_user_condition(42, tenant=True)
+    assert cond.key == "tenant_id" and cond.match.value == "42"
+    assert qc.summaries_user_condition(42, tenant=False).key == "user_id"
+    assert qc.summaries_shard_key(42, shards=4) == "u2"
+    assert qc.summaries_shard_key(42, shards=0) is None
+
+
+def test_profile_search_params_and_query_passthrough() -> None:
+    assert qc.profile_search_params("default") is None
+    sp = qc.profile_search_params("binary", hnsw_ef=64)
+    assert sp.hnsw_ef == 64 and sp.quantization.rescore is True and sp.quantization.oversampling == 3.0
+
+    captured = {}
+
+    class _Q:
+        def query_points(self, **kwargs):
+            captured.update(kwargs)
+            return []
+
+    qc.qdrant_query(_Q(), collection_name="c", query_vector=[0.1], limit=3, search_params=sp)
+    assert captured["search_params"] is sp
+
+
+def test_create_corpus_collection_without_metadata_support() -> None:
+    calls = []
+
+    class _OldClient:
+        # qdrant-client < 1.16: аргумента metadata ещё нет
+        def create_collection(self, *, collection_name, vectors_config, hnsw_config, quantization_config):
+            calls.append(collection_name)
+
+    qc.create_corpus_collection(_OldClient(), "corpus", profile="default")
+    assert calls == ["corpus"]
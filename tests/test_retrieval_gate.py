@@ -0,0 +1,42 @@
+from app.services import retrieval_gate as rg
+
+
+def test_short_reply_skips_both_retrievers() -> None:
+    d = rg.decide_retrieval("ок", chat_id=None)
+    assert d["rag"] is False
+    assert d["summaries"] is False
+    assert d["reason"] == "short_reply"
+    assert rg.decide_retrieval("да, спасибо", chat_id=None)["summaries"] is False
+
+
+def test_regular_message_runs_retrieval() -> None:
+    d = rg.decide_retrieval("мне тревожно перед экзаменом и не получается уснуть", chat_id=101)
+    assert d["rag"] is True
+    assert d["summaries"] is True
+
+
+def test_overlap_with_last_context_reuses_it() -> None:
+    rg.remember_context(
+        202,
+        query="не могу уснуть из-за тревоги",
+        rag_ctx="Тревога перед сном: дыхание 4-7-8 помогает уснуть.",
+        sum_block="Заметки",
+    )
+    d = rg.decide_retrieval("опять тревога, не могу уснуть", chat_id=202)
+    assert d["reason"] == "overlap"
+    assert d["rag"] is False
+    assert d["reuse"] is True
+    assert rg.reused_context(202)["sum_block"] == "Заметки"
+
+
+def test_lexical_overlap_ignores_stopwords() -> None:
+    assert rg.lexical_overlap("и в на", "и в на") == 0.0
+    assert rg.lexical_overlap("тревога", "сильная тревога") == 1.0
+
+
+def test_short_meaningful_message_keeps_long_term_memory() -> None:
+    for text in ("мама умерла", "хочу умереть"):
+        d = rg.decide_retrieval(text, chat_id=None)
+        assert d["reason"] == "too_short"
+        assert d["rag"] is False
+        assert d["summaries"] is True
@@ -0,0 +1,237 @@
+import numpy as np
+
+from app import rag_summaries as rs
+
+
+def _entry(vecs, kinds):
+    items = [
+        {"summary_id": i + 1, "kind": k, "period_start": None, "period_end": None, "text": f"t{i + 1}"}
+        for i, k in enumerate(kinds)
+    ]
+    mat = np.asarray(vecs, dtype=np.float32)
+    mat = mat / np.linalg.norm(mat, axis=1, keepdims=True)
+    return {"items": items, "mat": mat, "bytes": int(mat.nbytes), "expires_at": float("inf")}
+
+
+def test_rank_local_orders_by_cosine_and_filters_kinds() -> None:
+    entry = _entry([[1.0, 0.0], [0.7, 0.7], [0.0, 1.0]], ["daily", "weekly", "daily"])
+    out = rs._rank_local(entry, [1.0, 0.1], top_k=2, kinds=None)
+    assert [x["summary_id"] for x in out] == [1, 2]
+    out = rs._rank_local(entry, [1.0, 0.1], top_k=2, kinds=["daily"])
+    assert [x["summary_id"] for x in out] == [1, 3]
+    assert out[0]["text"] == "t1"
+
+
+def test_cache_remembers_users_without_summaries_and_invalidates() -> None:
+    rs.invalidate_user_summaries_cache()
+    rs._cache_store(7, {"items": [], "mat": np.zeros((0, 0), dtype=np.float32), "bytes": 0, "expires_at": float("inf")})
+    assert rs._cache_lookup(7) is not None
+    rs.invalidate_user_summaries_cache(7)
+    assert rs._cache_lookup(7) is None
+
+
+class _Point:
+    def __init__(self, pid, payload):
+        self.id = pid
+        self.score = 0.5
+        self.payload = payload
+
+
+def test_search_summaries_returns_payload_text(monkeypatch) -> None:
+    captured = {}
+
+    def fake_query(client, **kwargs):
+        captured.update(kwargs)
+        return [_Point(1, {"kind": "daily", "raw": "текст", "period_start": "2025-01-01T00:00:00+00:00"}), _Point(2, {"kind": "daily"})]
+
+    async def fake_embed(text):
+        return [0.1, 0.2]
+
+    monkeypatch.setattr(rs, "_ensure_collection", lambda: None)
+    monkeypatch.setattr(rs, "get_client", lambda: object())
+    monkeypatch.setattr(rs, "detect_vector_name", lambda client, name: ("single", None))
+    monkeypatch.setattr(rs, "qdrant_query", fake_query)
+    monkeypatch.setattr(rs, "_maybe_embed", fake_embed)
+
+    import asyncio
+    out = asyncio.run(rs.search_summaries(user_id=5, query="q", top_k=2, with_text=True))
+    assert captured["payload_fields"] == ["kind", "period_start", "period_end", "raw"]
+    assert out[0]["text"] == "текст"
+    assert out[1]["text"] is None
+
+
+def test_upsert_summary_points_bulk_batches_and_falls_back(monkeypatch) -> None:
+    from datetime import datetime, timezone
+
+    embed_calls = []
+    upserts = []
+
+    async def fake_embed_many(texts):
+        embed_calls.append(len(texts))
+        return [[0.1, 0.2] for _ in texts]
+
+    class _Client:
+        def upsert(self, *, collection_name, points, wait, **kwargs):
+            # первый формат (named) «не подходит» коллекции — должен сработать фолбэк на single
+            if isinstance(points[0].vector, dict):
+                raise RuntimeError("wrong vector format")
+            upserts.append((len(points), wait))
+
+    monkeypatch.setattr(rs, "_ensure_collection", lambda: None)
+    monkeypatch.setattr(rs, "get_client", lambda: _Client())
+    monkeypatch.setattr(rs, "detect_vector_name", lambda client, name: ("named", "default"))
+    monkeypatch.setattr(rs, "_maybe_embed_many", fake_embed_many)
+    monkeypatch.setattr(rs, "summaries_shard_key", lambda uid, shards=None: None)
+    marked = []
+
+    async def fake_mark(items):
+        marked.extend(it["summary_id"] for it in items)
+
+    monkeypatch.setattr(rs, "mark_summaries_indexed", fake_mark)
+
+    day = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    items = [
+        {"summary_id": i, "user_id": i % 3, "kind": "daily", "text": f"саммари {i}", "period_start": day, "period_end": day}
+        for i in range(1, 6)
+    ]
+
+    import asyncio
+    stats = asyncio.run(rs.upsert_summary_points_bulk(items, embed_batch=2, upsert_batch=3))
+    assert embed_calls == [2, 2, 1]
+    assert upserts == [(3, False), (2, True)]
+    assert stats["points"] == 5 and stats["upsert_calls"] == 2
+    # indexed_at отмечается только после записи точек
+    assert marked == [1, 2, 3, 4, 5]
+
+
+def test_summary_batch_keeps_points_when_flush_fails(monkeypatch) -> None:
+    import asyncio
+    from datetime import datetime, timezone
+
+    import pytest
+
+    calls = []
+    state = {"fail": True}
+
+    async def fake_bulk(items):
+        calls.append([it["summary_id"] for it in items])
+        if state["fail"]:
+            raise RuntimeError("qdrant down")
+        return {"points": len(items), "embed_calls": 1, "upsert_calls": 1}
+
+    monkeypatch.setattr(rs, "upsert_summary_points_bulk", fake_bulk)
+    day = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    batch = rs.SummaryBatch(flush_size=2)
+
+    async def add(i):
+        await batch.add(summary_id=i, user_id=i, kind="daily", text="t", period_start=day, period_end=day)
+
+    async def scenario():
+        await add(1)
+        # авто-flush на второй точке падает — обе точки остаются в буфере
+        with pytest.raises(RuntimeError):
+            await add(2)
+        assert batch.pending_ids() == [1, 2]
+        # следующая попытка — только через flush_size новых точек, а не на каждом add
+        await add(3)
+        assert len(calls) == 1
+        state["fail"] = False
+        await add(4)
+        assert calls[-1] == [1, 2, 3, 4] and batch.pending_ids() == []
+
+    asyncio.run(scenario())
+    assert batch.stats["errors"] == 1 and batch.stats["points"] == 4
+
+
+def test_migrate_summaries_collection_resumes_on_rerun(monkeypatch) -> None:
+    import asyncio
+
+    from qdrant_client import QdrantClient
+    from qdrant_client.http import models as qm
+
+    from app import qdrant_client as qc
+
+    client = QdrantClient(":memory:")
+    vname = qc.QDRANT_VECTOR_NAME or "default"
+    client.create_collection(
+        "src", vectors_config={vname: qm.VectorParams(size=qc.EMBED_DIM, distance=qm.Distance.COSINE)}
+    )
+    client.upsert("src", points=[
+        qm.PointStruct(id=i, vector={vname: [0.1] * qc.EMBED_DIM}, payload={"user_id": i, "kind": "daily"})
+        for i in range(1, 4)
+    ])
+    monkeypatch.setattr(rs, "get_client", lambda: client)
+    monkeypatch.setattr(rs, "SUMMARIES_COLLECTION", "src")
+
+    first = asyncio.run(rs.migrate_summaries_collection(target="dst", layout="tenant", batch=2))
+    # повторный запуск (например, после обрыва) не падает на «already exists»
+    second = asyncio.run(rs.migrate_summaries_collection(target="dst", layout="tenant", batch=2))
+
+    assert first["created"] == 1 and second["created"] == 0
+    assert first["moved"] == second["moved"] == 3
+    assert client.count("dst").count == 3
+    assert client.retrieve("dst", ids=[2])[0].payload["tenant_id"] == "2"
+
+    # чужая раскладка (без именованного вектора) — явная ошибка, а не молчаливый перенос
+    import pytest
+
+    client.create_collection("bad", vectors_config=qm.VectorParams(size=qc.EMBED_DIM, distance=qm.Distance.COSINE))
+    with pytest.raises(ValueError):
+        asyncio.run(rs.migrate_summaries_collection(target="bad", layout="tenant"))
+
+
+def test_delete_user_summaries_resets_indexed_marker(monkeypatch) -> None:
+    import asyncio
+
+    deleted = []
+    stmts = []
+
+    class _Client:
+        def delete(self, *, collection_name, points_selector):
+            deleted.append(collection_name)
+
+    class _Session:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        async def execute(self, stmt, params):
+            stmts.append((str(stmt), params))
+
+        async def commit(self):
+            pass
+
+    monkeypatch.setattr(rs, "_ensure_collection", lambda: None)
+    monkeypatch.setattr(rs, "get_client", lambda: _Client())
+    monkeypatch.setattr("app.db.core.async_session", lambda: _Session())
+
+    asyncio.run(rs.delete_user_summaries(5))
+
+    # точки удалены — /rebuild должен их переписать, а не счесть дни актуальными
+    assert deleted == [rs.SUMMARIES_COLLECTION]
+    assert "SET indexed_at = NULL" in stmts[0][0] and stmts[0][1] == {"uid": 5}
+
+
+def test_backfill_dry_run_counts_would_update(monkeypatch) -> None:
+    import asyncio
+    from types import SimpleNamespace
+
+    written = []
+
+    def fake_scroll(client, *, limit, offset):
+        return [SimpleNamespace(id=1), SimpleNamespace(id=2)], None
+
+    async def fake_rows(ids):
+        return {1: {"text": "итог дня", "period_start": None, "period_end": None}}
+
+    monkeypatch.setattr(rs, "_ensure_collection", lambda: None)
+    monkeypatch.setattr(rs, "get_client", lambda: object())
+    monkeypatch.setattr(rs, "_scroll_points_without_raw", fake_scroll)
+    monkeypatch.setattr(rs, "_fetch_summary_rows", fake_rows)
+    monkeypatch.setattr(rs, "_set_payloads", lambda client, payloads: written.append(payloads))
+
+    stats = asyncio.run(rs.backfill_summary_payloads(dry_run=True))
+    assert stats["would_update"] == 1 and stats["updated"] == 0 and stats["missing_in_db"] == 1
+    assert written == []
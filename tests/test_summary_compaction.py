@@ -0,0 +1,99 @@
+import asyncio
+from datetime import datetime, timezone
+
+from app import summary_compaction as sc
+
+
+def test_parse_retention_and_candidate_sql(monkeypatch) -> None:
+    assert sc.parse_retention("daily=30, weekly=0, monthly=5, junk") == {"daily": 30, "weekly": 0}
+    assert sc.parse_retention("") == sc.DEFAULT_RETENTION
+
+    calls = []
+
+    class _Res:
+        def mappings(self):
+            return self
+
+        def all(self):
+            return [{"id": 11, "user_id": 1, "kind": "daily"}]
+
+    class _Session:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        async def execute(self, stmt, params):
+            calls.append((str(stmt), params))
+            return _Res()
+
+    monkeypatch.setattr(sc, "async_session", lambda: _Session())
+    now = datetime(2025, 6, 1, tzinfo=timezone.utc)
+    rows = asyncio.run(sc.select_compactable({"daily": 30, "weekly": 0}, now, after_id=5))
+
+    assert rows == [{"id": 11, "user_id": 1, "kind": "daily"}]
+    stmt, params = calls[0]
+    # weekly с нулевым сроком не компактится; обязательна проверка покрытия monthly
+    assert "d.kind = 'daily'" in stmt and "d.kind = 'weekly'" not in stmt
+    assert "m.kind IN ('monthly','topic')" in stmt
+    assert params["cut_daily"] == datetime(2025, 5, 2, tzinfo=timezone.utc) and params["after"] == 5
+    assert asyncio.run(sc.select_compactable({"daily": 0, "weekly": 0}, now)) == []
+    assert len(calls) == 1
+
+
+def test_run_compaction_qdrant_first_and_per_user_report(monkeypatch) -> None:
+    pages = [
+        [{"id": 1, "user_id": 7, "kind": "daily"}, {"id": 2, "user_id": 7, "kind": "weekly"}, {"id": 3, "user_id": 8, "kind": "daily"}],
+        [{"id": 4, "user_id": 9, "kind": "daily"}],
+        [{"id": 5, "user_id": 7, "kind": "daily"}],
+    ]
+    events = []
+
+    async def fake_select(retention, now, *, user_ids=None, after_id=0, limit=0):
+        return pages.pop(0) if pages else []
+
+    async def fake_delete_points(by_user):
+        events.append(("qdrant", sorted(by_user)))
+        if 9 in by_user:
+            raise RuntimeError("qdrant down")
+        return sum(len(v) for v in by_user.values())
+
+    async def fake_archive(ids, run_id):
+        events.append(("db", ids))
+        return ids
+
+    monkeypatch.setattr(sc, "select_compactable", fake_select)
+    monkeypatch.setattr(sc, "delete_summary_points", fake_delete_points)
+    monkeypatch.setattr(sc, "archive_and_delete", fake_archive)
+
+    res = asyncio.run(sc.run_compaction(retention={"daily": 1, "weekly": 1}))
+
+    # пачка с упавшим Qdrant не трогает Postgres
+    assert events == [("qdrant", [7, 8]), ("db", [1, 2, 3]), ("qdrant", [9]), ("qdrant", [7]), ("db", [5])]
+    assert res["candidates"] == 5 and res["points_removed"] == 4 and res["archived"] == 4
+    assert res["qdrant_errors"] == 1
+    assert res["per_user"] == [
+        {"user_id": 7, "daily": 2, "weekly": 1, "total": 3},
+        {"user_id": 8, "daily": 1, "weekly": 0, "total": 1},
+    ]
+
+
+def test_delete_user_summary_rows_includes_archive() -> None:
+    calls = []
+
+    class _Res:
+        rowcount = 4
+
+    class _Session:
+        async def execute(self, stmt, params):
+            calls.append((str(stmt), params))
+            return _Res()
+
+    assert asyncio.run(sc.delete_user_summary_rows(_Session(), 7)) == 4
+    # очистка памяти снимает и архивные копии, а не только живые саммари
+    assert [c[0] for c in calls] == [
+        "DELETE FROM dialog_summaries WHERE user_id = :uid",
+        "DELETE FROM dialog_summaries_archive WHERE user_id = :uid",
+    ]
+    assert all(c[1] == {"uid": 7} for c in calls)
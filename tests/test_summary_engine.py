@@ -0,0 +1,418 @@
+import asyncio
+from datetime import datetime, timezone
+
+from app import memory_summarizer as ms
+from app.services.rate_limit import TokenBucket
+from app.services.stage_metrics import StageMetrics
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.t = 0.0
+
+    def __call__(self) -> float:
+        return self.t
+
+
+def test_token_bucket_rate_and_adaptive_slowdown() -> None:
+    clock = _Clock()
+    b = TokenBucket(60, burst=2, clock=clock, cooldown_sec=3.0)
+    # два токена в запасе, третий — через секунду (60 rpm)
+    assert b._reserve(1) == 0.0
+    assert b._reserve(1) == 0.0
+    assert b._reserve(1) == 1.0
+
+    b.on_rate_limit()
+    assert b.rpm == 30.0
+    # пауза после 429 действует на всех, даже если токены есть
+    clock.t = 10.0
+    assert b._reserve(0) == 0.0
+    b.on_rate_limit()
+    assert b._reserve(0) == 3.0 and b.rpm == 15.0
+
+    for _ in range(100):
+        b.on_success()
+    assert b.rpm == 60.0
+
+    assert TokenBucket(0)._reserve(100) == 0.0
+
+
+def test_run_daily_pool_runs_users_concurrently(monkeypatch) -> None:
+    active = {"now": 0, "peak": 0}
+
+    async def fake_make_daily(uid, day, *, batch=None, privacy_checked=False, trace=None):
+        active["now"] += 1
+        active["peak"] = max(active["peak"], active["now"])
+        await asyncio.sleep(0.01)
+        active["now"] -= 1
+        if uid == 3:
+            raise RuntimeError("429 Too Many Requests")
+        if uid == 4:
+            raise ValueError("boom")
+        if uid == 5:
+            trace["outcome"] = "no_messages"
+            return None
+        # up_to_date возвращает прежний id, но ничего не пишет
+        trace["outcome"] = "up_to_date" if uid == 6 else "written"
+        return uid * 10
+
+    monkeypatch.setattr(ms, "make_daily", fake_make_daily)
+
+    async def batches():
+        yield [1, 2, 3]
+        yield [4, 5, 6, 7, 8]
+
+    counters = {}
+    day = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    res = asyncio.run(ms.run_daily_pool(batches(), day, concurrency=4, counters=counters))
+
+    assert res["status"] == "ok" and res["dispatched"] == 8 and res["users"] == 8
+    assert active["peak"] == 4
+    assert counters["checked_users"] == 8
+    assert counters["processed_users"] == 6 and counters["summaries_written"] == 4
+    assert counters["skip_up_to_date"] == 1 and counters["skip_no_messages"] == 1
+    assert counters["rate_limited"] == 1 and counters["errors"] == 1
+    assert len(res["slowest"]) == 5
+
+
+def test_run_daily_pool_does_not_count_unindexed_points(monkeypatch) -> None:
+    async def fake_make_daily(uid, day, *, batch=None, privacy_checked=False, trace=None):
+        await batch.add(summary_id=uid * 10, user_id=uid, kind="daily", text="t", period_start=day, period_end=day)
+        trace["outcome"] = "written"
+        return uid * 10
+
+    async def qdrant_down(items):
+        raise RuntimeError("qdrant down")
+
+    monkeypatch.setattr(ms, "make_daily", fake_make_daily)
+    monkeypatch.setattr("app.rag_summaries.upsert_summary_points_bulk", qdrant_down)
+
+    counters = {}
+    day = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    res = asyncio.run(ms.run_daily_pool([1, 2], day, concurrency=2, batch=ms.SummaryBatch(), counters=counters))
+
+    # строки записаны, точки нет — пользователи не засчитаны как written
+    assert counters["summaries_written"] == 0 and counters["index_errors"] == 2
+    assert res["index_failed_user_ids"] == [1, 2]
+
+
+def test_plan_daily_candidates_single_grouped_query(monkeypatch) -> None:
+    calls = []
+
+    class _Res:
+        def mappings(self):
+            return self
+
+        def all(self):
+            return [{"user_id": 7, "messages": 12, "bytes": 3400}, {"user_id": 3, "messages": 2, "bytes": 90}]
+
+    class _Session:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        async def execute(self, stmt, params):
+            calls.append((str(stmt), params))
+            return _Res()
+
+    monkeypatch.setattr(ms, "async_session", lambda: _Session())
+    day = datetime(2025, 1, 1, 15, tzinfo=timezone.utc)
+
+    out = asyncio.run(ms.plan_daily_candidates(day, user_ids=[3, 7]))
+    assert [c["user_id"] for c in out] == [7, 3] and out[0]["bytes"] == 3400
+    assert len(calls) == 1
+    stmt, params = calls[0]
+    assert "GROUP BY m.user_id" in stmt and "privacy_level" in stmt and "ANY(:uids)" in stmt
+    assert params["st"] == datetime(2025, 1, 1, tzinfo=timezone.utc) and params["uids"] == [3, 7]
+
+    assert asyncio.run(ms.plan_daily_candidates(day, user_ids=[])) == []
+    assert len(calls) == 1
+
+
+def test_make_daily_incremental_folds_only_new_messages(monkeypatch) -> None:
+    writes = []
+
+    class _Res:
+        def __init__(self, row):
+            self.row = row
+
+        def mappings(self):
+            return self
+
+        def first(self):
+            return self.row
+
+        def scalar_one(self):
+            return 55
+
+    class _Session:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        async def execute(self, stmt, params):
+            if "SELECT id, text, source_count, source_last_id" in str(stmt):
+                return _Res({"id": 55, "text": "старое саммари", "source_count": 10, "source_last_id": 900, "indexed_at": day})
+            # запись — один INSERT ... ON CONFLICT ... RETURNING id
+            assert "ON CONFLICT (user_id, kind, period_start, period_end)" in str(stmt)
+            writes.append(params)
+            return _Res(None)
+
+        async def commit(self):
+            pass
+
+    fetched = []
+
+    async def fake_fetch(uid, start, end, *, after_id=None, report=None):
+        fetched.append(after_id)
+        return [{"id": 901, "role": "user", "text": "новое"}, {"id": 905, "role": "bot", "text": "ответ"}]
+
+    prompts = []
+
+    async def fake_update(prev_text, new_messages):
+        prompts.append((prev_text, [m["id"] for m in new_messages]))
+        return "обновлённое саммари"
+
+    async def full_not_expected(msgs):
+        raise AssertionError("full re-summarisation must not run")
+
+    stored = []
+
+    async def fake_store(batch, **point):
+        stored.append(point)
+
+    monkeypatch.setattr(ms, "async_session", lambda: _Session())
+    monkeypatch.setattr(ms, "_fetch_raw_messages", fake_fetch)
+    monkeypatch.setattr(ms, "_llm_update_summary", fake_update)
+    monkeypatch.setattr(ms, "_llm_summarize", full_not_expected)
+    monkeypatch.setattr(ms, "_store_point", fake_store)
+    monkeypatch.setattr(ms, "SUMMARY_INCREMENTAL", True)
+
+    day = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    ds_id = asyncio.run(ms.make_daily(5, day, privacy_checked=True))
+
+    assert ds_id == 55
+    assert fetched == [900]
+    assert prompts == [("старое саммари", [901, 905])]
+    assert writes[-1]["last"] == 905 and writes[-1]["cnt"] == 12
+    assert stored[0]["text"] == "обновлённое саммари"
+
+
+def test_make_daily_restores_point_lost_after_checkpoint(monkeypatch) -> None:
+    day = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    row = {"id": 55, "text": "старое саммари", "source_count": 10, "source_last_id": 900, "indexed_at": None}
+
+    class _Res:
+        def mappings(self):
+            return self
+
+        def first(self):
+            return row
+
+    class _Session:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        async def execute(self, stmt, params):
+            assert "SELECT id, text, source_count, source_last_id, indexed_at" in str(stmt)
+            return _Res()
+
+    async def no_new_messages(uid, start, end, *, after_id=None, report=None):
+        return []
+
+    async def llm_not_expected(*args):
+        raise AssertionError("no LLM call without new messages")
+
+    stored = []
+
+    async def fake_store(batch, **point):
+        stored.append(point)
+
+    monkeypatch.setattr(ms, "async_session", lambda: _Session())
+    monkeypatch.setattr(ms, "_fetch_raw_messages", no_new_messages)
+    monkeypatch.setattr(ms, "_llm_update_summary", llm_not_expected)
+    monkeypatch.setattr(ms, "_llm_summarize", llm_not_expected)
+    monkeypatch.setattr(ms, "_store_point", fake_store)
+    monkeypatch.setattr(ms, "SUMMARY_INCREMENTAL", True)
+
+    # чекпоинт есть, а точки нет (прошлый flush упал) — точка пишется заново из сохранённого текста
+    trace = {}
+    assert asyncio.run(ms.make_daily(5, day, privacy_checked=True, trace=trace)) == 55
+    assert trace["outcome"] == "reindexed"
+    assert stored == [{"summary_id": 55, "user_id": 5, "kind": "daily", "text": "старое саммари",
+                       "period_start": day, "period_end": datetime(2025, 1, 2, tzinfo=timezone.utc)}]
+
+    # точка подтверждена — честный up_to_date без записи
+    row["indexed_at"] = day
+    trace = {}
+    asyncio.run(ms.make_daily(5, day, privacy_checked=True, trace=trace))
+    assert trace["outcome"] == "up_to_date" and len(stored) == 1
+
+
+def test_llm_rate_limit_propagates_out_of_daily(monkeypatch) -> None:
+    async def rate_limited(msgs, *, max_completion_tokens):
+        raise RuntimeError("429 Too Many Requests")
+
+    monkeypatch.setattr(ms, "_complete_limited", rate_limited)
+    msgs = [{"role": "user", "text": "слово " * 50} for _ in range(40)]
+
+    # 429 не превращается в «пустое саммари»: джоб/пул должны повторить день
+    for mode in ("single", "mapreduce"):
+        try:
+            asyncio.run(ms._llm_summarize(msgs, mode=mode))
+        except RuntimeError as e:
+            assert "429" in str(e)
+        else:
+            raise AssertionError(f"{mode}: LLM error was swallowed")
+
+
+def test_mapreduce_returns_none_when_a_chunk_fails(monkeypatch) -> None:
+    calls = {"n": 0}
+
+    async def flaky(msgs, *, max_completion_tokens):
+        calls["n"] += 1
+        return "" if calls["n"] == 1 else "часть"
+
+    monkeypatch.setattr(ms, "_complete_limited", flaky)
+    msgs = [{"role": "user", "text": "слово " * 50} for _ in range(40)]
+    st: dict = {}
+    out = asyncio.run(ms._llm_summarize(msgs, mode="mapreduce", stats=st))
+    assert out is None
+    assert st["chunks"] > 1 and st["map_failed"] == 1
+
+
+def test_split_token_chunks_balanced_and_ordered() -> None:
+    msgs = [{"role": "user", "text": "х" * 297} for _ in range(25)]  # ~100 токенов на реплику
+    chunks = ms.split_token_chunks(msgs, 1000)
+    # 2500 токенов при цели 1000 → 3 куска примерно поровну, а не 1000/1000/500
+    sizes = [len(c) for c in chunks]
+    assert len(sizes) == 3 and max(sizes) - min(sizes) <= 1
+    assert sum(chunks, []) == msgs
+
+    huge = [{"role": "user", "text": "я" * 10000}]
+    assert ms.estimate_tokens(ms._msg_line(ms.split_token_chunks(huge, 500)[0][0])) <= 510
+
+
+def test_llm_summarize_mapreduce_stages(monkeypatch) -> None:
+    calls = []
+
+    async def fake_complete(msgs, *, max_completion_tokens):
+        prompt = msgs[-1]["content"]
+        kind = "reduce" if prompt.startswith("Ниже частичные") else "map"
+        calls.append(kind)
+        await asyncio.sleep(0)
+        return f"{kind}-out"
+
+    monkeypatch.setattr(ms, "_complete_limited", fake_complete)
+    monkeypatch.setattr(ms, "SUMMARY_SINGLE_SHOT_MAX_TOKENS", 1500)
+    monkeypatch.setattr(ms, "SUMMARY_CHUNK_TOKENS", 1000)
+
+    msgs = [{"role": "user", "text": "слово " * 50} for _ in range(40)]  # ~4000 токенов
+    st = {}
+    out = asyncio.run(ms._llm_summarize(msgs, stats=st))
+
+    assert out == "reduce-out"
+    assert st["mode"] == "mapreduce" and st["chunks"] == calls.count("map") >= 4
+    assert calls[-1] == "reduce" and calls.count("reduce") == 1
+    assert "map_ms" in st and "reduce_ms" in st and st["input_tokens"] > 1500
+
+    calls.clear()
+    st = {}
+    asyncio.run(ms._llm_summarize(msgs[:3], stats=st))
+    assert st["mode"] == "single" and calls == ["map"]  # один промпт без reduce
+
+
+def test_rollup_bulk_streams_sources_and_batches_writes(monkeypatch) -> None:
+    rows = [
+        {"user_id": 1, "kind": "daily", "text": "d1"},
+        {"user_id": 1, "kind": "weekly", "text": "w1"},
+        {"user_id": 1, "kind": "weekly", "text": "w2"},
+        {"user_id": 2, "kind": "daily", "text": "d2"},
+        {"user_id": 3, "kind": "topic", "text": "t3"},
+        {"user_id": 4, "kind": "daily", "text": "пусто"},
+    ]
+    queries = []
+
+    class _Stream:
+        def mappings(self):
+            return self
+
+        async def __aiter__(self):
+            for r in rows:
+                yield r
+
+    class _Session:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        async def stream(self, stmt, params):
+            queries.append((str(stmt), params))
+            return _Stream()
+
+    prompts = {}
+
+    async def fake_rollup_llm(kind, joined):
+        await asyncio.sleep(0)
+        uid = {"- w1\n\n- w2": 1, "- d2": 2, "- t3": 3}.get(joined)
+        prompts[uid] = joined
+        return "" if uid is None else f"m{uid}"
+
+    writes = []
+
+    async def fake_upsert(kind, start, end, chunk):
+        writes.append([r[0] for r in chunk])
+        return {uid: 100 + uid for uid, _, _ in chunk}
+
+    points = []
+
+    async def fake_points_bulk(items):
+        points.extend(items)
+        return {"points": len(items)}
+
+    monkeypatch.setattr(ms, "async_session", lambda: _Session())
+    monkeypatch.setattr(ms, "_rollup_llm", fake_rollup_llm)
+    monkeypatch.setattr(ms, "_upsert_rollups", fake_upsert)
+    monkeypatch.setattr("app.rag_summaries.upsert_summary_points_bulk", fake_points_bulk)
+
+    month = datetime(2025, 2, 1, tzinfo=timezone.utc)
+    res = asyncio.run(ms.rollup_bulk("monthly", month, concurrency=3, write_batch=2))
+
+    # один потоковый запрос на всех, weekly важнее daily, topic — последний фолбэк
+    assert len(queries) == 1 and queries[0][1]["kinds"] == ["weekly", "daily", "topic"]
+    assert prompts[1] == "- w1\n\n- w2"
+    assert res["users"] == 4 and res["written"] == 3 and res["empty"] == 1
+    assert sorted(sum(writes, [])) == [1, 2, 3] and all(len(w) <= 2 for w in writes)
+    assert res["db_writes"] == len(writes) == 2
+    assert sorted(p["summary_id"] for p in points) == [101, 102, 103]
+    assert all(p["kind"] == "monthly" and p["period_end"] == datetime(2025, 3, 1, tzinfo=timezone.utc) for p in points)
+
+
+def test_stage_metrics_histograms_and_counters() -> None:
+    m = StageMetrics(bounds=(10, 100))
+    for v in (1, 5, 50, 500):
+        m.observe("llm", v)
+    with m.time("fetch"):
+        pass
+    m.incr("daily_written")
+    m.incr("daily_up_to_date", 2)
+
+    snap = m.snapshot()
+    llm = snap["stages"]["llm"]
+    assert llm["count"] == 4 and llm["max_ms"] == 500.0
+    assert llm["buckets"] == [[10, 2], [100, 1], ["+Inf", 1]]
+    assert llm["p50_ms"] in (5.0, 50.0) and llm["p95_ms"] == 500.0
+    assert snap["stages"]["fetch"]["count"] == 1
+    assert snap["counters"] == {"daily_up_to_date": 2, "daily_written": 1}
+
+    m.reset()
+    assert m.snapshot()["stages"] == {} and m.snapshot()["counters"] == {}
@@ -0,0 +1,80 @@
+import asyncio
+
+from app import summary_jobs as sj
+
+
+def test_backoff_grows_and_is_capped(monkeypatch) -> None:
+    monkeypatch.setattr(sj.random, "random", lambda: 0.5)
+    monkeypatch.setattr(sj, "SUMMARY_TASK_BACKOFF_SEC", 10.0)
+    monkeypatch.setattr(sj, "SUMMARY_TASK_BACKOFF_MAX_SEC", 60.0)
+    assert [sj.backoff_delay(a) for a in (1, 2, 3, 4, 5)] == [10.0, 20.0, 40.0, 60.0, 60.0]
+
+
+def test_run_job_worker_acks_after_flush_and_retries(monkeypatch) -> None:
+    queue = [{"id": i, "user_id": 100 + i, "attempts": 1} for i in range(1, 7)]
+    events = []
+
+    async def fake_load_job(job_id):
+        return {"id": job_id, "kind": "daily", "target_key": "2025-01-01"}
+
+    async def fake_claim(job_id, worker_id, *, limit=1, lease_sec=0):
+        return [queue.pop(0)] if queue else []
+
+    async def fake_handler(uid, period, batch, trace):
+        await asyncio.sleep(0)
+        if uid == 103:
+            raise RuntimeError("429 Too Many Requests")
+        if uid == 105:
+            trace["outcome"] = "no_messages"
+            return None
+        if uid == 106:
+            trace["outcome"] = "llm_empty"
+            return None
+        await batch.add(summary_id=uid * 10, user_id=uid, kind="daily", text="t", period_start=period, period_end=period)
+        trace["outcome"] = "written"
+        return uid * 10
+
+    async def fake_bulk(items):
+        events.append(("upsert", sorted(it["summary_id"] for it in items)))
+        return {"points": len(items)}
+
+    outcomes = {}
+
+    async def fake_complete(done, worker_id):
+        events.append(("done", sorted(d[0] for d in done)))
+        outcomes.update({d[0]: d[3] for d in done})
+
+    async def fake_fail(task_id, worker_id, *, attempts, error, duration_ms):
+        events.append(("fail", task_id))
+        return "retry"
+
+    async def noop(*a, **kw):
+        return None
+
+    monkeypatch.setattr(sj, "_load_job", fake_load_job)
+    monkeypatch.setattr(sj, "claim_tasks", fake_claim)
+    monkeypatch.setattr(sj, "complete_tasks", fake_complete)
+    monkeypatch.setattr(sj, "fail_task", fake_fail)
+    monkeypatch.setattr(sj, "heartbeat", noop)
+    monkeypatch.setattr(sj, "_next_pending_in", noop)
+    monkeypatch.setattr(sj, "finalize_job", noop)
+    monkeypatch.setattr(sj, "upsert_summary_points_bulk", fake_bulk)
+    monkeypatch.setitem(sj.TASK_HANDLERS, "daily", fake_handler)
+    monkeypatch.setattr(sj, "SUMMARY_UPSERT_BATCH", 100)
+
+    stats = asyncio.run(sj.run_job_worker("daily-x", concurrency=2, worker_id="w1"))
+
+    assert ("fail", 3) in events
+    # пустой ответ LLM — повтор, а не done
+    assert ("fail", 6) in events
+    # задачи с точками подтверждаются только после записи их точек в Qdrant
+    upserted = set()
+    for kind, payload in events:
+        if kind == "upsert":
+            upserted |= {sid // 10 - 100 for sid in payload}
+        if kind == "done":
+            assert {t for t in payload if t != 5} <= upserted
+    done = sorted(t for kind, payload in events if kind == "done" for t in payload)
+    assert done == [1, 2, 4, 5]
+    assert outcomes == {1: "written", 2: "written", 4: "written", 5: "no_messages"}
+    assert stats["done"] == 4 and stats["retry"] == 2 and stats["rate_limited"] == 1